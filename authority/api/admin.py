@@ -3,7 +3,7 @@
 from django.contrib import admin
 
 from .forms import FlightAdminForm, BookingAdminForm
-from .models import Airline, Airport, City, Country, Flight, Booking
+from .models import Airline, AirlineCircuit, Airport, City, Country, Flight, Booking, OutboxMessage
 
 
 class ReadOnly(admin.ModelAdmin):
@@ -56,3 +56,5 @@ admin.site.register(City, ReadOnly)
 admin.site.register(Country, ReadOnly)
 admin.site.register(Booking, BookingAdmin)
 admin.site.register(Flight, FlightAdmin)
+admin.site.register(OutboxMessage, ReadOnly)
+admin.site.register(AirlineCircuit, ReadOnly)
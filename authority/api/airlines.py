@@ -0,0 +1,212 @@
+"""This module contains the HTTP clients used to talk to the airline servers.
+
+Each airline address gets its own session with a pool of keep-alive
+connections, so notifications to the same airline reuse open TCP
+connections instead of connecting for every booking. The pools report how
+many requests were served by a reused connection and how many had to open
+a new one. AsyncAirlineClient does the same for code running on an event
+loop, where one thread can wait on many slow airlines at once.
+"""
+
+import threading
+from collections import defaultdict
+from urllib.parse import urlencode
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import timed
+
+
+class AirlineClient:
+    """Pooled keep-alive HTTP sessions, one per airline address."""
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        """Creates the client.
+
+        Args:
+            pool_size (int, optional): Connections kept open per airline. Defaults to AIRLINE_POOL_SIZE.
+            connect_timeout (float, optional): Seconds to wait for a connection. Defaults to AIRLINE_CONNECT_TIMEOUT.
+            read_timeout (float, optional): Seconds to wait for a response. Defaults to AIRLINE_READ_TIMEOUT.
+        """
+
+        self.pool_size = pool_size or settings.AIRLINE_POOL_SIZE
+        self.connect_timeout = connect_timeout or settings.AIRLINE_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.AIRLINE_READ_TIMEOUT
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_session(self, ip):
+        """Gets the session of an airline, creating it on first use.
+
+        Args:
+            ip (str): The address of the airline server.
+
+        Returns:
+            Session: The session.
+        """
+
+        session = self.sessions.get(ip)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(ip)
+                if session is None:
+                    session = requests.Session()
+                    # Block rather than open throwaway connections when every pooled one is busy
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self.sessions[ip] = session
+
+        return session
+
+    def request(self, method, ip, path, data=None, timeout=None):
+        """Sends a request to an airline server.
+
+        Args:
+            method (str): The HTTP method.
+            ip (str): The address of the airline server.
+            path (str): The path, including any query string.
+            data (dict, optional): The form data. Defaults to None.
+            timeout (float, optional): Seconds to wait for a response. Defaults to the read timeout.
+
+        Returns:
+            Response: The response.
+
+        Raises:
+            RequestException: If the airline cannot be reached.
+        """
+
+        with timed('airline'):
+            return self.get_session(ip).request(
+                method, f'http://{ip}{path}', data=data,
+                timeout=(self.connect_timeout, timeout or self.read_timeout))
+
+    def stats(self):
+        """Reports the use of the connection pools.
+
+        Returns:
+            dict: For each airline address, the requests sent, the connections opened,
+                the requests that reused a connection and the connections idle in the pool.
+        """
+
+        report = {}
+        for ip, session in list(self.sessions.items()):
+            totals = {'requests': 0, 'connections': 0, 'reused': 0, 'idle': 0}
+            for adapter in set(session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    totals['requests'] += pool.num_requests
+                    totals['connections'] += pool.num_connections
+                    # Empty slots of the pool hold None
+                    totals['idle'] += sum(1 for conn in pool.pool.queue if conn is not None) if pool.pool else 0
+            totals['reused'] = totals['requests'] - totals['connections']
+            report[ip] = totals
+
+        return report
+
+    def close(self):
+        """Closes every pooled connection."""
+
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+airline_client = AirlineClient()
+
+
+class AsyncAirlineClient:
+    """Pooled keep-alive async HTTP clients, one per airline address.
+
+    The clients belong to the event loop they were created on, so an instance
+    should only be used from one loop.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        """Creates the client.
+
+        Args:
+            pool_size (int, optional): Connections kept open per airline. Defaults to AIRLINE_POOL_SIZE.
+            connect_timeout (float, optional): Seconds to wait for a connection. Defaults to AIRLINE_CONNECT_TIMEOUT.
+            read_timeout (float, optional): Seconds to wait for a response. Defaults to AIRLINE_READ_TIMEOUT.
+        """
+
+        self.pool_size = pool_size or settings.AIRLINE_POOL_SIZE
+        self.connect_timeout = connect_timeout or settings.AIRLINE_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.AIRLINE_READ_TIMEOUT
+        self.clients = {}
+        self.counts = defaultdict(lambda: {'requests': 0, 'connections': 0})
+
+    def get_client(self, ip):
+        """Gets the client of an airline, creating it on first use.
+
+        Args:
+            ip (str): The address of the airline server.
+
+        Returns:
+            AsyncClient: The client.
+        """
+
+        client = self.clients.get(ip)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            client = httpx.AsyncClient(base_url=f'http://{ip}', limits=limits)
+            self.clients[ip] = client
+
+        return client
+
+    async def request(self, method, ip, path, data=None, timeout=None):
+        """Sends a request to an airline server.
+
+        Args:
+            method (str): The HTTP method.
+            ip (str): The address of the airline server.
+            path (str): The path, including any query string.
+            data (dict, optional): The form data. Defaults to None.
+            timeout (float, optional): Seconds to wait for a response. Defaults to the read timeout.
+
+        Returns:
+            Response: The response.
+
+        Raises:
+            HTTPError: If the airline cannot be reached.
+        """
+
+        counts = self.counts[ip]
+
+        async def trace(event, info):
+            if event == 'connection.connect_tcp.complete':
+                counts['connections'] += 1
+
+        counts['requests'] += 1
+        # httpx only sends a form body with POST, PUT and PATCH, so encode it for DELETE too
+        content = urlencode(data) if data else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if data else None
+        with timed('airline'):
+            return await self.get_client(ip).request(
+                method, path, content=content, headers=headers, extensions={'trace': trace},
+                timeout=httpx.Timeout(timeout or self.read_timeout, connect=self.connect_timeout))
+
+    def stats(self):
+        """Reports the use of the connection pools.
+
+        Returns:
+            dict: For each airline address, the requests sent, the connections opened
+                and the requests that reused a connection.
+        """
+
+        return {ip: {**counts, 'reused': counts['requests'] - counts['connections']}
+                for ip, counts in self.counts.items()}
+
+    async def aclose(self):
+        """Closes every pooled connection."""
+
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
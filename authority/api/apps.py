@@ -1,6 +1,7 @@
 """This module configures the API app."""
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class APIConfig(AppConfig):
@@ -8,3 +9,12 @@ class APIConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        """Times the queries of the sampled requests and keeps the airport search index in sync."""
+
+        from .instrumentation import watch_connection
+        from .search import register_functions
+
+        connection_created.connect(watch_connection)
+        connection_created.connect(register_functions)
@@ -0,0 +1,155 @@
+"""This module contains async versions of the busiest Flight and Booking endpoints.
+
+Under ASGI these views wait on the database without holding a worker
+thread, so one worker can serve many requests at once. Django REST
+framework views are synchronous, so these are plain Django views that
+return the same data as their counterparts in views.py.
+"""
+
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .filters import FlightFilter
+from .models import Booking, Flight, NoSeatsAvailable
+from .pagination import FlightCursorPagination
+from .serializers import BookingSerializer, FlightSerializer
+from .views import get_fieldsets, get_param
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    """Renders data as a JSON response.
+
+    Args:
+        data (dict): The data.
+        status_code (int, optional): The HTTP status code. Defaults to 200.
+
+    Returns:
+        HttpResponse: The response.
+    """
+
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+class AsyncAPIView(View):
+    """Base class of the async endpoints."""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        """Creates the view function.
+
+        Returns:
+            callable: The view.
+        """
+
+        view = super().as_view(**initkwargs)
+        # Like the DRF views, the API does not use CSRF cookies. csrf_exempt cannot wrap async views yet.
+        view.csrf_exempt = True
+        return view
+
+    def get_request(self, request):
+        """Wraps the request to parse query parameters and bodies the way DRF does.
+
+        Args:
+            request (HttpRequest): The Django request.
+
+        Returns:
+            Request: The DRF request.
+        """
+
+        return Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+
+
+class AsyncFlightView(AsyncAPIView):
+    """Async version of the flights endpoint."""
+
+    async def get(self, request):
+        """
+        This API endpoint retrieves a specific flight or a page of flights, like GET /api/flights/.
+
+        Parameters:
+            request (HttpRequest): The Django request object.
+                Query parameters: The same as GET /api/flights/, including 'fields' and 'expand', except 'stream'.
+
+        Returns:
+            HttpResponse: The flight, or a page of flights with the URL of the next page.
+        """
+
+        request = self.get_request(request)
+        flight_code = get_param('flight_code', request)
+
+        try:
+            fields, expand = get_fieldsets(request, FlightSerializer)
+        except ValueError as error:
+            return render({"error": str(error)}, status.HTTP_400_BAD_REQUEST)
+
+        if flight_code:
+            flights = FlightSerializer.select_fields(Flight.objects.filter(flight_code=flight_code), fields, expand)
+            flight = await flights.afirst()
+            if not flight:
+                return render({"detail": f'Flight \'{flight_code}\' not found.'}, status.HTTP_404_NOT_FOUND)
+            return render(FlightSerializer(flight, fields=fields, expand=expand).data)
+
+        # Do not show flights with 0 available seats
+        flights = FlightFilter(request.GET, queryset=Flight.objects.all()).qs.filter(available_seats__gt=0)
+        flights = FlightSerializer.select_fields(flights, fields, expand, required=FlightCursorPagination.ordering)
+
+        paginator = FlightCursorPagination()
+        try:
+            page = await paginator.apaginate_queryset(flights, request)
+        except NotFound as error:
+            return render({"detail": str(error.detail)}, status.HTTP_404_NOT_FOUND)
+
+        if not page and paginator.position is None:
+            return render({"detail": "No flights available."}, status.HTTP_204_NO_CONTENT)
+
+        return render({
+            'next': paginator.get_next_link(),
+            'results': FlightSerializer(page, many=True, fields=fields, expand=expand).data,
+        })
+
+
+class AsyncBookingView(AsyncAPIView):
+    """Async version of the booking endpoint."""
+
+    async def post(self, request):
+        """
+        This API endpoint creates a new booking, like POST /api/bookings/.
+
+        Parameters:
+            request (HttpRequest): The Django request object.
+                Request body (JSON): The same as POST /api/bookings/.
+
+        Returns:
+            HttpResponse: The created booking with status 201, or an error with status 400, 404 or 409.
+        """
+
+        request = self.get_request(request)
+        booking_ref = get_param('booking_ref', request)
+        flight_code = get_param('flight', request)
+        passport_number = get_param('passport_number', request)
+
+        if booking_ref and await Booking.objects.filter(booking_ref=booking_ref).aexists():
+            return render({"error": f'Booking \'{booking_ref}\' already exists'}, status.HTTP_400_BAD_REQUEST)
+
+        flight = await Flight.objects.filter(flight_code=flight_code).afirst()
+        if not flight:
+            return render({"error": f'Flight \'{flight_code}\' not found'}, status.HTTP_404_NOT_FOUND)
+
+        if passport_number and await Booking.objects.filter(flight=flight, passport_number=passport_number).aexists():
+            return render({
+                "error": f'Booking already exists with flight \'{flight_code}\' and passport number \'{passport_number}\''},
+                status.HTTP_400_BAD_REQUEST)
+
+        # The seat, the booking and its airline notification are written in one
+        # transaction, which runs on a worker thread
+        try:
+            booking = await Booking.objects.acreate(passport_number=passport_number, flight=flight)
+        except NoSeatsAvailable as error:
+            return render({"error": str(error)}, status.HTTP_409_CONFLICT)
+
+        return render(BookingSerializer(booking).data, status.HTTP_201_CREATED)
@@ -0,0 +1,183 @@
+"""This module contains the prefix index behind the autocomplete endpoint.
+
+Every name is folded (lower case, no accents) and stored in one sorted
+array, once for the whole name and once for each later word, so "heath"
+finds "London Heathrow Airport". The matches for a prefix are then a
+contiguous slice found by binary search. Prefixes that match many names
+have their ranked results worked out when the index is built.
+"""
+
+import unicodedata
+from bisect import bisect_left
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .inmemory import InMemoryIndex
+from .models import Airport, City, Country
+
+MAX_SUGGESTIONS = 20
+# Prefixes matching more entries than this have their results precomputed
+PRECOMPUTE_THRESHOLD = 256
+
+TYPE_WEIGHTS = {
+    'country': 0,
+    'large_airport': 1,
+    'city': 2,
+    'medium_airport': 3,
+}
+OTHER_WEIGHT = 4
+
+
+def fold(text):
+    """Folds text for case- and accent-insensitive matching.
+
+    Args:
+        text (str): The text to fold.
+
+    Returns:
+        str: The folded text.
+    """
+
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class AutocompleteIndex:
+    """A sorted-array prefix index over airport, city and country names."""
+
+    def __init__(self, suggestions):
+        """Builds the index.
+
+        Args:
+            suggestions (iterable): (type, id, name, detail, weight, keys) for each suggestion,
+                where keys are the texts the suggestion should be found by.
+        """
+
+        self.suggestions = []
+        entries = []
+        for suggestion_type, ident, name, detail, weight, keys in suggestions:
+            number = len(self.suggestions)
+            self.suggestions.append({'type': suggestion_type, 'id': ident, 'name': name, 'detail': detail})
+            for key in keys:
+                folded = fold(key)
+                words = folded.split()
+                for position in range(len(words)):
+                    # Whole-name matches rank above matches on a later word
+                    rank = (min(position, 1), weight, len(name), name)
+                    entries.append((' '.join(words[position:]), rank, number))
+
+        entries.sort()
+        self.keys = [key for key, _, _ in entries]
+        self.entries = [(rank, number) for _, rank, number in entries]
+
+        self.precomputed = {}
+        self._precompute('', 0, len(self.keys))
+
+    @classmethod
+    def from_database(cls):
+        """Builds the index from the airports, cities and countries tables.
+
+        Returns:
+            AutocompleteIndex: The index.
+        """
+
+        def suggestions():
+            for name, continent in Country.objects.values_list('name', 'continent').iterator():
+                yield 'country', name, name, continent, TYPE_WEIGHTS['country'], [name]
+
+            cities = City.objects.values_list('id', 'name', 'country_id')
+            for ident, name, country in cities.iterator():
+                yield 'city', ident, name, country, TYPE_WEIGHTS['city'], [name]
+
+            airports = Airport.objects.values_list(
+                'ident', 'name', 'size_type', 'city__name', 'city__country_id')
+            for ident, name, size_type, city, country in airports.iterator():
+                weight = TYPE_WEIGHTS.get(size_type, OTHER_WEIGHT)
+                yield 'airport', ident, name, f'{city}, {country}', weight, [name, ident]
+
+        return cls(suggestions())
+
+    def _rank(self, lo, hi, limit):
+        """Ranks the distinct suggestions in a slice of the index.
+
+        Args:
+            lo (int): The start of the slice.
+            hi (int): The end of the slice.
+            limit (int): The maximum number of suggestions.
+
+        Returns:
+            list: The suggestion numbers, best first.
+        """
+
+        ranked = []
+        seen = set()
+        for _, number in sorted(self.entries[lo:hi]):
+            if number not in seen:
+                seen.add(number)
+                ranked.append(number)
+                if len(ranked) == limit:
+                    break
+
+        return ranked
+
+    def _precompute(self, prefix, lo, hi):
+        """Stores the ranked results of every prefix with a large slice.
+
+        Args:
+            prefix (str): The prefix shared by keys[lo:hi].
+            lo (int): The start of the slice.
+            hi (int): The end of the slice.
+        """
+
+        if hi - lo <= PRECOMPUTE_THRESHOLD:
+            return
+
+        if prefix:
+            self.precomputed[prefix] = self._rank(lo, hi, MAX_SUGGESTIONS)
+
+        # Keys equal to the prefix sort first and have no next character
+        start = bisect_left(self.keys, prefix + '\0', lo, hi) if len(self.keys[lo]) == len(prefix) else lo
+        while start < hi:
+            child = self.keys[start][:len(prefix) + 1]
+            end = bisect_left(self.keys, child + '\U0010ffff', start, hi)
+            self._precompute(child, start, end)
+            start = end
+
+    def search(self, query, limit=10):
+        """Finds the best suggestions whose name or a word of it starts with the query.
+
+        Args:
+            query (str): The text typed so far.
+            limit (int, optional): The maximum number of suggestions. Defaults to 10.
+
+        Returns:
+            list: The suggestions, best first.
+        """
+
+        prefix = ' '.join(fold(query).split())
+        if not prefix:
+            return []
+
+        ranked = self.precomputed.get(prefix)
+        if ranked is None:
+            lo = bisect_left(self.keys, prefix)
+            hi = bisect_left(self.keys, prefix + '\U0010ffff', lo)
+            ranked = self._rank(lo, hi, limit)
+
+        return [self.suggestions[number] for number in ranked[:limit]]
+
+
+autocomplete_index = InMemoryIndex(AutocompleteIndex.from_database, max_age=300)
+
+
+@receiver(post_save, sender=Airport)
+@receiver(post_delete, sender=Airport)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+def name_changed(sender, **kwargs):
+    """Marks the autocomplete index stale when an airport, city or country changes."""
+
+    autocomplete_index.mark_stale()
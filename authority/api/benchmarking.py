@@ -0,0 +1,668 @@
+"""This module contains helpers for the benchmark management commands.
+
+Benchmarks run against a scratch copy of the database, created the same way
+the test runner creates its test database, and seeded with synthetic data.
+"""
+
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from .models import Airline, Airport, Booking, City, Country, Flight
+from .references import booking_refs
+from .search import index_airports
+
+SEED_BATCH_SIZE = 5000
+CONTINENTS = ['AF', 'AN', 'AS', 'EU', 'NA', 'OC', 'SA']
+SCHEDULE_START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+@contextmanager
+def scratch_database(in_memory=True):
+    """Runs the enclosed block against a freshly migrated scratch database.
+
+    For SQLite the scratch database is in memory, so the real database is never touched.
+    Concurrent writers should ask for a temporary file instead, since the tables of a
+    shared in-memory database are locked without waiting for the busy timeout.
+
+    Args:
+        in_memory (bool, optional): Whether an SQLite scratch database lives in memory. Defaults to True.
+
+    Yields:
+        str: The name of the scratch database.
+    """
+
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings['NAME']
+    directory = None
+    if not in_memory and connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp()
+        test_settings['NAME'] = os.path.join(directory, 'scratch.sqlite3')
+
+    name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield name
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class StubAirlineHandler(BaseHTTPRequestHandler):
+    """Answers the booking notifications sent to an airline."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would hold back on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def reply(self, code):
+        """Reads the request body and sends an empty JSON response.
+
+        Args:
+            code (int): The status code.
+        """
+
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def do_POST(self):
+        """Accepts a new booking."""
+
+        self.reply(201)
+
+    def do_DELETE(self):
+        """Accepts a cancelled booking."""
+
+        self.reply(200)
+
+    def log_message(self, format, *args):
+        """Keeps the benchmark output free of access logs."""
+
+
+class StubAirlineServer(ThreadingHTTPServer):
+    """A threaded HTTP server that accepts many connections at once."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+    latency = 0.0
+
+
+@contextmanager
+def stub_airline(latency=0.0):
+    """Runs a local HTTP server standing in for the airline APIs.
+
+    Args:
+        latency (float, optional): Seconds the airline takes to answer. Defaults to 0.
+
+    Yields:
+        str: The host and port to store as the airline IP.
+    """
+
+    server = StubAirlineServer(('127.0.0.1', 0), StubAirlineHandler)
+    server.latency = latency
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    """Handles requests without writing an access log line for each."""
+
+    def log_message(self, format, *args):
+        """Keeps the benchmark output free of access logs."""
+
+
+class BenchmarkWSGIServer(ThreadedWSGIServer):
+    """The development WSGI server, with a backlog large enough for the load."""
+
+    request_queue_size = 1024
+
+
+@contextmanager
+def serve_wsgi():
+    """Serves the project with a thread per request, like runserver.
+
+    Yields:
+        str: The base URL of the server.
+    """
+
+    server = BenchmarkWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+    server.set_app(get_internal_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class QueryCounter:
+    """Counts the queries run on every database connection, including those of server threads."""
+
+    def __init__(self):
+        """Creates the counter."""
+
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Counts a query and runs it.
+
+        Returns:
+            object: The result of the query.
+        """
+
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def watch(self, sender, connection, **kwargs):
+        """Counts the queries of a newly opened connection."""
+
+        # A keep-alive thread reconnects the same connection object for each request
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextmanager
+    def installed(self):
+        """Counts the queries of this thread's connection and of connections opened meanwhile."""
+
+        connection_created.connect(self.watch)
+        try:
+            with connection.execute_wrapper(self):
+                yield self
+        finally:
+            connection_created.disconnect(self.watch)
+
+
+def get_percentiles(timings):
+    """Summarises request timings.
+
+    Args:
+        timings (list): The time of each request in milliseconds.
+
+    Returns:
+        dict: The median, 95th and 99th percentile and mean in milliseconds.
+    """
+
+    if len(timings) < 2:
+        timings = timings * 2 or [0.0, 0.0]
+    quantiles = statistics.quantiles(timings, n=100)
+
+    return {
+        'p50_ms': round(quantiles[49], 2),
+        'p95_ms': round(quantiles[94], 2),
+        'p99_ms': round(quantiles[98], 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+    }
+
+
+async def run_load(base_url, make_request, total, concurrency):
+    """Sends requests from many concurrent clients and times them.
+
+    Args:
+        base_url (str): The base URL of the server.
+        make_request (callable): Returns (method, path, data) for the next request,
+            where data is sent as the JSON body.
+        total (int): Number of requests.
+        concurrency (int): Number of requests in flight at once.
+
+    Returns:
+        dict: Throughput, latency percentiles and status counts.
+    """
+
+    timings = []
+    statuses = {}
+    remaining = iter(range(total))
+
+    async def client(session):
+        for _ in remaining:
+            method, path, data = make_request()
+            start = time.perf_counter()
+            try:
+                response = await session.request(method, path, json=data)
+                key = str(response.status_code)
+            except httpx.HTTPError as error:
+                key = type(error).__name__
+            timings.append((time.perf_counter() - start) * 1000)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        'requests_per_second': round(total / elapsed, 1),
+        **get_percentiles(timings),
+        'statuses': statuses,
+    }
+
+
+def seed_dataset(num_airports=500, num_flights=100000, num_bookings=0, seed=42):
+    """Seeds the database with a synthetic schedule.
+
+    Rows are inserted with bulk_create, which skips the model save methods,
+    so no seats are decremented and no airline is notified.
+
+    Args:
+        num_airports (int, optional): Number of airports. Defaults to 500.
+        num_flights (int, optional): Number of flights. Defaults to 100000.
+        num_bookings (int, optional): Number of bookings. Defaults to 0.
+        seed (int, optional): Seed for the random data. Defaults to 42.
+
+    Returns:
+        dict: The number of rows created per model.
+    """
+
+    rng = random.Random(seed)
+
+    countries = [Country(name=f'Country {i}', continent=CONTINENTS[i % len(CONTINENTS)])
+                 for i in range(max(1, num_airports // 20))]
+    Country.objects.bulk_create(countries, batch_size=SEED_BATCH_SIZE)
+
+    cities = [City(name=f'City {i}', country=countries[i % len(countries)])
+              for i in range(max(1, num_airports // 2))]
+    City.objects.bulk_create(cities, batch_size=SEED_BATCH_SIZE)
+    cities = list(City.objects.all())
+
+    airports = [
+        Airport(ident=f'X{i:05d}', name=f'Airport {i}', city=rng.choice(cities),
+                region=f'R-{i % 50}', size_type=rng.choice(['small_airport', 'large_airport']),
+                latitude=rng.uniform(-90, 90), longitude=rng.uniform(-180, 180),
+                elevation=str(rng.randint(0, 3000)))
+        for i in range(num_airports)
+    ]
+    Airport.objects.bulk_create(airports, batch_size=SEED_BATCH_SIZE)
+    # bulk_create sends no signals, so the search index is filled here
+    index_airports()
+
+    airlines = [Airline(code=f'B{i}', name=f'Benchmark Airline {i}', ip='127.0.0.1')
+                for i in range(10)]
+    Airline.objects.bulk_create(airlines)
+
+    flights = []
+    for i in range(num_flights):
+        departure, destination = rng.sample(airports, 2)
+        departure_datetime = SCHEDULE_START + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+        duration = timedelta(minutes=rng.randint(45, 900))
+        total_seats = rng.randint(100, 250)
+        flights.append(Flight(
+            flight_code=f'B{i % 10}{i:07d}', departure_airport=departure,
+            destination_airport=destination, departure_datetime=departure_datetime,
+            arrival_datetime=departure_datetime + duration, duration_time=duration,
+            base_price=round(rng.uniform(10, 2000), 2), total_seats=total_seats,
+            # Roughly one flight in ten is sold out
+            available_seats=0 if rng.random() < 0.1 else rng.randint(1, total_seats),
+            airline=airlines[i % 10]))
+        if len(flights) == SEED_BATCH_SIZE:
+            Flight.objects.bulk_create(flights)
+            flights = []
+    Flight.objects.bulk_create(flights)
+
+    flight_codes = list(Flight.objects.values_list('flight_code', flat=True)[:max(1, num_flights)])
+    bookings = []
+    for i in range(num_bookings if flight_codes else 0):
+        bookings.append(Booking(
+            booking_ref=f'{i:010d}', passport_number=rng.randint(10000000, 99999999),
+            flight_id=rng.choice(flight_codes)))
+        if len(bookings) == SEED_BATCH_SIZE:
+            Booking.objects.bulk_create(bookings)
+            bookings = []
+    Booking.objects.bulk_create(bookings)
+
+    return {
+        'countries': len(countries),
+        'cities': len(cities),
+        'airports': num_airports,
+        'airlines': len(airlines),
+        'flights': num_flights,
+        'bookings': num_bookings if flight_codes else 0,
+    }
+
+
+class Workload:
+    """Builds the requests of each endpoint from the seeded data.
+
+    Every route draws from its own random generator, seeded from the run's
+    seed and the route name, so the same dataset and arguments send the
+    same requests on every commit.
+    """
+
+    def __init__(self, seed):
+        """Reads the seeded rows the requests are built from.
+
+        Args:
+            seed (int): The seed of the run.
+        """
+
+        self.seed = seed
+        self.airports = list(Airport.objects.order_by('ident').values_list('ident', 'latitude', 'longitude'))
+        self.airlines = list(Airline.objects.order_by('code').values_list('code', flat=True))
+        self.cities = list(City.objects.order_by('id').values_list('name', flat=True))
+        self.countries = list(Country.objects.order_by('name').values_list('name', flat=True))
+        self.schedule = list(Flight.objects.filter(available_seats__gt=0).order_by('flight_code').values_list(
+            'flight_code', 'departure_airport__ident', 'destination_airport__ident', 'departure_datetime'))
+        self.flights = [flight_code for flight_code, *_ in self.schedule]
+        self.bookings = list(Booking.objects.order_by('booking_ref').values_list('booking_ref', 'passport_number'))
+        # Rows made by the create routes, for the delete routes to remove
+        self.created_flights = []
+        self.created_bookings = []
+        self.counter = 0
+
+    def get_routes(self):
+        """Lists the benchmarked routes.
+
+        Returns:
+            dict: For each route name, the share of the requests it gets and a function making its next request.
+                Routes that create rows come before the routes that delete them.
+        """
+
+        return {
+            'airlines': (1, self.get_airlines),
+            'airports': (1, self.get_airports),
+            'airports search': (1, self.search_airports),
+            'airports by city': (1, self.get_city_airports),
+            'airports by country': (1, self.get_country_airports),
+            'airports by continent': (0.25, self.get_continent_airports),
+            'airports nearby': (1, self.get_nearby_airports),
+            'cities': (1, self.get_cities),
+            'countries': (1, self.get_countries),
+            'autocomplete': (1, self.get_suggestions),
+            'flights': (1, self.get_flights),
+            'flights by route': (1, self.get_route_flights),
+            'flight': (1, self.get_flight),
+            'flights create': (1, self.create_flight),
+            'flights modify': (1, self.modify_flight),
+            'flights delete': (1, self.delete_flight),
+            'flights import': (0.1, self.import_flights),
+            'itineraries': (0.25, self.get_itineraries),
+            'bookings': (0.05, self.get_bookings),
+            'booking': (1, self.get_booking),
+            'bookings by passport': (1, self.get_passport_bookings),
+            'bookings by flight': (1, self.get_flight_bookings),
+            'bookings create': (1, self.create_booking),
+            'bookings modify': (1, self.modify_booking),
+            'bookings delete': (1, self.delete_booking),
+            'bookings bulk': (0.25, self.create_bookings),
+            'async flights': (1, self.get_async_flights),
+            'async bookings create': (1, self.create_async_booking),
+        }
+
+    def get_random(self, name):
+        """Gets the random generator of a route.
+
+        Args:
+            name (str): The route name.
+
+        Returns:
+            Random: The generator.
+        """
+
+        return random.Random(f'{self.seed}:{name}')
+
+    def get_next_code(self):
+        """Gets a flight code that is not in the seeded data.
+
+        Returns:
+            str: The flight code.
+        """
+
+        self.counter += 1
+        return f'BM{self.counter:07d}'
+
+    def get_new_flight(self, rng):
+        """Builds the body of a new flight.
+
+        Args:
+            rng (Random): The random generator of the route.
+
+        Returns:
+            dict: The flight.
+        """
+
+        departure, destination = rng.sample(self.airports, 2)
+        departure_datetime = SCHEDULE_START + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+        return {
+            'flight_code': self.get_next_code(), 'departure_airport': departure[0], 'destination_airport': destination[0],
+            'departure_datetime': departure_datetime.isoformat(),
+            'arrival_datetime': (departure_datetime + timedelta(hours=2)).isoformat(),
+            'duration_time': '02:00:00', 'base_price': 100, 'total_seats': 200, 'available_seats': 200,
+            'airline': rng.choice(self.airlines),
+        }
+
+    def get_airlines(self, rng):
+        """Lists every airline."""
+
+        return 'GET', '/api/airlines/', {}
+
+    def get_airports(self, rng):
+        """Looks up an airport by ident."""
+
+        return 'GET', '/api/airports/', {'ident': rng.choice(self.airports)[0]}
+
+    def search_airports(self, rng):
+        """Searches the airports by name."""
+
+        return 'GET', '/api/airports/', {'search': f'Airport {rng.randrange(len(self.airports))}'}
+
+    def get_city_airports(self, rng):
+        """Lists the airports of a city."""
+
+        return 'GET', '/api/airports/', {'city': rng.choice(self.cities).lower()}
+
+    def get_country_airports(self, rng):
+        """Lists the airports of a country."""
+
+        return 'GET', '/api/airports/', {'country': rng.choice(self.countries).lower()}
+
+    def get_continent_airports(self, rng):
+        """Lists the airports of a continent."""
+
+        return 'GET', '/api/airports/', {'continent': rng.choice(CONTINENTS).lower()}
+
+    def get_nearby_airports(self, rng):
+        """Finds the 10 airports nearest to an airport."""
+
+        _, latitude, longitude = rng.choice(self.airports)
+        return 'GET', '/api/airports/nearby/', {'lat': latitude, 'lon': longitude, 'k': 10}
+
+    def get_cities(self, rng):
+        """Looks up a city by name."""
+
+        return 'GET', '/api/cities/', {'name': rng.choice(self.cities)}
+
+    def get_countries(self, rng):
+        """Looks up a country by name."""
+
+        return 'GET', '/api/countries/', {'name': rng.choice(self.countries)}
+
+    def get_suggestions(self, rng):
+        """Asks for autocomplete suggestions of a common prefix."""
+
+        return 'GET', '/api/autocomplete/', {'q': rng.choice(['Air', 'City', 'Country', 'X0'])}
+
+    def get_flights(self, rng):
+        """Lists the first page of flights."""
+
+        return 'GET', '/api/flights/', {'limit': 100}
+
+    def get_route_flights(self, rng):
+        """Lists the flights from an airport in the week around a seeded flight."""
+
+        _, departure, _, departure_datetime = rng.choice(self.schedule)
+        return 'GET', '/api/flights/', {
+            'departure_airport': departure,
+            'departure_datetime_min': (departure_datetime - timedelta(days=3)).isoformat(),
+            'departure_datetime_max': (departure_datetime + timedelta(days=4)).isoformat(),
+            'limit': 20,
+        }
+
+    def get_flight(self, rng):
+        """Looks up a flight by code."""
+
+        return 'GET', '/api/flights/', {'flight_code': rng.choice(self.flights)}
+
+    def create_flight(self, rng):
+        """Creates a flight for the delete route to remove."""
+
+        flight = self.get_new_flight(rng)
+        self.created_flights.append(flight['flight_code'])
+        return 'POST', '/api/flights/', flight
+
+    def modify_flight(self, rng):
+        """Changes the price of a seeded flight."""
+
+        return 'PATCH', '/api/flights/', {'flight_code': rng.choice(self.flights), 'base_price': rng.randint(50, 500)}
+
+    def delete_flight(self, rng):
+        """Deletes a flight made by the create route, or a missing one once they run out."""
+
+        flight_code = self.created_flights.pop() if self.created_flights else self.get_next_code()
+        return 'DELETE', f'/api/flights/?flight_code={flight_code}', {}
+
+    def import_flights(self, rng):
+        """Imports 100 new flights as a JSON list."""
+
+        return 'POST', '/api/flights/bulk/', [self.get_new_flight(rng) for _ in range(100)]
+
+    def get_itineraries(self, rng):
+        """Searches for itineraries between the airports of a seeded flight."""
+
+        # Start from a seeded flight so there is at least one direct itinerary to find
+        _, departure, destination, departure_datetime = rng.choice(self.schedule)
+        return 'GET', '/api/itineraries/', {
+            'departure_airport': departure, 'destination_airport': destination,
+            'departure_datetime_min': (departure_datetime - timedelta(hours=12)).isoformat(),
+            'departure_datetime_max': (departure_datetime + timedelta(hours=12)).isoformat(),
+        }
+
+    def get_bookings(self, rng):
+        """Lists every booking."""
+
+        return 'GET', '/api/bookings/', {}
+
+    def get_booking(self, rng):
+        """Looks up a booking by reference."""
+
+        return 'GET', '/api/bookings/', {'booking_ref': rng.choice(self.bookings)[0]}
+
+    def get_passport_bookings(self, rng):
+        """Lists the bookings of a passport number."""
+
+        return 'GET', '/api/bookings/', {'passport_number': rng.choice(self.bookings)[1]}
+
+    def get_flight_bookings(self, rng):
+        """Lists the bookings of a flight."""
+
+        return 'GET', '/api/bookings/', {'flight': rng.choice(self.flights)}
+
+    def create_booking(self, rng):
+        """Books a seat on a seeded flight."""
+
+        return 'POST', '/api/bookings/', {
+            'flight': rng.choice(self.flights), 'passport_number': rng.randint(10000000, 99999999)}
+
+    def modify_booking(self, rng):
+        """Changes the passport number of a seeded booking."""
+
+        return 'PATCH', '/api/bookings/', {
+            'booking_ref': rng.choice(self.bookings)[0], 'passport_number': rng.randint(10000000, 99999999)}
+
+    def delete_booking(self, rng):
+        """Deletes a booking made by the create routes, or a missing one once they run out."""
+
+        booking_ref = self.created_bookings.pop() if self.created_bookings else 'XXXXXXXXXX'
+        return 'DELETE', f'/api/bookings/?booking_ref={booking_ref}', {}
+
+    def create_bookings(self, rng):
+        """Books 10 seats on one seeded flight at once."""
+
+        flight_code = rng.choice(self.flights)
+        return 'POST', '/api/bookings/bulk/', [
+            {'flight': flight_code, 'passport_number': rng.randint(10000000, 99999999)} for _ in range(10)]
+
+    def get_async_flights(self, rng):
+        """Lists the flights from an airport through the async view."""
+
+        return 'GET', '/api/async/flights/', {'departure_airport': rng.choice(self.airports)[0], 'limit': 20}
+
+    def create_async_booking(self, rng):
+        """Books a seat on a seeded flight through the async view."""
+
+        return 'POST', '/api/async/bookings/', {
+            'flight': rng.choice(self.flights), 'passport_number': rng.randint(10000000, 99999999)}
+
+    def record_created_bookings(self):
+        """Queues the bookings made by the create routes for the delete route."""
+
+        self.created_bookings = list(Booking.objects.exclude(booking_ref__in=[ref for ref, _ in self.bookings])
+                                     .order_by('booking_ref').values_list('booking_ref', flat=True))
+
+
+def generate_booking_refs(count):
+    """Makes booking references in the calling process.
+
+    Module level so that worker processes can run it.
+
+    Args:
+        count (int): Number of references.
+
+    Returns:
+        list: The references.
+    """
+
+    return [booking_refs.next() for _ in range(count)]
+
+
+def time_call(func, repeat=5):
+    """Times repeated calls of a function.
+
+    Args:
+        func (callable): The function to time.
+        repeat (int, optional): Number of timed calls. Defaults to 5.
+
+    Returns:
+        dict: The median, min and max call time in milliseconds.
+    """
+
+    # Warm up the page cache and the statement cache first
+    func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
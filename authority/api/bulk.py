@@ -0,0 +1,332 @@
+"""This module contains the bulk writes behind the bulk booking and flight import endpoints.
+
+A group booking is checked with one query per table instead of one per
+passenger. Seats are then taken with one conditional UPDATE per flight,
+and the bookings and their airline notifications are each inserted with
+one bulk INSERT, all in a single transaction.
+
+Flight schedules are read row by row from CSV or NDJSON, checked a chunk
+at a time against the known airports and airlines, and upserted with one
+INSERT ... ON CONFLICT per chunk, so a season of flights loads without a
+query per flight.
+"""
+
+import csv
+import json
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_duration
+from rest_framework import status
+
+from .caching import invalidate
+from .itineraries import invalidate_timetable
+from .metrics import BOOKINGS_CREATED, count_bookings
+from .models import Airline, Airport, Booking, Flight, OutboxMessage
+from .references import BOOKING_REF_ATTEMPTS
+
+# Largest number of bookings accepted in one request
+BULK_BOOKING_LIMIT = 500
+# Flights validated and written per statement
+FLIGHT_IMPORT_CHUNK_SIZE = 5000
+# Only the first errors are reported in full, the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+FLIGHT_IMPORT_FORMATS = {'csv', 'ndjson'}
+# Seat counts of existing flights belong to their bookings, so an import leaves them alone
+FLIGHT_UPDATE_FIELDS = [
+    'departure_airport', 'destination_airport', 'departure_datetime', 'arrival_datetime',
+    'duration_time', 'base_price', 'airline']
+
+
+def get_error(status_code, message):
+    """Builds the result of an entry that was not booked.
+
+    Args:
+        status_code (int): The HTTP status code the single booking endpoint would answer with.
+        message (str): The error message.
+
+    Returns:
+        dict: The result.
+    """
+
+    return {'status': status_code, 'error': message}
+
+
+def book_many(entries):
+    """Books a list of passengers, each on a flight.
+
+    The passengers of a flight are booked together or not at all, so a
+    group is never split when the flight fills up.
+
+    Args:
+        entries (list): Dictionaries with the flight code and passport number of each passenger.
+
+    Returns:
+        list: The result of each entry, in order: the status code and either the booking or an error.
+    """
+
+    results = [None] * len(entries)
+    wanted = defaultdict(list)
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            results[index] = get_error(status.HTTP_400_BAD_REQUEST, 'Each booking must have a flight and a passport number')
+            continue
+
+        flight_code = entry.get('flight')
+        if not flight_code:
+            results[index] = get_error(status.HTTP_400_BAD_REQUEST, 'Flight is required')
+            continue
+
+        try:
+            passport_number = int(entry.get('passport_number'))
+        except (TypeError, ValueError):
+            results[index] = get_error(status.HTTP_400_BAD_REQUEST, 'Passport number must be an integer')
+            continue
+
+        wanted[str(flight_code)].append((index, passport_number))
+
+    flights = Flight.objects.in_bulk(list(wanted))
+    passport_numbers = {passport_number for items in wanted.values() for _, passport_number in items}
+    booked = set(Booking.objects.filter(flight__in=list(flights), passport_number__in=passport_numbers)
+                 .values_list('flight_id', 'passport_number'))
+
+    groups = {}
+    for flight_code, items in wanted.items():
+        if flight_code not in flights:
+            for index, _ in items:
+                results[index] = get_error(status.HTTP_404_NOT_FOUND, f'Flight \'{flight_code}\' not found')
+            continue
+
+        group = []
+        for index, passport_number in items:
+            if (flight_code, passport_number) in booked:
+                results[index] = get_error(
+                    status.HTTP_400_BAD_REQUEST,
+                    f'Booking already exists with flight \'{flight_code}\' and passport number \'{passport_number}\'')
+                continue
+            # A passenger listed twice is only booked once
+            booked.add((flight_code, passport_number))
+            group.append((index, passport_number))
+        if group:
+            groups[flight_code] = group
+
+    with transaction.atomic():
+        bookings = []
+        for flight_code, group in groups.items():
+            # Check and take every seat of the group at once, so concurrent bookings cannot oversell the flight
+            if not Flight.objects.filter(flight_code=flight_code, available_seats__gte=len(group)) \
+                    .update(available_seats=F('available_seats') - len(group)):
+                for index, _ in group:
+                    results[index] = get_error(
+                        status.HTTP_409_CONFLICT, f'Flight \'{flight_code}\' does not have {len(group)} seats available')
+                continue
+            bookings += [(index, Booking(flight=flights[flight_code], passport_number=passport_number))
+                         for index, passport_number in group]
+
+        # bulk_create skips Booking.save, whose reference, seat and notification are handled here
+        for attempt in range(BOOKING_REF_ATTEMPTS):
+            for _, booking in bookings:
+                booking.booking_ref = Booking.generate_booking_ref()
+            try:
+                with transaction.atomic():
+                    Booking.objects.bulk_create([booking for _, booking in bookings])
+                break
+            except IntegrityError:
+                # Another process made one of the same references
+                if attempt == BOOKING_REF_ATTEMPTS - 1:
+                    raise
+        OutboxMessage.objects.bulk_create([booking.get_created_notification() for _, booking in bookings])
+        for airline, count in Counter(booking.flight.airline_id for _, booking in bookings).items():
+            count_bookings(BOOKINGS_CREATED, airline, count)
+
+    for index, booking in bookings:
+        results[index] = {'status': status.HTTP_201_CREATED, 'booking': booking}
+
+    return results
+
+
+def read_flight_rows(lines, file_format):
+    """Reads flight rows one at a time from CSV or NDJSON text.
+
+    Args:
+        lines (iterable): The lines of text.
+        file_format (str): 'csv', with a header row, or 'ndjson', with one object per line.
+
+    Yields:
+        tuple: The line number and either the row as a dictionary or, for an unreadable line, an error message.
+    """
+
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_number, f'Invalid JSON: {error}'
+            continue
+        yield line_number, row if isinstance(row, dict) else 'Each line must be a JSON object'
+
+
+def parse_flight(row, airports, airlines):
+    """Builds a flight from an imported row.
+
+    Args:
+        row (dict): The row, with the fields of POST /api/flights/.
+            duration_time defaults to the time between departure and arrival,
+            and available_seats to total_seats.
+        airports (set): The idents of the known airports.
+        airlines (set): The codes of the known airlines.
+
+    Returns:
+        tuple: The unsaved flight, or None, and a dictionary of the errors of each field.
+    """
+
+    errors = {}
+
+    def get_text(field, max_length=None):
+        value = row.get(field)
+        value = '' if value is None else str(value).strip()
+        if not value:
+            errors[field] = 'This field is required.'
+        elif max_length and len(value) > max_length:
+            errors[field] = f'Ensure this field has no more than {max_length} characters.'
+        return value
+
+    def get_number(field, convert, default=None):
+        value = row.get(field)
+        if value in (None, '') and default is not None:
+            return default
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            errors[field] = 'A valid number is required.'
+            return None
+        # float() reads 'nan' and 'inf', which would pass the check below
+        if not math.isfinite(value):
+            errors[field] = 'A valid number is required.'
+        elif value < 0:
+            errors[field] = 'Ensure this value is greater than or equal to 0.'
+        return value
+
+    def get_datetime(field):
+        value = get_text(field)
+        try:
+            parsed = parse_datetime(value) if value else None
+        except ValueError:
+            parsed = None
+        if value and parsed is None:
+            errors[field] = 'A valid datetime is required.'
+        elif parsed is not None and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, timezone.utc)
+        return parsed
+
+    flight_code = get_text('flight_code', Flight._meta.get_field('flight_code').max_length)
+    departure_airport = get_text('departure_airport')
+    destination_airport = get_text('destination_airport')
+    airline = get_text('airline')
+    for field, value, known in (('departure_airport', departure_airport, airports),
+                                ('destination_airport', destination_airport, airports),
+                                ('airline', airline, airlines)):
+        if value and value not in known:
+            errors[field] = f'\'{value}\' does not exist.'
+
+    departure_datetime = get_datetime('departure_datetime')
+    arrival_datetime = get_datetime('arrival_datetime')
+    if departure_datetime and arrival_datetime and arrival_datetime <= departure_datetime:
+        errors['arrival_datetime'] = 'The arrival must be after the departure.'
+
+    duration_time = row.get('duration_time')
+    if duration_time in (None, ''):
+        duration_time = arrival_datetime - departure_datetime if departure_datetime and arrival_datetime else None
+    elif isinstance(duration_time, (int, float)):
+        duration_time = timedelta(seconds=duration_time)
+    else:
+        duration_time = parse_duration(str(duration_time))
+        if duration_time is None:
+            errors['duration_time'] = 'A valid duration is required.'
+
+    base_price = get_number('base_price', float)
+    total_seats = get_number('total_seats', int)
+    available_seats = get_number('available_seats', int, total_seats)
+    if 'total_seats' not in errors and 'available_seats' not in errors and available_seats > total_seats:
+        errors['available_seats'] = 'Available seats cannot be greater than total seats.'
+
+    if errors:
+        return None, errors
+
+    return Flight(
+        flight_code=flight_code, departure_airport_id=departure_airport, destination_airport_id=destination_airport,
+        departure_datetime=departure_datetime, arrival_datetime=arrival_datetime, duration_time=duration_time,
+        base_price=base_price, total_seats=total_seats, available_seats=available_seats, airline_id=airline), {}
+
+
+def import_flights(rows, chunk_size=FLIGHT_IMPORT_CHUNK_SIZE):
+    """Creates or updates flights from a stream of rows.
+
+    Each chunk is written in its own transaction, so the flights of the
+    chunks before a failure stay imported.
+
+    Args:
+        rows (iterable): The line number and the row (or an error message) of each flight, as read_flight_rows yields.
+        chunk_size (int, optional): Number of flights written per statement. Defaults to FLIGHT_IMPORT_CHUNK_SIZE.
+
+    Returns:
+        dict: The number of rows read, flights created and updated, and rows rejected,
+            with the errors of the first rejected rows.
+    """
+
+    # Every row is checked against these, so load them once instead of a query per row
+    airports = set(Airport.objects.values_list('ident', flat=True))
+    airlines = set(Airline.objects.values_list('code', flat=True))
+    report = {'rows': 0, 'created': 0, 'updated': 0, 'rejected': 0, 'errors': []}
+
+    def reject(line_number, errors):
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': line_number, 'errors': errors})
+
+    def write(chunk):
+        existing = set(Flight.objects.filter(flight_code__in=list(chunk)).values_list('flight_code', flat=True))
+        with transaction.atomic():
+            Flight.objects.bulk_create(
+                chunk.values(), update_conflicts=True, unique_fields=['flight_code'],
+                update_fields=FLIGHT_UPDATE_FIELDS)
+        report['created'] += len(chunk) - len(existing)
+        report['updated'] += len(existing)
+
+    # A flight listed twice in a chunk is written once, with its last row
+    chunk = {}
+    for line_number, row in rows:
+        report['rows'] += 1
+        if isinstance(row, str):
+            reject(line_number, {'row': row})
+            continue
+
+        flight, errors = parse_flight(row, airports, airlines)
+        if errors:
+            reject(line_number, errors)
+            continue
+
+        chunk[flight.flight_code] = flight
+        if len(chunk) >= chunk_size:
+            write(chunk)
+            chunk = {}
+    if chunk:
+        write(chunk)
+
+    if report['created'] or report['updated']:
+        # Bulk inserts send no signals, so drop the cached flights and this process's timetable here
+        invalidate('flight')
+        invalidate_timetable()
+
+    return report
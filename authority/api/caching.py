@@ -0,0 +1,275 @@
+"""This module contains the response cache and conditional GETs of the read endpoints.
+
+Every model has a version number in the cache, and a cached response is
+stored under the versions of all the models it was read from. Saving or
+deleting a row bumps the version of its model once the transaction
+commits, so later requests miss the old entries instead of serving them.
+
+The ETags of the reference data endpoints come from the ResourceVersion
+table instead, bumped in the same callback. A per-process cache numbers
+its versions on its own, but every process reads the same table, so the
+ETag is checked before the handler runs on every deployment.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Airline, Airport, Booking, City, Country, Flight, ResourceVersion
+from .streaming import wants_stream
+
+VERSION_KEY = 'version:{}'
+RESPONSE_KEY = 'response:{}:{}:{}'
+# The resources with ETags, which are rarely written. Bookings and flights are left out of the
+# ResourceVersion table so that every booking does not queue on the same row.
+ETAG_RESOURCES = frozenset(['airline', 'airport', 'city', 'country'])
+
+
+def get_versions(resources):
+    """Gets the current version of each resource.
+
+    Args:
+        resources (tuple): The resource names.
+
+    Returns:
+        list: The versions, in the same order.
+    """
+
+    keys = [VERSION_KEY.format(resource) for resource in resources]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            # Start from the clock so an evicted version never repeats an old one
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+def bump_version(resource):
+    """Moves a resource to a new version, orphaning its cached responses.
+
+    Args:
+        resource (str): The resource name.
+    """
+
+    key = VERSION_KEY.format(resource)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_etag_versions(resources):
+    """Gets the version of each resource from the database, the same in every process.
+
+    Args:
+        resources (tuple): The resource names.
+
+    Returns:
+        list: The versions, in the same order. Resources never changed are at 0.
+    """
+
+    versions = dict(ResourceVersion.objects.filter(resource__in=resources).values_list('resource', 'version'))
+    return [versions.get(resource, 0) for resource in resources]
+
+
+def bump_versions(resource):
+    """Moves a resource to a new version in the cache, and in the database if it has ETags.
+
+    Args:
+        resource (str): The resource name.
+    """
+
+    bump_version(resource)
+    if resource in ETAG_RESOURCES:
+        ResourceVersion.bump(resource)
+
+
+def invalidate(*resources):
+    """Bumps the versions of resources once the current transaction commits.
+
+    Bumping before the commit would let a concurrent request cache the
+    old rows under the new version.
+
+    Args:
+        *resources (str): The resource names.
+    """
+
+    for resource in resources:
+        transaction.on_commit(lambda resource=resource: bump_versions(resource))
+
+
+def get_cache_key(name, request, resources):
+    """Builds the cache key of a request.
+
+    Args:
+        name (str): The name of the view.
+        request (Request): The request object.
+        resources (tuple): The resources the response is read from.
+
+    Returns:
+        str: The cache key.
+    """
+
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    # The host is part of the key because paginated responses hold absolute links
+    digest = hashlib.sha256(repr((request.get_host(), params)).encode()).hexdigest()
+    versions = '.'.join(str(version) for version in get_versions(resources))
+
+    return RESPONSE_KEY.format(name, digest, versions)
+
+
+def get_etag(name, request, versions):
+    """Builds the strong ETag of a request.
+
+    Args:
+        name (str): The name of the view.
+        request (Request): The request object.
+        versions (list): The versions of the resources the response is read from.
+
+    Returns:
+        str: The quoted ETag.
+    """
+
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    # The same data renders differently as JSON, NDJSON or the browsable API
+    renderer = getattr(request, 'accepted_renderer', None)
+    fingerprint = (name, params, renderer and renderer.format, versions)
+
+    return f'"{hashlib.sha256(repr(fingerprint).encode()).hexdigest()[:32]}"'
+
+
+def etag_matches(request, etag):
+    """Checks whether the client's copy of a response is current.
+
+    Args:
+        request (Request): The request object.
+        etag (str): The quoted ETag of the current response.
+
+    Returns:
+        bool: True if If-None-Match holds the ETag.
+    """
+
+    # If-None-Match uses the weak comparison, so W/ prefixes (e.g. added by gzip) are ignored
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in client_etags or etag in [tag.removeprefix('W/') for tag in client_etags]
+
+
+def conditional_response(*resources):
+    """Answers a GET handler with 304 Not Modified when the client's copy is current.
+
+    The ETag depends only on the request and the resource versions in the
+    database, so a matching If-None-Match is answered with one query and
+    without running the handler.
+
+    Args:
+        *resources (str): The resources the handler reads from.
+
+    Returns:
+        callable: The decorator.
+
+    Raises:
+        ValueError: If a resource is not in ETAG_RESOURCES, so its versions are never bumped.
+    """
+
+    if not ETAG_RESOURCES.issuperset(resources):
+        raise ValueError(f'No ETags are kept for {", ".join(sorted(set(resources) - ETAG_RESOURCES))}.')
+
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET' or wants_stream(request):
+                return handler(self, request, *args, **kwargs)
+
+            etag = get_etag(handler.__qualname__, request, get_etag_versions(resources))
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+
+            response['ETag'] = etag
+            patch_vary_headers(response, ['Accept'])
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def cache_response(*resources, timeout=None):
+    """Caches the successful responses of a GET handler.
+
+    Args:
+        *resources (str): The resources the handler reads from.
+        timeout (int, optional): Seconds to keep responses, 0 to not cache them.
+            Defaults to RESPONSE_CACHE_TIMEOUT.
+
+    Returns:
+        callable: The decorator.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            timeout_seconds = timeout if timeout is not None else settings.RESPONSE_CACHE_TIMEOUT
+            # Streams are never buffered, and a body could change the result
+            if request.method != 'GET' or not timeout_seconds or wants_stream(request) or request.data:
+                return handler(self, request, *args, **kwargs)
+
+            key = get_cache_key(handler.__qualname__, request, resources)
+            cached = cache.get(key)
+            if cached is not None:
+                return Response(cached, status=status.HTTP_200_OK)
+
+            response = handler(self, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, timeout_seconds)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@receiver(post_save, sender=Airline)
+@receiver(post_delete, sender=Airline)
+@receiver(post_save, sender=Airport)
+@receiver(post_delete, sender=Airport)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+@receiver(post_save, sender=Flight)
+@receiver(post_delete, sender=Flight)
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def row_changed(sender, **kwargs):
+    """Invalidates the cached responses read from the model of a saved or deleted row."""
+
+    invalidate(sender._meta.model_name)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def seats_changed(sender, **kwargs):
+    """Invalidates the cached flights when a booking takes or releases a seat.
+
+    Seats are counted with update(), which sends no signals of its own.
+    """
+
+    invalidate('flight')
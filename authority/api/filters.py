@@ -5,6 +5,27 @@ import django_filters
 from .models import Airport, Flight
 
 
+class IdentFilter(django_filters.CharFilter):
+    """Matches an airport ident exactly, ignoring the case of the query.
+
+    Idents are stored in upper case, so upper-casing the query gives the same
+    results as iexact while letting the database use the flight indexes.
+    """
+
+    def filter(self, qs, value):
+        """Filters the queryset by the upper-cased ident.
+
+        Args:
+            qs (QuerySet): The queryset to filter.
+            value (str): The ident to match.
+
+        Returns:
+            QuerySet: The filtered queryset.
+        """
+
+        return super().filter(qs, value.upper() if value else value)
+
+
 class AirportFilter(django_filters.FilterSet):
     """Filters for the Airport model."""
 
@@ -78,10 +99,8 @@ class FlightFilter(django_filters.FilterSet):
     available_seats_max = django_filters.NumberFilter(
         field_name="available_seats", lookup_expr='lte')
 
-    departure_airport = django_filters.CharFilter(
-        field_name="departure_airport__ident", lookup_expr='iexact')
-    destination_airport = django_filters.CharFilter(
-        field_name="destination_airport__ident", lookup_expr='iexact')
+    departure_airport = IdentFilter(field_name="departure_airport")
+    destination_airport = IdentFilter(field_name="destination_airport")
     departure_city = django_filters.CharFilter(
         field_name="departure_airport__city__name", lookup_expr='iexact')
     destination_city = django_filters.CharFilter(
@@ -0,0 +1,88 @@
+"""This module contains the holder for in-memory structures derived from the database.
+
+Each process keeps its own copy of a structure such as the flight timetable
+or the airport spatial index. Signals mark the copy stale when the source
+rows change in this process, and a maximum age picks up changes made by
+other processes.
+"""
+
+import threading
+import time
+
+from django.db import connections
+
+
+class InMemoryIndex:
+    """Holds a structure built from the database and rebuilds it when stale.
+
+    Only the first caller waits for the structure to be built. After that a
+    stale or expired copy keeps being served while a background thread
+    builds its replacement, so no request pays for a rebuild.
+    """
+
+    def __init__(self, build, max_age=60):
+        """Creates the holder without building anything yet.
+
+        Args:
+            build (callable): Builds the structure from the database.
+            max_age (float, optional): Seconds before the structure is rebuilt anyway. Defaults to 60.
+        """
+
+        self.build = build
+        self.max_age = max_age
+        self.current = None
+        self._built_at = 0
+        self._stale = False
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Gets the structure, building it on first use.
+
+        Returns:
+            object: The structure.
+        """
+
+        current = self.current
+        if current is None:
+            with self._lock:
+                if self.current is None:
+                    self._rebuild()
+                return self.current
+
+        if self._stale or time.monotonic() - self._built_at > self.max_age:
+            with self._lock:
+                if not self._rebuilding:
+                    self._rebuilding = True
+                    threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+        return current
+
+    def mark_stale(self):
+        """Schedules a rebuild on the next call to get."""
+
+        self._stale = True
+
+    def invalidate(self):
+        """Drops the structure so the next call to get rebuilds it before returning."""
+
+        self.current = None
+
+    def _rebuild(self):
+        """Builds the structure and swaps it in."""
+
+        # Cleared first so changes made during the build mark the new copy stale
+        self._stale = False
+        built_at = time.monotonic()
+        self.current = self.build()
+        self._built_at = built_at
+
+    def _rebuild_in_background(self):
+        """Rebuilds the structure from a background thread."""
+
+        try:
+            self._rebuild()
+        finally:
+            self._rebuilding = False
+            # The thread opened its own database connection, so close it
+            connections.close_all()
@@ -0,0 +1,231 @@
+"""This module contains the per-request timing instrumentation.
+
+Every request gets a RequestTimings object for the time it is being
+handled, which counts its database queries for the request metrics. A
+sampled request also has its database queries, serializers and requests
+to the airline servers timed, and the middleware sends the totals back in
+a Server-Timing header and writes them to the 'api.timing' logger as one
+JSON line. Requests that are not sampled only pay for a context variable
+lookup and a counter per query, and a lookup per serializer call.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import observe_request
+
+logger = logging.getLogger('api.timing')
+
+# The parts of a request that are timed, in Server-Timing order
+SPANS = ('db', 'serializer', 'airline')
+
+
+class RequestTimings:
+    """The time a request spent in each part of the code."""
+
+    def __init__(self, sampled):
+        """Creates empty timings.
+
+        Args:
+            sampled (bool): Whether to time the parts of the request, not just count its queries.
+        """
+
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.durations = dict.fromkeys(SPANS, 0.0)
+        self.queries = 0
+        self.open = set()
+
+    def get_fields(self, request, response):
+        """Gets the timings of a finished request.
+
+        Args:
+            request (HttpRequest): The request.
+            response (HttpResponse): The response.
+
+        Returns:
+            dict: The request, its status, the number of queries and the time of each part in milliseconds.
+        """
+
+        match = getattr(request, 'resolver_match', None)
+        return {
+            'method': request.method,
+            'path': request.path,
+            'route': match.url_name if match else None,
+            'status': response.status_code,
+            'queries': self.queries,
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 3),
+            **{f'{span}_ms': round(duration * 1000, 3) for span, duration in self.durations.items()},
+        }
+
+
+# The timings of the request being handled, or None outside a request
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+@contextmanager
+def timed(span):
+    """Adds the time of the enclosed block to a span of the current request.
+
+    Nested blocks of the same span, like a serializer inside another, are only counted once.
+
+    Args:
+        span (str): One of SPANS.
+    """
+
+    timings = current_timings.get()
+    if timings is None or not timings.sampled or span in timings.open:
+        yield
+        return
+
+    timings.open.add(span)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.durations[span] += time.perf_counter() - start
+        timings.open.discard(span)
+
+
+def time_query(execute, sql, params, many, context):
+    """Counts and times a query of the current request.
+
+    Returns:
+        object: The result of the query.
+    """
+
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    timings.queries += 1
+    if not timings.sampled:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.durations['db'] += time.perf_counter() - start
+
+
+def watch_connection(sender, connection, **kwargs):
+    """Times the queries of a newly opened database connection.
+
+    Args:
+        sender (type): The database backend class.
+        connection (DatabaseWrapper): The connection.
+    """
+
+    # Connections are reopened on the same wrapper object between requests
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedSerializerMixin:
+    """Adds the time a serializer spends turning instances into data to the current request."""
+
+    def to_representation(self, instance):
+        """Turns an instance into data.
+
+        Args:
+            instance (object): The instance.
+
+        Returns:
+            dict: The data.
+        """
+
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+def get_server_timing(fields):
+    """Builds the Server-Timing header of a request.
+
+    Args:
+        fields (dict): The timings from RequestTimings.get_fields.
+
+    Returns:
+        str: The header value.
+    """
+
+    metrics = [f'db;dur={fields["db_ms"]};desc="{fields["queries"]} queries"']
+    metrics += [f'{span};dur={fields[f"{span}_ms"]}' for span in SPANS[1:]]
+    metrics.append(f'total;dur={fields["total_ms"]}')
+    return ', '.join(metrics)
+
+
+def finish(request, response, timings):
+    """Records a finished request in the metrics, and reports its timings if it was sampled.
+
+    Args:
+        request (HttpRequest): The request.
+        response (HttpResponse): The response.
+        timings (RequestTimings): The timings of the request.
+
+    Returns:
+        HttpResponse: The response, with a Server-Timing header if the request was sampled.
+    """
+
+    match = getattr(request, 'resolver_match', None)
+    observe_request(match.url_name if match else None, request.method, response.status_code,
+                    time.perf_counter() - timings.start, timings.queries)
+
+    if timings.sampled:
+        fields = timings.get_fields(request, response)
+        response['Server-Timing'] = get_server_timing(fields)
+        logger.info(json.dumps(fields), extra={'timing': fields})
+
+    return response
+
+
+def is_sampled():
+    """Decides whether to time a request.
+
+    Returns:
+        bool: True for REQUEST_TIMING_SAMPLE_RATE of requests.
+    """
+
+    rate = settings.REQUEST_TIMING_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Records every request in the metrics, and reports where the time of a sample of them went.
+
+    Args:
+        get_response (callable): The next middleware or the view.
+
+    Returns:
+        callable: The middleware.
+    """
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = RequestTimings(is_sampled())
+            token = current_timings.set(timings)
+            try:
+                response = await get_response(request)
+            finally:
+                current_timings.reset(token)
+            return finish(request, response, timings)
+    else:
+        def middleware(request):
+            timings = RequestTimings(is_sampled())
+            token = current_timings.set(timings)
+            try:
+                response = get_response(request)
+            finally:
+                current_timings.reset(token)
+            return finish(request, response, timings)
+
+    return middleware
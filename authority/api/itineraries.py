@@ -0,0 +1,263 @@
+"""This module contains the connections engine behind the itineraries endpoint.
+
+The timetable is an in-memory copy of the flight schedule, grouped by
+departure and destination airport and sorted by departure time, so that
+the connections from an airport within a time window are found by binary
+search instead of self-joins on the flights table.
+"""
+
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import count, islice
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .inmemory import InMemoryIndex
+from .models import Flight
+
+# Rebuild at least this often (in seconds) so changes made by other processes are picked up
+TIMETABLE_MAX_AGE = 60
+
+Connection = namedtuple('Connection', [
+    'flight_code', 'departure_airport', 'destination_airport',
+    'departure', 'arrival', 'base_price'])
+
+SORT_KEYS = {
+    'arrival': lambda legs: (legs[-1].arrival, sum(leg.base_price for leg in legs)),
+    'price': lambda legs: (sum(leg.base_price for leg in legs), legs[-1].arrival),
+}
+
+
+class Timetable:
+    """An in-memory timetable of the bookable flights."""
+
+    def __init__(self, connections):
+        """Indexes the connections by airport.
+
+        Args:
+            connections (iterable): The connections to index.
+        """
+
+        self.by_code = {}
+        routes = {}
+        for connection in connections:
+            self.by_code[connection.flight_code] = connection
+            routes.setdefault(connection.departure_airport, {}) \
+                .setdefault(connection.destination_airport, []).append(connection)
+
+        # departures[airport][destination] = (departure times, connections), sorted by time
+        self.departures = {}
+        # feeders[airport] = the airports with a direct flight to it
+        self.feeders = {}
+        for airport, destinations in routes.items():
+            self.departures[airport] = {}
+            for destination, legs in destinations.items():
+                legs.sort(key=lambda leg: leg.departure)
+                self.departures[airport][destination] = ([leg.departure for leg in legs], legs)
+                self.feeders.setdefault(destination, set()).add(airport)
+
+    @classmethod
+    def from_database(cls):
+        """Builds the timetable from the flights with available seats.
+
+        Returns:
+            Timetable: The timetable.
+        """
+
+        rows = Flight.objects.filter(available_seats__gt=0).values_list(
+            'flight_code', 'departure_airport', 'destination_airport',
+            'departure_datetime', 'arrival_datetime', 'base_price')
+
+        return cls(
+            Connection(code, departure, destination, departs.timestamp(), arrives.timestamp(), price)
+            for code, departure, destination, departs, arrives, price in rows.iterator(chunk_size=5000))
+
+    def matches(self, flight):
+        """Checks whether a flight is in the timetable as it is now scheduled.
+
+        Args:
+            flight (Flight): The flight.
+
+        Returns:
+            bool: True if the timetable needs no rebuild for this flight.
+        """
+
+        connection = self.by_code.get(flight.flight_code)
+        if connection is None:
+            return flight.available_seats <= 0
+
+        try:
+            return connection == Connection(
+                flight.flight_code, flight.departure_airport_id, flight.destination_airport_id,
+                flight.departure_datetime.timestamp(), flight.arrival_datetime.timestamp(),
+                flight.base_price)
+        except AttributeError:
+            # The instance was saved with unparsed values, so rebuild to be safe
+            return False
+
+    def reachable(self, destinations, max_legs):
+        """Finds the airports that can reach the destinations.
+
+        Args:
+            destinations (set): The destination airports.
+            max_legs (int): The maximum number of legs.
+
+        Returns:
+            list: For each number of legs k, the airports that reach a destination in at most k legs.
+        """
+
+        reach = [set(destinations)]
+        frontier = reach[0]
+        for _ in range(max_legs):
+            frontier = set().union(*(self.feeders.get(airport, ()) for airport in frontier))
+            frontier -= reach[-1]
+            reach.append(reach[-1] | frontier)
+
+        return reach
+
+    def search(self, origins, destinations, earliest, latest, max_stops=2,
+               min_connection=3600, max_connection=86400, sort='arrival'):
+        """Finds the itineraries between two sets of airports, best first.
+
+        Partial itineraries are extended in the order of their sort key, which
+        can only grow as legs are added, so complete itineraries come out in
+        ranked order and nothing ranked after the ones consumed is explored.
+
+        Args:
+            origins (set): The departure airport idents.
+            destinations (set): The destination airport idents.
+            earliest (float): The earliest first departure, as a timestamp.
+            latest (float): The latest first departure, as a timestamp.
+            max_stops (int, optional): The maximum number of stops. Defaults to 2.
+            min_connection (float, optional): The minimum connection time in seconds. Defaults to 3600.
+            max_connection (float, optional): The maximum connection time in seconds. Defaults to 86400.
+            sort (str, optional): 'arrival' or 'price'. Defaults to 'arrival'.
+
+        Yields:
+            tuple: The connections of each itinerary, in the order of SORT_KEYS[sort].
+        """
+
+        reach = self.reachable(destinations, max_stops)
+        key = SORT_KEYS[sort]
+        # The counter breaks ties, so paths with the same key come out in the order they were found
+        counter = count()
+
+        def window(legs, start, end):
+            times, connections = legs
+            return connections[bisect_left(times, start):bisect_right(times, end)]
+
+        heap = []
+        for origin in origins:
+            for destination, legs in self.departures.get(origin, {}).items():
+                # Never route back through any of the departure airports
+                if destination in origins or destination not in reach[max_stops]:
+                    continue
+                for connection in window(legs, earliest, latest):
+                    path = (connection,)
+                    heap.append((key(path), next(counter), path, origins | {destination}, max_stops))
+        heapq.heapify(heap)
+
+        while heap:
+            _, _, path, visited, stops_left = heapq.heappop(heap)
+            last = path[-1]
+            if last.destination_airport in destinations:
+                yield path
+                continue
+
+            if stops_left == 0:
+                continue
+
+            start = last.arrival + min_connection
+            end = last.arrival + max_connection
+            for destination, legs in self.departures.get(last.destination_airport, {}).items():
+                # Only follow legs that can still reach a destination in time
+                if destination in visited or destination not in reach[stops_left - 1]:
+                    continue
+                for connection in window(legs, start, end):
+                    extended = path + (connection,)
+                    heapq.heappush(heap, (key(extended), next(counter), extended,
+                                          visited | {destination}, stops_left - 1))
+
+
+timetable_index = InMemoryIndex(Timetable.from_database, max_age=TIMETABLE_MAX_AGE)
+
+
+def get_timetable():
+    """Gets the timetable of this process.
+
+    Returns:
+        Timetable: The timetable.
+    """
+
+    return timetable_index.get()
+
+
+def invalidate_timetable():
+    """Drops the timetable of this process so the next search rebuilds it."""
+
+    timetable_index.invalidate()
+
+
+@receiver(post_save, sender=Flight)
+def flight_saved(sender, instance, **kwargs):
+    """Marks the timetable stale when a flight is added or rescheduled.
+
+    Seat changes that leave the flight bookable do not change the timetable,
+    so they do not cause a rebuild.
+    """
+
+    timetable = timetable_index.current
+    if timetable is not None and not timetable.matches(instance):
+        timetable_index.mark_stale()
+
+
+@receiver(post_delete, sender=Flight)
+def flight_deleted(sender, instance, **kwargs):
+    """Marks the timetable stale when a flight is deleted."""
+
+    timetable_index.mark_stale()
+
+
+def find_itineraries(origins, destinations, earliest, latest, sort='arrival', limit=20, **options):
+    """Finds the best itineraries that are still bookable.
+
+    The timetable may lag behind seat sales and is served while it is being
+    rebuilt, so the flights of the best itineraries are checked against the
+    database, usually in one query.
+
+    Args:
+        origins (set): The departure airport idents.
+        destinations (set): The destination airport idents.
+        earliest (datetime): The earliest first departure.
+        latest (datetime): The latest first departure.
+        sort (str, optional): 'arrival' or 'price'. Defaults to 'arrival'.
+        limit (int, optional): The maximum number of itineraries. Defaults to 20.
+        **options: Passed on to Timetable.search.
+
+    Returns:
+        list: The itineraries, each a list of Flight objects.
+    """
+
+    timetable = get_timetable()
+    candidates = timetable.search(
+        origins, destinations, earliest.timestamp(), latest.timestamp(), sort=sort, **options)
+
+    # Candidates come out ranked, so they are checked a batch at a time until there are enough
+    # bookable ones, over-fetching so a few sold out flights do not take another query
+    itineraries = []
+    while len(itineraries) < limit:
+        ranked = list(islice(candidates, limit * 2))
+        if not ranked:
+            break
+
+        codes = {leg.flight_code for legs in ranked for leg in legs}
+        flights = Flight.objects.filter(available_seats__gt=0).in_bulk(codes)
+        for legs in ranked:
+            if all(leg.flight_code in flights for leg in legs):
+                itineraries.append([flights[leg.flight_code] for leg in legs])
+                if len(itineraries) == limit:
+                    break
+
+    return itineraries
@@ -0,0 +1,228 @@
+"""Benchmarks every API endpoint on a seeded scratch database."""
+
+import asyncio
+import json
+import platform
+import subprocess
+import time
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from api.benchmarking import QueryCounter, Workload, get_percentiles, run_load, scratch_database, seed_dataset, \
+    serve_wsgi
+
+
+def get_commit():
+    """Gets the commit the benchmark runs on, so reports can be matched to it.
+
+    Returns:
+        str: The commit hash, with '-dirty' if there are uncommitted changes, or None outside a git checkout.
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=settings.BASE_DIR).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return f'{commit}-dirty' if dirty else commit
+
+
+class Command(BaseCommand):
+    """Measures latency, queries per request and throughput of every route."""
+
+    help = 'Seeds a scratch database and sends a fixed workload to every API route, through the test ' \
+           'client or a live server, reporting p50/p95/p99 latency, queries per request and throughput as JSON.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--airports', type=int, default=500,
+                            help='Number of airports to seed.')
+        parser.add_argument('--flights', type=int, default=20000,
+                            help='Number of flights to seed.')
+        parser.add_argument('--bookings', type=int, default=20000,
+                            help='Number of bookings to seed.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of requests per route. Heavy routes get a share of these.')
+        parser.add_argument('--server', choices=['client', 'live'], default='client',
+                            help='Send requests through the test client, or over HTTP to a threaded live server.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of requests in flight at once, with --server live.')
+        parser.add_argument('--routes', nargs='*', default=None,
+                            help='Only benchmark these routes.')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the response cache on. By default every request reaches the view.')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Seed for the dataset and the requests.')
+        parser.add_argument('--output', default=None,
+                            help='Also write the report to this file.')
+        parser.add_argument('--compare', default=None,
+                            help='A report from an earlier run to print the changes against.')
+
+    def handle(self, *args, **options):
+        """Seeds a scratch database and runs the benchmark."""
+
+        if options['concurrency'] > 1 and options['server'] == 'client':
+            raise CommandError('The test client sends one request at a time, use --server live for concurrency')
+
+        report = {
+            'meta': {
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'server': options['server'],
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'seed': options['seed'],
+                'cache': options['cache'],
+            },
+            'routes': {},
+        }
+
+        # Everything runs in this process, so its local cache is as good as a shared one
+        timeout = (settings.RESPONSE_CACHE_TIMEOUT or 300) if options['cache'] else 0
+        # A live server's threads need a database file they can all open
+        with scratch_database(in_memory=options['server'] == 'client'), \
+                override_settings(RESPONSE_CACHE_TIMEOUT=timeout, ALLOWED_HOSTS=['*']):
+            self.stderr.write('Seeding...')
+            report['meta']['dataset'] = seed_dataset(
+                num_airports=options['airports'], num_flights=options['flights'],
+                num_bookings=options['bookings'], seed=options['seed'])
+
+            workload = Workload(options['seed'])
+            routes = workload.get_routes()
+            if options['routes']:
+                unknown = set(options['routes']) - set(routes)
+                if unknown:
+                    raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}. '
+                                       f'Choose from: {", ".join(routes)}')
+                routes = {name: route for name, route in routes.items() if name in options['routes']}
+
+            for name, (share, make_request) in routes.items():
+                if name == 'bookings delete':
+                    workload.record_created_bookings()
+                total = max(5, round(options['requests'] * share))
+                self.stderr.write(f'{name} ({total} requests)...')
+                rng = workload.get_random(name)
+                if options['server'] == 'client':
+                    report['routes'][name] = self.run_client(lambda: make_request(rng), total)
+                else:
+                    report['routes'][name] = self.run_live(lambda: make_request(rng), total, options['concurrency'])
+
+        output = json.dumps(report, indent=4)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(options['compare'], report)
+
+    def run_client(self, make_request, total):
+        """Sends requests one at a time through the test client.
+
+        Args:
+            make_request (callable): Returns (method, path, data) for the next request.
+            total (int): Number of requests.
+
+        Returns:
+            dict: Throughput, latency percentiles, queries per request and status counts.
+        """
+
+        client = Client()
+        timings = []
+        statuses = {}
+        queries = 0
+        elapsed = 0
+        for _ in range(total):
+            method, path, data = make_request()
+            if method == 'GET':
+                path, data = f'{path}?{urlencode(data)}' if data else path, None
+            counter = QueryCounter()
+            with counter.installed():
+                start = time.perf_counter()
+                response = client.generic(method, path, json.dumps(data) if data else '',
+                                          content_type='application/json')
+                timing = time.perf_counter() - start
+            elapsed += timing
+            timings.append(timing * 1000)
+            queries += counter.count
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+        return {
+            'requests': total,
+            'requests_per_second': round(total / elapsed, 1),
+            **get_percentiles(timings),
+            'queries_per_request': round(queries / total, 2),
+            'statuses': statuses,
+        }
+
+    def run_live(self, make_request, total, concurrency):
+        """Sends requests over HTTP to a threaded live server.
+
+        Args:
+            make_request (callable): Returns (method, path, data) for the next request.
+            total (int): Number of requests.
+            concurrency (int): Number of requests in flight at once.
+
+        Returns:
+            dict: Throughput, latency percentiles, queries per request and status counts.
+        """
+
+        def make():
+            method, path, data = make_request()
+            if method == 'GET':
+                return method, f'{path}?{urlencode(data)}' if data else path, None
+            return method, path, data or None
+
+        counter = QueryCounter()
+        with counter.installed(), serve_wsgi() as base_url:
+            result = asyncio.run(run_load(base_url, make, total, concurrency))
+        statuses = result.pop('statuses')
+
+        return {
+            'requests': total,
+            **result,
+            'queries_per_request': round(counter.count / total, 2),
+            'statuses': statuses,
+        }
+
+    def compare(self, path, report):
+        """Prints how each route changed since an earlier report.
+
+        Args:
+            path (str): The earlier report.
+            report (dict): This run's report.
+        """
+
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Changes since {baseline["meta"].get("commit")} (p50, p95, queries per request)'))
+        for name, result in report['routes'].items():
+            before = baseline['routes'].get(name)
+            if not before:
+                self.stdout.write(f'  {name}: new')
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms'):
+                change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0
+                changes.append(f'{before[key]} -> {result[key]} ms ({change:+.0f}%)')
+            changes.append(f'{before["queries_per_request"]} -> {result["queries_per_request"]} queries')
+            style = self.style.ERROR if result['p95_ms'] > before['p95_ms'] * 1.2 else self.style.SUCCESS
+            self.stdout.write(style(f'  {name}: ' + ', '.join(changes)))
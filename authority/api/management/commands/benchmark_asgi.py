@@ -0,0 +1,181 @@
+"""Benchmarks the flight and booking endpoints under WSGI and ASGI servers."""
+
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.benchmarking import run_load, scratch_database, seed_dataset, serve_wsgi, stub_airline
+from api.models import Airline, Airport, Flight, OutboxMessage
+from api.outbox import AsyncOutboxDispatcher, OutboxDispatcher
+
+ENDPOINTS = {
+    'sync': {'flights': '/api/flights/', 'bookings': '/api/bookings/'},
+    'async': {'flights': '/api/async/flights/', 'bookings': '/api/async/bookings/'},
+}
+
+
+@contextmanager
+def serve_asgi():
+    """Serves the project from a single uvicorn event loop.
+
+    Yields:
+        str: The base URL of the server.
+
+    Raises:
+        CommandError: If uvicorn is not installed.
+    """
+
+    try:
+        import uvicorn
+    except ImportError as error:
+        raise CommandError('The ASGI benchmark needs uvicorn (pip install uvicorn)') from error
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(
+        get_asgi_application(), lifespan='off', log_level='warning', access_log=False, backlog=1024))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f'http://127.0.0.1:{sock.getsockname()[1]}'
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+
+class Command(BaseCommand):
+    """Compares the sync endpoints under WSGI with the async endpoints under ASGI."""
+
+    help = 'Benchmarks the flight and booking endpoints under a threaded WSGI server and a uvicorn ASGI ' \
+           'server, and the outbox dispatchers against a slow stub airline, on a seeded scratch database.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--flights', type=int, default=20000,
+                            help='Number of flights to seed.')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Number of requests per run.')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Number of requests in flight at once.')
+        parser.add_argument('--notifications', type=int, default=500,
+                            help='Number of queued notifications to deliver.')
+        parser.add_argument('--latency', type=float, default=0.1,
+                            help='Seconds the stub airline takes to answer.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Seeds a scratch database and runs the benchmark."""
+
+        report = {'servers': {}, 'outbox': {}}
+
+        # Cached responses would hide the cost of the views
+        with scratch_database(in_memory=False), stub_airline(options['latency']) as airline_ip, \
+                override_settings(RESPONSE_CACHE_TIMEOUT=0):
+            self.stdout.write(f'Seeding {options["flights"]} flights...')
+            seed_dataset(num_airports=200, num_flights=options['flights'])
+            Airline.objects.update(ip=airline_ip)
+            Flight.objects.update(available_seats=1000, total_seats=1000)
+            airports = list(Airport.objects.values_list('ident', flat=True))
+            flight_codes = list(Flight.objects.values_list('flight_code', flat=True))
+
+            requests = {
+                'flights': lambda: ('GET', f'?departure_airport={random.choice(airports)}&limit=20', None),
+                'bookings': lambda: ('POST', '', {
+                    'flight': random.choice(flight_codes), 'passport_number': random.randint(10000000, 99999999)}),
+            }
+
+            for server_name, serve in (('wsgi', serve_wsgi), ('asgi', serve_asgi)):
+                with serve() as base_url:
+                    for kind, paths in ENDPOINTS.items():
+                        for endpoint, make_request in requests.items():
+                            self.stdout.write(f'{server_name} {kind} {endpoint}...')
+
+                            def make(path=paths[endpoint], make_request=make_request):
+                                method, query, data = make_request()
+                                return method, path + query, data
+
+                            result = asyncio.run(run_load(base_url, make, options['requests'], options['concurrency']))
+                            report['servers'].setdefault(server_name, {})[f'{kind} {endpoint}'] = result
+
+            report['outbox'] = self.run_outbox(options['notifications'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+            return
+
+        for server_name, results in report['servers'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(server_name))
+            for name, result in results.items():
+                self.stdout.write(f'  {name}: {result["requests_per_second"]} req/s, p50 {result["p50_ms"]} ms, '
+                                  f'p95 {result["p95_ms"]} ms, p99 {result["p99_ms"]} ms, {result["statuses"]}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('outbox'))
+        for name, result in report['outbox'].items():
+            self.stdout.write(f'  {name}: {result["messages_per_second"]} messages/s, {result["counts"]}')
+
+    def run_outbox(self, notifications):
+        """Delivers the same queued notifications with the threaded and the async dispatcher.
+
+        Args:
+            notifications (int): Number of notifications.
+
+        Returns:
+            dict: The throughput and outcome counts of each dispatcher.
+        """
+
+        OutboxMessage.objects.all().delete()
+        airlines = list(Airline.objects.values_list('code', flat=True))
+        OutboxMessage.objects.bulk_create(
+            OutboxMessage(airline_id=airlines[i % len(airlines)], booking_ref=f'{i:010d}', method='POST',
+                          path='/api/bookings/', payload={'booking_ref': f'{i:010d}'})
+            for i in range(notifications))
+
+        report = {}
+        for name in ('threaded', 'async'):
+            OutboxMessage.objects.update(status=OutboxMessage.PENDING, attempts=0, sent_at=None)
+            totals = {'sent': 0, 'retried': 0, 'failed': 0, 'deferred': 0, 'held': 0}
+
+            start = time.perf_counter()
+            if name == 'async':
+                dispatcher = AsyncOutboxDispatcher()
+
+                async def drain():
+                    while True:
+                        counts = await dispatcher.adispatch()
+                        if not any(counts.values()):
+                            break
+                        for key, value in counts.items():
+                            totals[key] += value
+                    await dispatcher.aclose()
+
+                asyncio.run(drain())
+            else:
+                dispatcher = OutboxDispatcher()
+                while True:
+                    counts = dispatcher.dispatch()
+                    if not any(counts.values()):
+                        break
+                    for key, value in counts.items():
+                        totals[key] += value
+            elapsed = time.perf_counter() - start
+
+            report[name] = {'messages_per_second': round(totals['sent'] / elapsed, 1), 'counts': totals}
+
+        return report
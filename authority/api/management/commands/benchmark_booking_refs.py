@@ -0,0 +1,112 @@
+"""Benchmarks the booking reference generator against probing the database for free references."""
+
+import json
+import multiprocessing
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.benchmarking import generate_booking_refs, scratch_database, seed_dataset
+from api.models import Booking, Flight
+
+
+def probe_booking_ref():
+    """Picks random references until the database has no booking with one, as bookings used to.
+
+    Returns:
+        str: The booking reference.
+    """
+
+    booking_ref = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+    while Booking.objects.filter(booking_ref=booking_ref).exists():
+        booking_ref = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+    return booking_ref
+
+
+class Command(BaseCommand):
+    """Reports references per second and checks references from many processes are unique."""
+
+    help = 'Measures booking references per second from the generator and from probing a seeded ' \
+           'scratch database, and checks references made by several processes at once never repeat.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--count', type=int, default=100000,
+                            help='Number of references per run, and per process.')
+        parser.add_argument('--processes', type=int, default=4,
+                            help='Number of processes making references at once.')
+        parser.add_argument('--bookings', type=int, default=100000,
+                            help='Number of bookings to seed before probing.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Runs the benchmark."""
+
+        count = options['count']
+        report = {}
+
+        start = time.perf_counter()
+        refs = generate_booking_refs(count)
+        elapsed = time.perf_counter() - start
+        report['generator'] = {
+            'refs': count,
+            'refs_per_second': round(count / elapsed),
+            'duplicates': count - len(set(refs)),
+        }
+
+        # Forked workers each get their own node, as forked server workers do
+        start = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+            batches = pool.map(generate_booking_refs, [count] * options['processes'])
+        elapsed = time.perf_counter() - start
+        total = count * options['processes']
+        report['processes'] = {
+            'processes': options['processes'],
+            'refs': total,
+            'refs_per_second': round(total / elapsed),
+            'duplicates': total - len({ref for batch in batches for ref in batch}),
+        }
+
+        with scratch_database():
+            self.stdout.write(f'Seeding {options["bookings"]} bookings...')
+            seed_dataset(num_airports=20, num_flights=100, num_bookings=options['bookings'])
+
+            # Probing makes a query per reference, so time fewer of them
+            probes = max(1, count // 10)
+            start = time.perf_counter()
+            for _ in range(probes):
+                probe_booking_ref()
+            elapsed = time.perf_counter() - start
+            report['probing'] = {'refs': probes, 'refs_per_second': round(probes / elapsed)}
+
+            flight = Flight.objects.first()
+            Flight.objects.filter(pk=flight.pk).update(total_seats=10, available_seats=10)
+            # The probes overflowed the query log, which would hide the new queries
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as queries:
+                Booking.objects.create(flight=flight, passport_number=12345678)
+            report['queries_per_booking'] = len(queries)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+            return
+
+        for name in ('generator', 'processes', 'probing'):
+            self.stdout.write(f'{name}: ' + ', '.join(f'{key}: {value}' for key, value in report[name].items()))
+        self.stdout.write(f'queries per booking: {report["queries_per_booking"]}')
+
+        if report['generator']['duplicates'] or report['processes']['duplicates']:
+            self.stdout.write(self.style.ERROR('References repeated'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No reference repeated'))
@@ -0,0 +1,141 @@
+"""Benchmarks the flight search queries with and without the flight indexes."""
+
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.benchmarking import SCHEDULE_START, scratch_database, seed_dataset, time_call
+from api.filters import FlightFilter
+from api.models import Flight
+from api.pagination import FlightCursorPagination
+
+
+class Command(BaseCommand):
+    """Compares query plans and latency of the flight searches before and after indexing."""
+
+    help = 'Benchmarks the FlightFilter searches with and without the flight indexes ' \
+           'on a seeded scratch database.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--airports', type=int, default=500,
+                            help='Number of airports to seed.')
+        parser.add_argument('--flights', type=int, default=200000,
+                            help='Number of flights to seed.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs per query.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Seeds a scratch database and runs the benchmark."""
+
+        with scratch_database():
+            self.stdout.write(f'Seeding {options["flights"]} flights...')
+            seed_dataset(num_airports=options['airports'], num_flights=options['flights'])
+
+            searches = self.get_searches()
+            report = {'flights': options['flights'], 'searches': {}}
+
+            # Run the searches without the indexes, then recreate them and run again
+            self.set_indexes(False)
+            for name, params in searches.items():
+                report['searches'][name] = {'params': params, 'before': self.run(params, options['repeat'])}
+
+            self.set_indexes(True)
+            for name, params in searches.items():
+                report['searches'][name]['after'] = self.run(params, options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+            return
+
+        for name, result in report['searches'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name} {result["params"]}'))
+            for stage in ('before', 'after'):
+                timing = result[stage]['timing']
+                self.stdout.write(f'  {stage}: {timing["median_ms"]} ms median')
+                for line in result[stage]['plan']:
+                    self.stdout.write(f'    {line}')
+
+    def get_searches(self):
+        """Builds representative searches from the seeded data.
+
+        Returns:
+            dict: The query parameters of each search by name.
+        """
+
+        flight = Flight.objects.order_by('flight_code').first()
+        window_start = SCHEDULE_START + timedelta(days=120)
+        window_end = window_start + timedelta(days=7)
+
+        return {
+            'route': {
+                'departure_airport': flight.departure_airport_id,
+                'destination_airport': flight.destination_airport_id,
+            },
+            'route_and_dates': {
+                'departure_airport': flight.departure_airport_id,
+                'destination_airport': flight.destination_airport_id,
+                'departure_datetime_min': window_start.isoformat(),
+                'departure_datetime_max': (window_start + timedelta(days=90)).isoformat(),
+            },
+            'departure_window': {
+                'departure_datetime_min': window_start.isoformat(),
+                'departure_datetime_max': window_end.isoformat(),
+            },
+            'departure_window_and_price': {
+                'departure_datetime_min': window_start.isoformat(),
+                'departure_datetime_max': window_end.isoformat(),
+                'base_price_min': 100,
+                'base_price_max': 300,
+            },
+            'first_page': {},
+        }
+
+    def set_indexes(self, enabled):
+        """Creates or drops the indexes declared on the Flight model.
+
+        Args:
+            enabled (bool): Whether the indexes should exist.
+        """
+
+        with connection.schema_editor() as editor:
+            for index in Flight._meta.indexes:
+                if enabled:
+                    editor.add_index(Flight, index)
+                else:
+                    editor.remove_index(Flight, index)
+
+        if connection.vendor == 'sqlite':
+            # Refresh the planner statistics for the new set of indexes
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def run(self, params, repeat):
+        """Runs a search the way the flights endpoint does.
+
+        Args:
+            params (dict): The query parameters.
+            repeat (int): Number of timed runs.
+
+        Returns:
+            dict: The query plan and timing of the search.
+        """
+
+        paginator = FlightCursorPagination()
+        flights = FlightFilter(params, queryset=Flight.objects.all()).qs.filter(available_seats__gt=0)
+        page = flights.order_by(*paginator.ordering)[:paginator.default_limit + 1]
+
+        return {
+            'plan': page.explain().splitlines(),
+            # Evaluate a fresh copy each time so the result cache is not reused
+            'timing': time_call(lambda: list(page.all()), repeat),
+        }
@@ -0,0 +1,69 @@
+"""Shows and resets the circuit breakers of the airline servers."""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.models import AirlineCircuit
+
+
+class Command(BaseCommand):
+    """Lists the state of each airline circuit breaker."""
+
+    help = 'Shows the circuit breaker of each airline server that has been sent a notification, ' \
+           'with its recent failures and latency, and resets them.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--reset', metavar='AIRLINE', nargs='*',
+                            help='Close the circuits of these airlines, or of every airline if none is given.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Prints the circuit breakers, after resetting any that were asked for."""
+
+        if options['reset'] is not None:
+            circuits = AirlineCircuit.objects.all()
+            if options['reset']:
+                missing = set(options['reset']) - set(circuits.filter(airline__in=options['reset'])
+                                                      .values_list('airline', flat=True))
+                if missing:
+                    raise CommandError(f'No circuit for airline {", ".join(sorted(missing))}')
+                circuits = circuits.filter(airline__in=options['reset'])
+            # The messages they held back are picked up again when next due
+            reset = circuits.update(state=AirlineCircuit.CLOSED, failures=0, opened_at=None,
+                                    open_seconds=0, retry_at=None, probe_until=None,
+                                    updated_at=timezone.now())
+            self.stdout.write(f'Reset {reset} circuit(s)')
+
+        now = timezone.now()
+        report = [{
+            'airline': circuit.airline_id,
+            'status': circuit.get_status(now),
+            'failures': circuit.failures,
+            'requests': circuit.requests,
+            'latency_ms': round(circuit.latency_ms, 1),
+            'opened_at': circuit.opened_at.isoformat() if circuit.opened_at else None,
+            'retry_at': circuit.retry_at.isoformat() if circuit.retry_at else None,
+        } for circuit in AirlineCircuit.objects.order_by('airline')]
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+            return
+
+        if not report:
+            self.stdout.write('No airline has been sent a notification yet')
+        for row in report:
+            style = self.style.SUCCESS if row['status'] == 'closed' else self.style.ERROR
+            line = f'{row["airline"]}: {style(row["status"])}, {row["failures"]} failure(s), ' \
+                   f'{row["latency_ms"]} ms average over {row["requests"]} request(s)'
+            if row['retry_at']:
+                line += f', probe at {row["retry_at"]}'
+            self.stdout.write(line)
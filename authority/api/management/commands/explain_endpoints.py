@@ -0,0 +1,167 @@
+"""Audits the query plans of the statements run by every API endpoint."""
+
+import json
+import os
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from api.benchmarking import Workload, scratch_database, seed_dataset
+from api.query_plans import FLAG_DESCRIPTIONS, StatementCollector, audit, get_key
+
+BASELINE_PATH = os.path.join(settings.BASE_DIR, 'api', 'explain_baseline.json')
+
+
+class Command(BaseCommand):
+    """Flags full table scans, temporary B-trees and unindexed joins in the queries of each route."""
+
+    help = 'Sends one representative request to every API route on a seeded scratch database, explains ' \
+           'every statement it runs, and flags full table scans, temporary B-trees and unindexed joins. ' \
+           'With --check, fails if there are findings that the baseline does not have.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--airports', type=int, default=200,
+                            help='Number of airports to seed.')
+        parser.add_argument('--flights', type=int, default=2000,
+                            help='Number of flights to seed.')
+        parser.add_argument('--bookings', type=int, default=2000,
+                            help='Number of bookings to seed.')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Seed for the dataset and the requests.')
+        parser.add_argument('--routes', nargs='*', default=None,
+                            help='Only audit these routes.')
+        parser.add_argument('--baseline', default=BASELINE_PATH,
+                            help='The baseline to compare with or update.')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if any finding is not in the baseline.')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Save the findings as the new baseline.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Audits the routes and compares the findings with the baseline."""
+
+        report = {'database': connection.vendor, 'routes': {}}
+        with scratch_database(), override_settings(RESPONSE_CACHE_TIMEOUT=0):
+            seed_dataset(num_airports=options['airports'], num_flights=options['flights'],
+                         num_bookings=options['bookings'], seed=options['seed'])
+
+            workload = Workload(options['seed'])
+            routes = workload.get_routes()
+            if options['routes']:
+                unknown = set(options['routes']) - set(routes)
+                if unknown:
+                    raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}. '
+                                       f'Choose from: {", ".join(routes)}')
+                routes = {name: route for name, route in routes.items() if name in options['routes']}
+
+            client = Client()
+            for name, (_, make_request) in routes.items():
+                if name == 'bookings delete':
+                    workload.record_created_bookings()
+                method, path, data = make_request(workload.get_random(name))
+                if method == 'GET':
+                    path, data = f'{path}?{urlencode(data)}' if data else path, None
+                with StatementCollector().installed() as collector:
+                    response = client.generic(method, path, json.dumps(data) if data else '',
+                                              content_type='application/json')
+                report['routes'][name] = {
+                    'method': method,
+                    'path': path,
+                    'status': response.status_code,
+                    'statements': len(collector.statements),
+                    'findings': audit(collector.statements),
+                }
+
+        if options['update_baseline']:
+            self.save_baseline(options['baseline'], report)
+
+        regressions = []
+        if options['check']:
+            regressions = self.compare(options['baseline'], report)
+
+        if options['json']:
+            self.stdout.write(json.dumps({**report, 'regressions': regressions}, indent=4))
+        else:
+            self.print_report(report, regressions if options['check'] else None)
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} query plan findings are not in the baseline')
+
+    def save_baseline(self, path, report):
+        """Saves the findings of every route as the baseline.
+
+        Args:
+            path (str): The baseline file.
+            report (dict): The report.
+        """
+
+        baseline = {'database': report['database'], 'routes': {
+            name: [{key: finding[key] for key in ('flag', 'table', 'fingerprint', 'sql')}
+                   for finding in route['findings']]
+            for name, route in report['routes'].items()
+        }}
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(baseline, file, indent=4)
+            file.write('\n')
+        self.stderr.write(f'Saved the baseline to {path}')
+
+    def compare(self, path, report):
+        """Finds the findings that the baseline does not have.
+
+        Args:
+            path (str): The baseline file.
+            report (dict): The report.
+
+        Raises:
+            CommandError: If the baseline is missing or comes from another database.
+
+        Returns:
+            list: The new findings, each with its route.
+        """
+
+        try:
+            with open(path, encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError as error:
+            raise CommandError(f'No baseline at {path}, create one with --update-baseline') from error
+
+        if baseline['database'] != report['database']:
+            raise CommandError(f'The baseline was made on {baseline["database"]}, not {report["database"]}')
+
+        known = {get_key(name, finding) for name, findings in baseline['routes'].items() for finding in findings}
+        return [{'route': name, **finding}
+                for name, route in report['routes'].items()
+                for finding in route['findings'] if get_key(name, finding) not in known]
+
+    def print_report(self, report, regressions):
+        """Prints the findings of each route.
+
+        Args:
+            report (dict): The report.
+            regressions (list): The findings not in the baseline, or None if not compared.
+        """
+
+        new = {get_key(regression['route'], regression) for regression in regressions or []}
+        for name, route in report['routes'].items():
+            summary = f'{name}: {route["method"]} {route["path"]} -> {route["status"]}, ' \
+                      f'{route["statements"]} statements'
+            style = self.style.WARNING if route['findings'] else self.style.SUCCESS
+            self.stdout.write(style(summary))
+            for finding in route['findings']:
+                marker = 'NEW ' if get_key(name, finding) in new else ''
+                table = f' {finding["table"]}' if finding['table'] else ''
+                line = f'  {marker}{finding["flag"]}{table}: {FLAG_DESCRIPTIONS[finding["flag"]]} ' \
+                       f'({finding["detail"]})\n    {finding["sql"][:200]}'
+                self.stdout.write(self.style.ERROR(line) if marker else line)
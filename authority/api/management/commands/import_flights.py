@@ -0,0 +1,69 @@
+"""Imports a schedule of flights from a CSV or NDJSON file."""
+
+import json
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk import FLIGHT_IMPORT_CHUNK_SIZE, FLIGHT_IMPORT_FORMATS, import_flights, read_flight_rows
+
+
+class Command(BaseCommand):
+    """Creates or updates flights in bulk, reporting the rows that could not be imported."""
+
+    help = 'Creates or updates the flights in a CSV or NDJSON file, a chunk at a time, ' \
+           'and reports the rows that were rejected.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('file',
+                            help='The file to import, or - to read standard input.')
+        parser.add_argument('--format', choices=sorted(FLIGHT_IMPORT_FORMATS), default=None,
+                            help='The format of the file. Defaults to its extension.')
+        parser.add_argument('--chunk-size', type=int, default=FLIGHT_IMPORT_CHUNK_SIZE,
+                            help='Number of flights written per statement.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Imports the file and prints the report."""
+
+        file_format = options['format']
+        if not file_format:
+            file_format = os.path.splitext(options['file'])[1].lstrip('.').lower()
+            if file_format not in FLIGHT_IMPORT_FORMATS:
+                raise CommandError('Cannot tell the format from the file name, use --format')
+
+        start = time.perf_counter()
+        if options['file'] == '-':
+            report = import_flights(read_flight_rows(sys.stdin, file_format), options['chunk_size'])
+        else:
+            try:
+                with open(options['file'], newline='', encoding='utf-8') as lines:
+                    report = import_flights(read_flight_rows(lines, file_format), options['chunk_size'])
+            except OSError as error:
+                raise CommandError(f'Cannot read {options["file"]}: {error}') from error
+        elapsed = time.perf_counter() - start
+        report['elapsed_s'] = round(elapsed, 3)
+        report['rows_per_second'] = round(report['rows'] / elapsed, 1) if elapsed else None
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+            return
+
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f'Row {error["row"]}: ' + '; '.join(
+                f'{field}: {message}' for field, message in error['errors'].items())))
+        if report['rejected'] > len(report['errors']):
+            self.stdout.write(self.style.WARNING(f'... and {report["rejected"] - len(report["errors"])} more'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {report["rows"]} rows in {report["elapsed_s"]} s ({report["rows_per_second"]} rows/s): '
+            f'{report["created"]} created, {report["updated"]} updated, {report["rejected"]} rejected'))
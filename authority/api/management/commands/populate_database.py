@@ -3,13 +3,17 @@
 import csv
 import os
 import random
+import time
 from datetime import datetime, timedelta
 
 import django
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils.timezone import make_aware
 
+from api.caching import invalidate
 from api.models import City, Country, Airport, Airline, Flight, Booking
+from api.search import index_airports
 
 # Set seed for random
 random.seed(42)
@@ -21,6 +25,8 @@ django.setup()
 AIRPORTS_FILE = 'api/static/data/airports.csv'
 NUM_FLIGHTS = 3
 NUM_BOOKINGS_PER_FLIGHT = 3
+# Airports inserted per transaction by the bulk loader
+BULK_BATCH_SIZE = 5000
 
 
 class Command(BaseCommand):
@@ -28,11 +34,26 @@ class Command(BaseCommand):
 
     help = 'Populates the database with sample data'
 
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--bulk', action='store_true',
+                            help='Load every airport in the file with bulk inserts, instead of a sample row by row.')
+        parser.add_argument('--file', default=AIRPORTS_FILE,
+                            help='The airports CSV file.')
+
     def handle(self, *args, **options):
         """Calls the functions to populate the database."""
 
         self.populate_airlines()
-        self.populate_airports(AIRPORTS_FILE)
+        if options['bulk']:
+            self.bulk_load_airports(options['file'])
+        else:
+            self.populate_airports(options['file'])
         # Do not generate flights as the airline can do this instead
         # self.generate_flights(NUM_FLIGHTS)  # Also generates bookings
 
@@ -125,6 +146,92 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING(
                 f'{missing} airports missing id!'))
 
+    def bulk_load_airports(self, file_path):
+        """Loads every airport in the file, with its countries and cities, using bulk inserts.
+
+        The file is read once and the existing countries, cities and airports are
+        loaded into dictionaries up front, so no query is made per row. A row is
+        skipped if it has no ident or city, if its ident or name is already taken,
+        or if its latitude or longitude is not a number. Unlike populate_airports,
+        every row is read rather than a sample, and a city is told apart by its
+        name and country, so cities of the same name in different countries are
+        kept apart.
+
+        Args:
+            file_path (str): The airports CSV file.
+        """
+
+        start = time.perf_counter()
+        countries = {country.name: country for country in Country.objects.all()}
+        cities = {(name, country): city_id for city_id, name, country
+                  in City.objects.values_list('id', 'name', 'country')}
+        idents = set(Airport.objects.values_list('ident', flat=True))
+        names = set(Airport.objects.values_list('name', flat=True))
+
+        rows = []
+        new_countries = {}
+        new_cities = set()
+        skipped = 0
+        with open(file_path, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                # Airports without an id, a city or a position are skipped, as are repeated ones
+                if not row['ident'] or not row['city'] or row['ident'] in idents or row['name'] in names:
+                    skipped += 1
+                    continue
+                try:
+                    row['latitude'], row['longitude'] = float(row['latitude']), float(row['longitude'])
+                except ValueError:
+                    skipped += 1
+                    continue
+
+                idents.add(row['ident'])
+                names.add(row['name'])
+                if row['country'] not in countries and row['country'] not in new_countries:
+                    new_countries[row['country']] = Country(name=row['country'], continent=row['continent'])
+                if (row['city'], row['country']) not in cities:
+                    new_cities.add((row['city'], row['country']))
+                rows.append(row)
+
+        self.stdout.write(f'Read {len(rows) + skipped} rows, {skipped} skipped, '
+                          f'in {time.perf_counter() - start:.2f} s')
+
+        with transaction.atomic():
+            Country.objects.bulk_create(new_countries.values(), batch_size=BULK_BATCH_SIZE)
+            City.objects.bulk_create(
+                [City(name=name, country_id=country) for name, country in new_cities], batch_size=BULK_BATCH_SIZE)
+        # Read the new ids back, since not every database returns them from a bulk insert
+        cities = {(name, country): city_id for city_id, name, country
+                  in City.objects.values_list('id', 'name', 'country')}
+        self.stdout.write(f'Added {len(new_countries)} countries and {len(new_cities)} cities')
+
+        loaded = 0
+        load_start = time.perf_counter()
+        for batch_start in range(0, len(rows), BULK_BATCH_SIZE):
+            batch = rows[batch_start:batch_start + BULK_BATCH_SIZE]
+            with transaction.atomic():
+                Airport.objects.bulk_create([Airport(
+                    ident=row['ident'],
+                    name=row['name'],
+                    city_id=cities[row['city'], row['country']],
+                    region=row['region'],
+                    size_type=row['size_type'],
+                    latitude=row['latitude'],
+                    longitude=row['longitude'],
+                    elevation=row['elevation'],
+                ) for row in batch])
+            loaded += len(batch)
+            self.stdout.write(f'{loaded}/{len(rows)} airports '
+                              f'({loaded / (time.perf_counter() - load_start):.0f} rows/s)')
+
+        # Bulk inserts send no signals, so index the new airports for search and drop the cached
+        # responses here. The servers' in-memory indexes pick them up when they next expire.
+        index_airports(row['ident'] for row in rows)
+        invalidate('airport', 'city', 'country')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{loaded} airports added successfully in {elapsed:.2f} s!'))
+
     def generate_flights(self, num_flights=NUM_FLIGHTS):
         """Generates random flights.
 
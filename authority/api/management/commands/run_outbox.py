@@ -0,0 +1,101 @@
+"""Delivers the queued airline notifications in the background."""
+
+import asyncio
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.airlines import airline_client
+from api.outbox import ASYNC_OUTBOX_PER_AIRLINE, ASYNC_OUTBOX_WORKERS, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, \
+    OUTBOX_PER_AIRLINE, OUTBOX_WORKERS, AsyncOutboxDispatcher, OutboxDispatcher
+
+
+class Command(BaseCommand):
+    """Drains the outbox, sending booking notifications to the airline servers."""
+
+    help = 'Sends the queued booking notifications to the airline servers, ' \
+           'retrying failures with exponential backoff.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help=f'Number of messages claimed at a time. Defaults to {OUTBOX_BATCH_SIZE}, '
+                                 f'or {ASYNC_OUTBOX_WORKERS} with --async.')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Send from an event loop instead of a thread pool.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help=f'Number of concurrent requests in total. Defaults to {OUTBOX_WORKERS}, '
+                                 f'or {ASYNC_OUTBOX_WORKERS} with --async.')
+        parser.add_argument('--per-airline', type=int, default=None,
+                            help=f'Number of concurrent requests per airline. Defaults to {OUTBOX_PER_AIRLINE}, '
+                                 f'or {ASYNC_OUTBOX_PER_AIRLINE} with --async.')
+        parser.add_argument('--timeout', type=float, default=None,
+                            help='Seconds to wait for an airline server. Defaults to AIRLINE_READ_TIMEOUT.')
+        parser.add_argument('--max-attempts', type=int, default=OUTBOX_MAX_ATTEMPTS,
+                            help='Number of attempts before a message is marked as failed.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when there is nothing to send.')
+        parser.add_argument('--retention', type=float, default=168,
+                            help='Hours to keep delivered messages.')
+        parser.add_argument('--once', action='store_true',
+                            help='Send everything that is due, then exit.')
+
+    def handle(self, *args, **options):
+        """Runs the dispatcher until interrupted."""
+
+        common = {
+            'timeout': options['timeout'],
+            'max_attempts': options['max_attempts'],
+        }
+        if options['use_async']:
+            dispatcher = AsyncOutboxDispatcher(
+                batch_size=options['batch_size'] or ASYNC_OUTBOX_WORKERS, workers=options['workers'] or ASYNC_OUTBOX_WORKERS,
+                per_airline=options['per_airline'] or ASYNC_OUTBOX_PER_AIRLINE, **common)
+            # One loop for the whole run, since it owns the pooled connections
+            loop = asyncio.new_event_loop()
+
+            def dispatch():
+                return loop.run_until_complete(dispatcher.adispatch())
+
+            client = dispatcher.client
+        else:
+            dispatcher = OutboxDispatcher(
+                batch_size=options['batch_size'] or OUTBOX_BATCH_SIZE, workers=options['workers'] or OUTBOX_WORKERS,
+                per_airline=options['per_airline'] or OUTBOX_PER_AIRLINE, **common)
+            dispatch = dispatcher.dispatch
+            client = airline_client
+        retention = timedelta(hours=options['retention'])
+
+        try:
+            while True:
+                close_old_connections()
+                counts = dispatch()
+                if any(counts.values()):
+                    self.stdout.write(', '.join(f'{key}: {value}' for key, value in counts.items()))
+                    continue
+
+                # Nothing is due, so tidy up before waiting
+                purged = dispatcher.purge(retention)
+                if purged:
+                    self.stdout.write(f'purged: {purged}')
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
+
+        for ip, stats in client.stats().items():
+            self.stdout.write(f'{ip}: ' + ', '.join(f'{key}: {value}' for key, value in stats.items()))
+
+        if options['use_async']:
+            loop.run_until_complete(dispatcher.aclose())
+            loop.close()
+        else:
+            airline_client.close()
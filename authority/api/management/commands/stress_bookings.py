@@ -0,0 +1,121 @@
+"""Books one flight from many threads at once to check the seat inventory under contention."""
+
+import json
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from api.benchmarking import scratch_database, seed_dataset
+from api.models import Booking, Flight, NoSeatsAvailable
+
+
+class Command(BaseCommand):
+    """Races concurrent bookings for a flight and reports throughput and overselling."""
+
+    help = 'Books a single flight from many threads on a scratch database, ' \
+           'checks that no seat is sold twice and reports bookings per second.'
+
+    def add_arguments(self, parser):
+        """Adds the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The argument parser.
+        """
+
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Number of concurrent booking threads.')
+        parser.add_argument('--seats', type=int, default=200,
+                            help='Number of seats on the flight.')
+        parser.add_argument('--attempts', type=int, default=50,
+                            help='Number of booking attempts per thread.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Seeds a scratch database and runs the stress test."""
+
+        with scratch_database(in_memory=False):
+            seed_dataset(num_airports=10, num_flights=1)
+            flight = Flight.objects.get()
+            Flight.objects.filter(pk=flight.pk).update(
+                total_seats=options['seats'], available_seats=options['seats'])
+
+            report = self.run(flight.pk, options['threads'], options['attempts'])
+
+            flight.refresh_from_db()
+            report.update({
+                'seats': options['seats'],
+                'available_seats': flight.available_seats,
+                'bookings_stored': Booking.objects.filter(flight=flight).count(),
+            })
+
+        # Every stored booking holds exactly one seat, and none is sold twice
+        report['oversold'] = report['bookings_stored'] > report['seats'] or report['available_seats'] < 0
+        report['consistent'] = report['bookings_stored'] == report['seats'] - report['available_seats']
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=4))
+            return
+
+        for key, value in report.items():
+            self.stdout.write(f'{key}: {value}')
+
+        if report['oversold'] or not report['consistent']:
+            self.stdout.write(self.style.ERROR('Seat inventory is inconsistent'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No seats were oversold'))
+
+    def run(self, flight_code, threads, attempts):
+        """Books the flight from several threads at once.
+
+        Args:
+            flight_code (str): The code of the flight to book.
+            threads (int): Number of threads.
+            attempts (int): Number of booking attempts per thread.
+
+        Returns:
+            dict: The outcome counts and the throughput.
+        """
+
+        counts = {'booked': 0, 'full': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads + 1)
+
+        def book():
+            flight = Flight.objects.get(pk=flight_code)
+            outcomes = {'booked': 0, 'full': 0, 'errors': 0}
+            barrier.wait()
+            for _ in range(attempts):
+                try:
+                    Booking.objects.create(flight=flight, passport_number=random.randint(10000000, 99999999))
+                    outcomes['booked'] += 1
+                except NoSeatsAvailable:
+                    outcomes['full'] += 1
+                except OperationalError:
+                    # e.g. the SQLite busy timeout running out
+                    outcomes['errors'] += 1
+            connection.close()
+            with lock:
+                for key, value in outcomes.items():
+                    counts[key] += value
+
+        workers = [threading.Thread(target=book) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+
+        barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        return {
+            'threads': threads,
+            'attempts': threads * attempts,
+            **counts,
+            'elapsed_s': round(elapsed, 3),
+            'bookings_per_second': round(counts['booked'] / elapsed, 1) if elapsed else None,
+        }
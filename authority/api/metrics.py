@@ -0,0 +1,114 @@
+"""This module contains the Prometheus metrics of the API and the /metrics view.
+
+When the PROMETHEUS_MULTIPROC_DIR environment variable names a directory,
+every process, web workers and run_outbox alike, writes its samples to
+memory-mapped files in it, and /metrics adds up the files of all of them.
+The directory must exist and be emptied before the processes start.
+Without it, /metrics only shows the samples of the process that answers.
+"""
+
+import os
+
+from django.db import transaction
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+
+# Seconds, from a cached response up to the airline read timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+# Anything else is counted as 'other', so odd methods cannot add label values
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+REQUESTS = Counter(
+    'api_requests', 'Requests answered, by route name, method and status code.',
+    ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Time taken to answer a request, by route name and method.',
+    ['route', 'method'], buckets=LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'api_request_queries', 'Database queries run per request, by route name and method.',
+    ['route', 'method'], buckets=QUERY_BUCKETS)
+BOOKINGS_CREATED = Counter(
+    'api_bookings_created', 'Bookings created, by airline code.', ['airline'])
+BOOKINGS_DELETED = Counter(
+    'api_bookings_deleted', 'Bookings deleted, by airline code.', ['airline'])
+AIRLINE_LATENCY = Histogram(
+    'api_airline_request_duration_seconds', 'Time airline servers took to answer a notification, by airline code.',
+    ['airline'], buckets=LATENCY_BUCKETS)
+AIRLINE_ERRORS = Counter(
+    'api_airline_errors', 'Notifications an airline server failed to accept, by airline code and whether '
+    'they will be retried.', ['airline', 'retry'])
+
+
+def observe_request(route, method, status_code, duration, queries):
+    """Records an answered request.
+
+    Args:
+        route (str): The name of the URL pattern, or None if no pattern matched.
+        method (str): The HTTP method.
+        status_code (int): The status code of the response.
+        duration (float): Seconds taken to answer.
+        queries (int): Database queries run.
+    """
+
+    route = route or 'unmatched'
+    method = method if method in METHODS else 'other'
+    REQUESTS.labels(route, method, str(status_code)).inc()
+    REQUEST_LATENCY.labels(route, method).observe(duration)
+    REQUEST_QUERIES.labels(route, method).observe(queries)
+
+
+def count_bookings(counter, airline, count=1):
+    """Counts bookings once the transaction that made or removed them commits.
+
+    Args:
+        counter (Counter): BOOKINGS_CREATED or BOOKINGS_DELETED.
+        airline (str): The airline code.
+        count (int, optional): Number of bookings. Defaults to 1.
+    """
+
+    transaction.on_commit(lambda: counter.labels(airline).inc(count))
+
+
+def observe_airline(airline, latency_ms, error):
+    """Records the answer of an airline server to a notification.
+
+    Args:
+        airline (str): The airline code.
+        latency_ms (float): Milliseconds the airline took to answer.
+        error (DeliveryError): Why the airline did not accept the notification, or None.
+    """
+
+    AIRLINE_LATENCY.labels(airline).observe(latency_ms / 1000)
+    if error is not None:
+        AIRLINE_ERRORS.labels(airline, str(error.retry).lower()).inc()
+
+
+def get_registry():
+    """Gets the registry to expose.
+
+    Returns:
+        CollectorRegistry: A registry adding up the samples of every process when
+            PROMETHEUS_MULTIPROC_DIR is set, otherwise the registry of this process.
+    """
+
+    if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    """Exposes the metrics in the Prometheus text format.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        HttpResponse: The metrics.
+    """
+
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
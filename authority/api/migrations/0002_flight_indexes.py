@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['departure_airport', 'destination_airport', 'departure_datetime'], name='flight_route_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['departure_datetime', 'flight_code'], name='flight_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(condition=models.Q(('available_seats__gt', 0)), fields=['departure_datetime', 'flight_code'], name='flight_bookable_idx'),
+        ),
+    ]
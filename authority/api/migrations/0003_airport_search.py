@@ -0,0 +1,86 @@
+# Full-text search over airports using an SQLite FTS5 table kept in sync by triggers.
+#
+# The triggers live on api_airport and api_city. A later migration that makes
+# Django rebuild either table on SQLite drops them, so it must run
+# create_search_index again.
+
+from django.db import migrations
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_airport_fts USING fts5(
+        ident UNINDEXED, name, region, city, country,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO api_airport_fts (ident, name, region, city, country)
+    SELECT a.ident, a.name, a.region, c.name, c.country_id
+    FROM api_airport a JOIN api_city c ON c.id = a.city_id
+    """,
+    """
+    CREATE TRIGGER api_airport_fts_insert AFTER INSERT ON api_airport BEGIN
+        INSERT INTO api_airport_fts (ident, name, region, city, country)
+        SELECT new.ident, new.name, new.region, c.name, c.country_id
+        FROM api_city c WHERE c.id = new.city_id;
+    END
+    """,
+    """
+    CREATE TRIGGER api_airport_fts_update AFTER UPDATE ON api_airport BEGIN
+        DELETE FROM api_airport_fts WHERE ident = old.ident;
+        INSERT INTO api_airport_fts (ident, name, region, city, country)
+        SELECT new.ident, new.name, new.region, c.name, c.country_id
+        FROM api_city c WHERE c.id = new.city_id;
+    END
+    """,
+    """
+    CREATE TRIGGER api_airport_fts_delete AFTER DELETE ON api_airport BEGIN
+        DELETE FROM api_airport_fts WHERE ident = old.ident;
+    END
+    """,
+    """
+    CREATE TRIGGER api_city_fts_update AFTER UPDATE OF name, country_id ON api_city BEGIN
+        UPDATE api_airport_fts SET city = new.name, country = new.country_id
+        WHERE ident IN (SELECT ident FROM api_airport WHERE city_id = new.id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS api_city_fts_update',
+    'DROP TRIGGER IF EXISTS api_airport_fts_delete',
+    'DROP TRIGGER IF EXISTS api_airport_fts_update',
+    'DROP TRIGGER IF EXISTS api_airport_fts_insert',
+    'DROP TABLE IF EXISTS api_airport_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Creates and fills the FTS5 table on SQLite. Other databases fall back to LIKE searches."""
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for statement in DROP_SQL + CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    """Drops the FTS5 table and its triggers."""
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_flight_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AirlineCircuit',
+            fields=[
+                ('airline', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='api.airline')),
+                ('state', models.CharField(choices=[('closed', 'Closed'), ('open', 'Open')], default='closed', max_length=10)),
+                ('failures', models.IntegerField(default=0)),
+                ('requests', models.IntegerField(default=0)),
+                ('latency_ms', models.FloatField(default=0)),
+                ('opened_at', models.DateTimeField(blank=True, null=True)),
+                ('open_seconds', models.FloatField(default=0)),
+                ('retry_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
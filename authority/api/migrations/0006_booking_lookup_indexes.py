@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-17 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_airline_circuits'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['passport_number', 'booking_ref'], name='booking_passport_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['flight', 'passport_number'], name='booking_flight_passport_idx'),
+        ),
+    ]
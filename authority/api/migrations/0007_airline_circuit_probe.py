@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-17 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_booking_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airlinecircuit',
+            name='probe_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Keys the FTS5 rows of airports by the rowid of api_airport instead of an
+# UNINDEXED ident column, so the triggers and the search join look rows up
+# directly instead of scanning the whole FTS table.
+#
+# api_airport has no integer primary key, so VACUUM may renumber its rowids.
+# Run create_search_index again after one, as after a table rebuild.
+
+from importlib import import_module
+
+from django.db import migrations
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_airport_fts USING fts5(
+        name, region, city, country,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO api_airport_fts (rowid, name, region, city, country)
+    SELECT a.rowid, a.name, a.region, c.name, c.country_id
+    FROM api_airport a JOIN api_city c ON c.id = a.city_id
+    """,
+    """
+    CREATE TRIGGER api_airport_fts_insert AFTER INSERT ON api_airport BEGIN
+        INSERT INTO api_airport_fts (rowid, name, region, city, country)
+        SELECT new.rowid, new.name, new.region, c.name, c.country_id
+        FROM api_city c WHERE c.id = new.city_id;
+    END
+    """,
+    """
+    CREATE TRIGGER api_airport_fts_update AFTER UPDATE ON api_airport BEGIN
+        DELETE FROM api_airport_fts WHERE rowid = old.rowid;
+        INSERT INTO api_airport_fts (rowid, name, region, city, country)
+        SELECT new.rowid, new.name, new.region, c.name, c.country_id
+        FROM api_city c WHERE c.id = new.city_id;
+    END
+    """,
+    """
+    CREATE TRIGGER api_airport_fts_delete AFTER DELETE ON api_airport BEGIN
+        DELETE FROM api_airport_fts WHERE rowid = old.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER api_city_fts_update AFTER UPDATE OF name, country_id ON api_city BEGIN
+        UPDATE api_airport_fts SET city = new.name, country = new.country_id
+        WHERE rowid IN (SELECT rowid FROM api_airport WHERE city_id = new.id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS api_city_fts_update',
+    'DROP TRIGGER IF EXISTS api_airport_fts_delete',
+    'DROP TRIGGER IF EXISTS api_airport_fts_update',
+    'DROP TRIGGER IF EXISTS api_airport_fts_insert',
+    'DROP TABLE IF EXISTS api_airport_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Recreates and fills the FTS5 table on SQLite, keyed by airport rowid."""
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for statement in DROP_SQL + CREATE_SQL:
+        schema_editor.execute(statement)
+
+
+def restore_search_index(apps, schema_editor):
+    """Goes back to the FTS5 table keyed by ident."""
+
+    import_module('api.migrations.0003_airport_search').create_search_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_airline_circuit_probe'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, restore_search_index),
+    ]
@@ -0,0 +1,66 @@
+# Replaces the triggers that kept api_airport_fts in sync with signal handlers
+# in api/search.py. The triggers named api_airport, so Django could no longer
+# rebuild that table on SQLite to alter one of its fields. The FTS rows now hold
+# the ident of their airport and are keyed by a hash of it rather than by the
+# rowid of api_airport, which VACUUM may renumber.
+
+import hashlib
+from importlib import import_module
+
+from django.db import migrations
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS api_city_fts_update',
+    'DROP TRIGGER IF EXISTS api_airport_fts_delete',
+    'DROP TRIGGER IF EXISTS api_airport_fts_update',
+    'DROP TRIGGER IF EXISTS api_airport_fts_insert',
+    'DROP TABLE IF EXISTS api_airport_fts',
+]
+
+CREATE_SQL = """
+    CREATE VIRTUAL TABLE api_airport_fts USING fts5(
+        ident UNINDEXED, name, region, city, country,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+"""
+
+
+def get_search_key(ident):
+    """Gets the FTS rowid of an airport, as api.search.get_search_key does."""
+
+    return int.from_bytes(hashlib.blake2b(ident.encode(), digest_size=8).digest(), 'big') >> 1
+
+
+def create_search_index(apps, schema_editor):
+    """Recreates and fills the FTS5 table on SQLite, without triggers."""
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+    schema_editor.execute(CREATE_SQL)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT a.ident, a.name, a.region, c.name, c.country_id '
+                       'FROM api_airport a JOIN api_city c ON c.id = a.city_id')
+        rows = [(get_search_key(row[0]), *row) for row in cursor.fetchall()]
+        cursor.executemany('INSERT INTO api_airport_fts (rowid, ident, name, region, city, country) '
+                           'VALUES (%s, %s, %s, %s, %s, %s)', rows)
+
+
+def restore_search_index(apps, schema_editor):
+    """Goes back to the FTS5 table kept in sync by triggers."""
+
+    import_module('api.migrations.0008_airport_search_rowid').create_search_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_airport_search_rowid'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, restore_search_index),
+    ]
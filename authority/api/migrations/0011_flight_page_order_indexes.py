@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-17 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_resource_versions'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='flight',
+            name='flight_route_departure_idx',
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['departure_airport', 'destination_airport', 'departure_datetime', 'flight_code'], name='flight_route_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['departure_airport', 'departure_datetime', 'flight_code'], name='flight_airport_departure_idx'),
+        ),
+    ]
@@ -7,11 +7,19 @@ and unique constraints are specified using the unique=True parameter
 for the respective fields.
 """
 
-import random
-import string
+from datetime import timedelta
 
-import requests
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import BOOKINGS_CREATED, BOOKINGS_DELETED, count_bookings
+from .references import BOOKING_REF_ATTEMPTS, booking_refs
+
+
+class NoSeatsAvailable(Exception):
+    """Raised when a booking is made on a flight with no available seats."""
 
 
 class Country(models.Model):
@@ -108,6 +116,29 @@ class Flight(models.Model):
     available_seats = models.IntegerField(null=False)
     airline = models.ForeignKey(Airline, on_delete=models.CASCADE, null=False)
 
+    class Meta:
+        """Meta class for the Flight model."""
+
+        indexes = [
+            # Route searches, optionally narrowed to a departure window, read in page order
+            models.Index(
+                fields=['departure_airport', 'destination_airport', 'departure_datetime', 'flight_code'],
+                name='flight_route_departure_idx'),
+            # The same for searches from an airport to anywhere
+            models.Index(
+                fields=['departure_airport', 'departure_datetime', 'flight_code'],
+                name='flight_airport_departure_idx'),
+            # Departure windows and the keyset ordering of the flights endpoint
+            models.Index(
+                fields=['departure_datetime', 'flight_code'],
+                name='flight_departure_idx'),
+            # Only bookable flights are ever listed, so keep a smaller index of those
+            models.Index(
+                fields=['departure_datetime', 'flight_code'],
+                condition=models.Q(available_seats__gt=0),
+                name='flight_bookable_idx'),
+        ]
+
     def __str__(self):
         """Returns the string representation of the object.
 
@@ -133,6 +164,30 @@ class Flight(models.Model):
 
         super().save(*args, **kwargs)
 
+    def take_seat(self):
+        """Takes one seat with a single conditional UPDATE.
+
+        The check and the decrement happen in the database, so concurrent
+        bookings can neither oversell the flight nor overwrite each other.
+        The update sends no signals and leaves this instance's count as it was.
+
+        Returns:
+            bool: Whether a seat was available.
+        """
+
+        return Flight.objects.filter(flight_code=self.flight_code, available_seats__gt=0) \
+            .update(available_seats=F('available_seats') - 1) == 1
+
+    def release_seat(self):
+        """Gives one seat back with a single conditional UPDATE.
+
+        Returns:
+            bool: Whether a seat was released.
+        """
+
+        return Flight.objects.filter(flight_code=self.flight_code, available_seats__lt=F('total_seats')) \
+            .update(available_seats=F('available_seats') + 1) == 1
+
 
 class Booking(models.Model):
     """Stores information about a booking."""
@@ -142,6 +197,16 @@ class Booking(models.Model):
     passport_number = models.IntegerField(null=False)
     flight = models.ForeignKey(Flight, on_delete=models.CASCADE, null=False)
 
+    class Meta:
+        """Meta class for the Booking model."""
+
+        indexes = [
+            # A passenger's bookings, in the keyset order of the lookup endpoint
+            models.Index(fields=['passport_number', 'booking_ref'], name='booking_passport_idx'),
+            # A passenger's booking on a flight, and the bookings of a flight
+            models.Index(fields=['flight', 'passport_number'], name='booking_flight_passport_idx'),
+        ]
+
     def __str__(self):
         """Returns the string representation of the object.
 
@@ -156,6 +221,9 @@ class Booking(models.Model):
         """
         Overrides the save method to ensure that the number of available seats
         is updated when a booking is created.
+
+        Raises:
+            NoSeatsAvailable: If the flight is fully booked.
         """
 
         # If this is a new booking (i.e., it doesn't exist in the database yet)
@@ -163,63 +231,257 @@ class Booking(models.Model):
             # Generate booking reference
             self.booking_ref = self.generate_booking_ref()
 
-            # Decrease the number of available seats
-            self.flight.available_seats -= 1
-            self.flight.save()
+            # Take a seat, insert the booking and queue the airline notification together,
+            # so none of them happens without the others
+            with transaction.atomic():
+                if not self.flight.take_seat():
+                    raise NoSeatsAvailable(f'Flight \'{self.flight.flight_code}\' is fully booked')
+
+                # Insert rather than update, so a repeated reference fails instead of overwriting a booking
+                kwargs['force_insert'] = True
+                for attempt in range(BOOKING_REF_ATTEMPTS):
+                    try:
+                        with transaction.atomic():
+                            super(Booking, self).save(*args, **kwargs)
+                        break
+                    except IntegrityError:
+                        if attempt == BOOKING_REF_ATTEMPTS - 1:
+                            raise
+                        self.booking_ref = self.generate_booking_ref()
+
+                # run_outbox sends the notification once the booking is committed
+                self.get_created_notification().save()
+                count_bookings(BOOKINGS_CREATED, self.flight.airline_id)
+            return
+
+        super(Booking, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """
+        Overrides the delete method to ensure that the number of available seats
+        is updated when a booking is deleted.
+        """
+
+        # Deleting clears the primary key, so keep the reference for the notification
+        booking_ref = self.booking_ref
+
+        # Give the seat back, delete the booking and queue the airline notification together
+        with transaction.atomic():
+            self.flight.release_seat()
+            result = super(Booking, self).delete(*args, **kwargs)
+            self.notify_airline('DELETE', f'/api/bookings/?booking_ref={booking_ref}', {
+                'booking_ref': booking_ref
+            })
+            count_bookings(BOOKINGS_DELETED, self.flight.airline_id)
+
+        return result
+
+    def notify_airline(self, method, path, data):
+        """Queues a notification to the airline of the booked flight.
 
-            # Get the airline IP address
-            flight_ip_address = self.flight.airline.ip
+        Args:
+            method (str): The HTTP method.
+            path (str): The path on the airline server.
+            data (dict): The form data, including the booking reference.
 
-            url = f'http://{flight_ip_address}/api/bookings/'
+        Returns:
+            OutboxMessage: The queued message.
+        """
+
+        return OutboxMessage.objects.create(
+            airline_id=self.flight.airline_id, booking_ref=data['booking_ref'],
+            method=method, path=path, payload=data)
 
-            # Make the request data
-            data = {
+    def get_created_notification(self):
+        """Builds the notification of a new booking without saving it, for bulk inserts.
+
+        Returns:
+            OutboxMessage: The unsaved message.
+        """
+
+        return OutboxMessage(
+            airline_id=self.flight.airline_id, booking_ref=self.booking_ref, method='POST', path='/api/bookings/',
+            payload={
                 'booking_ref': self.booking_ref,
                 'passport_number': self.passport_number,
                 'flight': self.flight.flight_code
-            }
+            })
 
-            # Make the request
-            requests.post(url, data=data, timeout=20)
+    @staticmethod
+    def generate_booking_ref():
+        """Generates a unique booking reference without querying the database.
 
-        super(Booking, self).save(*args, **kwargs)
+        Returns:
+            str: The booking reference.
+        """
 
-    def delete(self, *args, **kwargs):
+        return booking_refs.next()
+
+
+class AirlineCircuit(models.Model):
+    """Stores the circuit breaker of an airline server.
+
+    A closed circuit lets requests through. After CIRCUIT_FAILURE_THRESHOLD
+    consecutive failures or over-budget responses it opens, and requests
+    to the airline wait in the outbox until retry_at. The first request
+    after that is a probe, sent by whichever dispatcher claims it through
+    probe_until: success closes the circuit, failure keeps it open for
+    twice as long.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    STATE_CHOICES = [(CLOSED, 'Closed'), (OPEN, 'Open')]
+
+    airline = models.OneToOneField(Airline, on_delete=models.CASCADE, primary_key=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=CLOSED)
+    failures = models.IntegerField(default=0)
+    requests = models.IntegerField(default=0)
+    latency_ms = models.FloatField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    open_seconds = models.FloatField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)
+    # The dispatcher sending the probe holds it until then, in case it dies before reporting back
+    probe_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """Returns the string representation of the object.
+
+        Returns:
+            str: The string representation of the object.
         """
-        Overrides the delete method to ensure that the number of available seats
-        is updated when a booking is deleted.
+
+        return f'{self.airline_id} [{self.get_status()}]'
+
+    def get_status(self, now=None):
+        """Gets the state of the circuit, telling apart an open circuit that is due a probe.
+
+        Args:
+            now (datetime, optional): The current time. Defaults to now.
+
+        Returns:
+            str: 'closed', 'open' or 'half-open'.
+        """
+
+        if self.state == self.CLOSED:
+            return 'closed'
+
+        return 'open' if self.retry_at > (now or timezone.now()) else 'half-open'
+
+    def record(self, latency_ms, succeeded, now=None):
+        """Records the outcome of a request to the airline.
+
+        Args:
+            latency_ms (float): How long the airline took to answer.
+            succeeded (bool): Whether the airline answered. Slow answers count as failures.
+            now (datetime, optional): The current time. Defaults to now.
         """
 
-        # Increase the number of available seats
-        self.flight.available_seats += 1
-        self.flight.save()
+        now = now or timezone.now()
+        # Moving average, so the latency follows the airline without jumping on one slow request
+        self.latency_ms = latency_ms if not self.requests else 0.8 * self.latency_ms + 0.2 * latency_ms
+        self.requests += 1
+
+        if succeeded and latency_ms <= settings.AIRLINE_LATENCY_BUDGET * 1000:
+            self.failures = 0
+            self.state = self.CLOSED
+            self.opened_at = self.retry_at = self.probe_until = None
+            self.open_seconds = 0
+            return
+
+        self.failures += 1
+        if self.state == self.OPEN:
+            # Only a failed probe keeps the circuit open for longer, not the rest of the
+            # failures that were already on their way when it opened
+            if self.get_status(now) == 'half-open':
+                self.open_seconds = min(settings.CIRCUIT_MAX_OPEN_SECONDS, self.open_seconds * 2)
+                self.retry_at = now + timedelta(seconds=self.open_seconds)
+                self.probe_until = None
+        elif self.failures >= settings.CIRCUIT_FAILURE_THRESHOLD:
+            self.state = self.OPEN
+            self.opened_at = now
+            self.open_seconds = settings.CIRCUIT_OPEN_SECONDS
+            self.retry_at = now + timedelta(seconds=self.open_seconds)
+
+
+class OutboxMessage(models.Model):
+    """Stores a notification to an airline server until run_outbox has delivered it."""
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    airline = models.ForeignKey(Airline, on_delete=models.CASCADE, null=False)
+    # Messages about the same booking are delivered in order
+    booking_ref = models.CharField(max_length=10, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # A dispatcher leases the messages it is sending, so two dispatchers never send the same one
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """Meta class for the OutboxMessage model."""
+
+        indexes = [
+            # The dispatcher only ever scans the pending messages that are due
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        """Returns the string representation of the object.
+
+        Returns:
+            str: The string representation of the object.
+        """
 
-        # Get the airline IP address
-        flight_ip_address = self.flight.airline.ip
+        return f'{self.method} {self.path} [{self.airline_id}, {self.status}]'
 
-        url = f'http://{flight_ip_address}/api/bookings/?booking_ref={self.booking_ref}'
 
-        # Make the request data
-        data = {
-            'booking_ref': self.booking_ref
-        }
+class ResourceVersion(models.Model):
+    """Stores the version of a resource, which every process reads the same.
 
-        # Make the request
-        requests.delete(url, data=data, timeout=5)
+    The ETags of the read endpoints are built from these, so a request can
+    be answered with 304 Not Modified before its queryset runs whether or
+    not the processes share a cache.
+    """
 
-        super(Booking, self).delete(*args, **kwargs)
+    resource = models.CharField(max_length=20, primary_key=True)
+    version = models.BigIntegerField(default=0)
 
-    def generate_booking_ref(self):
-        """Generates a random booking reference.
+    def __str__(self):
+        """Returns the string representation of the object.
 
         Returns:
-            str: The booking reference.
+            str: The string representation of the object.
+        """
+
+        return f'{self.resource} [{self.version}]'
+
+    @classmethod
+    def bump(cls, resource):
+        """Moves a resource to its next version.
+
+        Args:
+            resource (str): The resource name.
         """
 
-        booking_ref = ''.join(random.choices(
-            string.ascii_uppercase + string.digits, k=10))
-        while Booking.objects.filter(booking_ref=booking_ref).exists():
-            booking_ref = ''.join(random.choices(
-                string.ascii_uppercase + string.digits, k=10))
+        if cls.objects.filter(resource=resource).update(version=F('version') + 1):
+            return
 
-        return booking_ref
+        # The row is made on the first change, and a concurrent first change bumps it once more
+        _, created = cls.objects.get_or_create(resource=resource, defaults={'version': 1})
+        if not created:
+            cls.objects.filter(resource=resource).update(version=F('version') + 1)
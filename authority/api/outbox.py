@@ -0,0 +1,485 @@
+"""This module contains the dispatcher that delivers queued airline notifications.
+
+Bookings write their notifications to the OutboxMessage table in the same
+transaction as the booking itself. The dispatcher claims due messages in
+batches, sends them with a limit on the concurrent requests per airline,
+and retries failures with exponential backoff. Messages about the same
+booking are always sent in the order they were written. While an airline's
+circuit breaker is open its messages are held back instead of waiting on
+a dead server, apart from one probe once the circuit is due to half-open.
+AsyncOutboxDispatcher sends from an event loop instead of threads, so one
+process can keep hundreds of requests to slow airlines in flight.
+"""
+
+import asyncio
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import BoundedSemaphore
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .airlines import AsyncAirlineClient, airline_client
+from .metrics import observe_airline
+from .models import Airline, AirlineCircuit, OutboxMessage
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_WORKERS = 16
+OUTBOX_PER_AIRLINE = 4
+# Waiting coroutines cost far less than waiting threads
+ASYNC_OUTBOX_WORKERS = 500
+ASYNC_OUTBOX_PER_AIRLINE = 100
+OUTBOX_MAX_ATTEMPTS = 10
+# The first retry waits BACKOFF_BASE seconds and each later one twice as long, up to BACKOFF_MAX
+BACKOFF_BASE = 2
+BACKOFF_MAX = 3600
+# Claimed messages go back to the queue if their dispatcher dies before finishing them
+CLAIM_LEASE = timedelta(minutes=5)
+# Messages held behind a half-open circuit's probe wait this long before they are looked at again
+PROBE_WAIT = timedelta(seconds=5)
+
+
+class DeliveryError(Exception):
+    """Raised when an airline server does not accept a notification."""
+
+    def __init__(self, message, retry=True):
+        """Creates the error.
+
+        Args:
+            message (str): The reason the delivery failed.
+            retry (bool, optional): Whether sending again could succeed. Defaults to True.
+        """
+
+        super().__init__(message)
+        self.retry = retry
+
+
+def get_backoff(attempts):
+    """Works out how long to wait before retrying a message.
+
+    Args:
+        attempts (int): The number of failed attempts so far.
+
+    Returns:
+        timedelta: The delay, with jitter so retries to one airline spread out.
+    """
+
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def send(message, ip, timeout=None):
+    """Sends a message to its airline server over the pooled airline client.
+
+    Args:
+        message (OutboxMessage): The message.
+        ip (str): The address of the airline server.
+        timeout (float, optional): Seconds to wait for the airline. Defaults to AIRLINE_READ_TIMEOUT.
+
+    Raises:
+        DeliveryError: If the airline cannot be reached or rejects the message.
+    """
+
+    try:
+        response = airline_client.request(message.method, ip, message.path, data=message.payload, timeout=timeout)
+    except requests.RequestException as error:
+        raise DeliveryError(str(error)) from error
+
+    check_response(response)
+
+
+async def asend(client, message, ip, timeout=None):
+    """Sends a message to its airline server over an async airline client.
+
+    Args:
+        client (AsyncAirlineClient): The client.
+        message (OutboxMessage): The message.
+        ip (str): The address of the airline server.
+        timeout (float, optional): Seconds to wait for the airline. Defaults to AIRLINE_READ_TIMEOUT.
+
+    Raises:
+        DeliveryError: If the airline cannot be reached or rejects the message.
+    """
+
+    try:
+        response = await client.request(message.method, ip, message.path, data=message.payload, timeout=timeout)
+    except httpx.HTTPError as error:
+        raise DeliveryError(str(error) or type(error).__name__) from error
+
+    check_response(response)
+
+
+def check_response(response):
+    """Checks that an airline server accepted a message.
+
+    Args:
+        response (Response): The response of the airline, from requests or httpx.
+
+    Raises:
+        DeliveryError: If the response is an error.
+    """
+
+    if response.status_code >= 400:
+        # Sending the same message again cannot fix a client error
+        retry = response.status_code >= 500 or response.status_code in (408, 429)
+        raise DeliveryError(f'{response.status_code} {response.text[:200]}', retry=retry)
+
+
+class OutboxDispatcher:
+    """Claims, sends and settles batches of outbox messages."""
+
+    def __init__(self, batch_size=OUTBOX_BATCH_SIZE, workers=OUTBOX_WORKERS,
+                 per_airline=OUTBOX_PER_AIRLINE, timeout=None, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        """Creates the dispatcher.
+
+        Args:
+            batch_size (int, optional): Messages claimed at a time. Defaults to OUTBOX_BATCH_SIZE.
+            workers (int, optional): Concurrent requests in total. Defaults to OUTBOX_WORKERS.
+            per_airline (int, optional): Concurrent requests per airline. Defaults to OUTBOX_PER_AIRLINE.
+            timeout (float, optional): Seconds to wait for an airline. Defaults to AIRLINE_READ_TIMEOUT.
+            max_attempts (int, optional): Attempts before a message fails. Defaults to OUTBOX_MAX_ATTEMPTS.
+        """
+
+        self.batch_size = batch_size
+        self.workers = workers
+        self.per_airline = per_airline
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.token = uuid.uuid4().hex
+        self.limits = defaultdict(lambda: BoundedSemaphore(per_airline))
+
+    def claim(self):
+        """Claims the next batch of due messages.
+
+        A message waits while an earlier message about the same booking is
+        pending but cannot be sent in the same batch, so a cancellation never
+        overtakes its booking.
+
+        Returns:
+            list: The claimed messages, oldest first.
+        """
+
+        now = timezone.now()
+        blocking = OutboxMessage.objects.filter(
+            Q(next_attempt_at__gt=now) | Q(claimed_until__gt=now), status=OutboxMessage.PENDING,
+            booking_ref=OuterRef('booking_ref'), id__lt=OuterRef('id'))
+        # Oldest first, so an earlier message about a booking is always in the batch before a later one
+        due = OutboxMessage.objects.filter(status=OutboxMessage.PENDING, next_attempt_at__lte=now) \
+            .exclude(claimed_until__gt=now).exclude(Exists(blocking)).order_by('id')
+        candidates = list(due.values_list('id', 'booking_ref')[:self.batch_size])
+        if not candidates:
+            return []
+
+        # Only the rows still unclaimed by the time of the update are ours
+        ids = [ident for ident, _ in candidates]
+        OutboxMessage.objects.filter(id__in=ids, status=OutboxMessage.PENDING) \
+            .exclude(claimed_until__gt=now) \
+            .update(claimed_by=self.token, claimed_until=now + CLAIM_LEASE)
+        claimed = list(OutboxMessage.objects.filter(id__in=ids, claimed_by=self.token).order_by('id'))
+
+        # Give back the messages queued behind one another dispatcher took first
+        claimed_ids = {message.id for message in claimed}
+        lost = {}
+        for ident, booking_ref in candidates:
+            if ident not in claimed_ids:
+                lost.setdefault(booking_ref, ident)
+        held = [message for message in claimed
+                if message.booking_ref in lost and message.id > lost[message.booking_ref]]
+        self.release(held)
+
+        return [message for message in claimed if message not in held]
+
+    def release(self, messages):
+        """Gives claimed messages back to the queue untouched.
+
+        Args:
+            messages (list): The messages.
+        """
+
+        if messages:
+            OutboxMessage.objects.filter(id__in=[message.id for message in messages], claimed_by=self.token) \
+                .update(claimed_by='', claimed_until=None)
+
+    def deliver(self, chain, ip):
+        """Sends the messages about one booking in order, stopping at the first failure.
+
+        Args:
+            chain (list): The messages, oldest first.
+            ip (str): The address of the airline server.
+
+        Returns:
+            list: (message, error, latency in ms) for each message sent or attempted,
+                where error is None on success.
+        """
+
+        results = []
+        with self.limits[chain[0].airline_id]:
+            for message in chain:
+                start = time.perf_counter()
+                try:
+                    send(message, ip, self.timeout)
+                except DeliveryError as error:
+                    results.append((message, error, (time.perf_counter() - start) * 1000))
+                    break
+                results.append((message, None, (time.perf_counter() - start) * 1000))
+
+        return results
+
+    def settle(self, message, error):
+        """Records the outcome of sending a message.
+
+        Args:
+            message (OutboxMessage): The message.
+            error (DeliveryError): The failure, or None if the message was delivered.
+
+        Returns:
+            str: 'sent', 'retried' or 'failed'.
+        """
+
+        updates = {'attempts': F('attempts') + 1, 'claimed_by': '', 'claimed_until': None}
+        if error is None:
+            outcome = 'sent'
+            updates.update(status=OutboxMessage.SENT, sent_at=timezone.now(), last_error='')
+        elif not error.retry or message.attempts + 1 >= self.max_attempts:
+            outcome = 'failed'
+            updates.update(status=OutboxMessage.FAILED, last_error=str(error))
+        else:
+            outcome = 'retried'
+            updates.update(next_attempt_at=timezone.now() + get_backoff(message.attempts + 1),
+                           last_error=str(error))
+
+        OutboxMessage.objects.filter(id=message.id, claimed_by=self.token).update(**updates)
+        return outcome
+
+    def dispatch(self):
+        """Claims and sends one batch of messages.
+
+        Returns:
+            dict: The number of messages sent, retried, failed, left for later and held by open circuits.
+        """
+
+        messages = self.claim()
+        if not messages:
+            return self.record(messages, [])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.deliver, chain, ip) for chain, ip in self.get_chains(messages)]
+            results = [result for future in futures for result in future.result()]
+
+        return self.record(messages, results)
+
+    def get_chains(self, messages):
+        """Groups claimed messages into the chains that have to be sent in order.
+
+        Chains to an airline with an open circuit are left out, except for a
+        single probe once the circuit is due to half-open.
+
+        Args:
+            messages (list): The claimed messages, oldest first.
+
+        Returns:
+            list: (messages about one booking, address of its airline) for each booking to send now.
+        """
+
+        airlines = {message.airline_id for message in messages}
+        ips = dict(Airline.objects.filter(code__in=airlines).values_list('code', 'ip'))
+        circuits = AirlineCircuit.objects.in_bulk(airlines)
+        chains = defaultdict(list)
+        for message in messages:
+            chains[message.airline_id, message.booking_ref].append(message)
+
+        now = timezone.now()
+        sendable = []
+        probing = set()
+        for (airline, _), chain in chains.items():
+            circuit = circuits.get(airline)
+            if circuit is not None and circuit.state == AirlineCircuit.OPEN:
+                if circuit.retry_at > now or airline in probing or not self.claim_probe(airline, now):
+                    continue
+                probing.add(airline)
+            sendable.append((chain, ips[airline]))
+
+        return sendable
+
+    def claim_probe(self, airline, now):
+        """Claims the probe of a circuit that is due to half-open, so only one dispatcher sends it.
+
+        Args:
+            airline (str): The airline code.
+            now (datetime): The current time.
+
+        Returns:
+            bool: True if this dispatcher is to send the probe.
+        """
+
+        claimed = AirlineCircuit.objects.filter(airline=airline, state=AirlineCircuit.OPEN, retry_at__lte=now) \
+            .exclude(probe_until__gt=now).update(probe_until=now + CLAIM_LEASE)
+        return claimed == 1
+
+    def update_circuits(self, messages, results, now):
+        """Feeds the outcomes of a batch to the circuit breakers of its airlines.
+
+        Args:
+            messages (list): The claimed messages.
+            results (list): (message, error, latency in ms) for each message attempted.
+            now (datetime): The current time.
+
+        Returns:
+            dict: The circuit of each airline in the batch that has one.
+        """
+
+        # Other dispatchers update the same circuits, so the rows are locked until the batch commits,
+        # after creating the missing ones so that there is a row to lock
+        touched = {message.airline_id for message, _, _ in results}
+        AirlineCircuit.objects.bulk_create([AirlineCircuit(airline_id=airline) for airline in touched],
+                                           ignore_conflicts=True)
+        locked = AirlineCircuit.objects.select_for_update() \
+            .filter(airline__in={message.airline_id for message in messages}).order_by('airline')
+        circuits = {circuit.airline_id: circuit for circuit in locked}
+        for message, error, latency_ms in results:
+            # Only the airline failing to answer counts; a rejected message says nothing about its health
+            circuits[message.airline_id].record(latency_ms, error is None or not error.retry, now)
+            observe_airline(message.airline_id, latency_ms, error)
+
+        for airline in touched:
+            circuits[airline].save()
+
+        return circuits
+
+    def record(self, messages, results):
+        """Records the outcome of a batch.
+
+        Args:
+            messages (list): The claimed messages.
+            results (list): (message, error, latency in ms) for each message attempted.
+
+        Returns:
+            dict: The number of messages sent, retried, failed, left for later and held by open circuits.
+        """
+
+        # The senders only make HTTP requests, so every database write happens here, in one commit
+        counts = {'sent': 0, 'retried': 0, 'failed': 0, 'deferred': 0, 'held': 0}
+        attempted = set()
+        now = timezone.now()
+        with transaction.atomic():
+            circuits = self.update_circuits(messages, results, now)
+            for message, error, _ in results:
+                attempted.add(message.id)
+                counts[self.settle(message, error)] += 1
+
+            # Messages behind a failure in their chain are released untouched, while messages
+            # to an open circuit wait until it is due a probe, without using up an attempt
+            deferred = []
+            held = defaultdict(list)
+            for message in messages:
+                if message.id in attempted:
+                    continue
+                circuit = circuits.get(message.airline_id)
+                if circuit is not None and circuit.state == AirlineCircuit.OPEN:
+                    held[max(circuit.retry_at, now + PROBE_WAIT)].append(message.id)
+                else:
+                    deferred.append(message)
+
+            self.release(deferred)
+            for until, ids in held.items():
+                OutboxMessage.objects.filter(id__in=ids, claimed_by=self.token) \
+                    .update(next_attempt_at=until, claimed_by='', claimed_until=None)
+        counts['deferred'] = len(deferred)
+        counts['held'] = sum(len(ids) for ids in held.values())
+
+        return counts
+
+    def purge(self, retention):
+        """Deletes delivered messages older than the retention period.
+
+        Args:
+            retention (timedelta): How long to keep delivered messages.
+
+        Returns:
+            int: The number of messages deleted.
+        """
+
+        cutoff = timezone.now() - retention
+        deleted, _ = OutboxMessage.objects.filter(status=OutboxMessage.SENT, sent_at__lt=cutoff).delete()
+        return deleted
+
+
+class AsyncOutboxDispatcher(OutboxDispatcher):
+    """Sends batches of outbox messages from an event loop.
+
+    All of the dispatcher's methods must be awaited on the same event loop,
+    which owns the pooled airline connections.
+    """
+
+    def __init__(self, batch_size=ASYNC_OUTBOX_WORKERS, workers=ASYNC_OUTBOX_WORKERS,
+                 per_airline=ASYNC_OUTBOX_PER_AIRLINE, timeout=None, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        """Creates the dispatcher.
+
+        Args:
+            batch_size (int, optional): Messages claimed at a time. Defaults to ASYNC_OUTBOX_WORKERS.
+            workers (int, optional): Concurrent requests in total. Defaults to ASYNC_OUTBOX_WORKERS.
+            per_airline (int, optional): Concurrent requests per airline. Defaults to ASYNC_OUTBOX_PER_AIRLINE.
+            timeout (float, optional): Seconds to wait for an airline. Defaults to AIRLINE_READ_TIMEOUT.
+            max_attempts (int, optional): Attempts before a message fails. Defaults to OUTBOX_MAX_ATTEMPTS.
+        """
+
+        super().__init__(batch_size, workers, per_airline, timeout, max_attempts)
+        self.client = AsyncAirlineClient(pool_size=per_airline)
+        self.limits = defaultdict(lambda: asyncio.Semaphore(per_airline))
+        self.slots = asyncio.Semaphore(workers)
+
+    async def adeliver(self, chain, ip):
+        """Sends the messages about one booking in order, stopping at the first failure.
+
+        Args:
+            chain (list): The messages, oldest first.
+            ip (str): The address of the airline server.
+
+        Returns:
+            list: (message, error, latency in ms) for each message sent or attempted,
+                where error is None on success.
+        """
+
+        results = []
+        async with self.slots, self.limits[chain[0].airline_id]:
+            for message in chain:
+                start = time.perf_counter()
+                try:
+                    await asend(self.client, message, ip, self.timeout)
+                except DeliveryError as error:
+                    results.append((message, error, (time.perf_counter() - start) * 1000))
+                    break
+                results.append((message, None, (time.perf_counter() - start) * 1000))
+
+        return results
+
+    async def adispatch(self):
+        """Claims and sends one batch of messages.
+
+        Returns:
+            dict: The number of messages sent, retried, failed, left for later and held by open circuits.
+        """
+
+        # The database work runs on a worker thread, whose connection is not cleaned up by the caller
+        await sync_to_async(close_old_connections)()
+        messages = await sync_to_async(self.claim)()
+        if not messages:
+            return await sync_to_async(self.record)(messages, [])
+
+        chains = await sync_to_async(self.get_chains)(messages)
+        delivered = await asyncio.gather(*(self.adeliver(chain, ip) for chain, ip in chains))
+
+        return await sync_to_async(self.record)(messages, [result for results in delivered for result in results])
+
+    async def aclose(self):
+        """Closes the pooled airline connections."""
+
+        await self.client.aclose()
@@ -0,0 +1,256 @@
+"""This module contains the keyset (cursor) pagination used by the list endpoints."""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginates a queryset by seeking past the last row of the previous page.
+
+    Unlike offset pagination, the cost of a page does not grow with its depth
+    because each page is a range scan starting from the cursor position.
+    The ordering fields must together be unique so the ordering is stable.
+    """
+
+    ordering = ()
+    default_limit = 100
+    max_limit = 1000
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def get_limit(self, request):
+        """Gets the page size from the request.
+
+        Args:
+            request (Request): The request object.
+
+        Returns:
+            int: The page size, clamped to between 1 and max_limit.
+        """
+
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+
+        return max(1, min(limit, self.max_limit))
+
+    def get_fields(self, model):
+        """Gets the model fields used for the ordering.
+
+        Args:
+            model (Model): The model being paginated.
+
+        Returns:
+            list: The model fields in ordering order.
+        """
+
+        return [model._meta.get_field(name) for name in self.ordering]
+
+    def encode_cursor(self, instance):
+        """Encodes the position of an instance as an opaque cursor.
+
+        Args:
+            instance (Model): The last instance of the current page.
+
+        Returns:
+            str: The cursor.
+        """
+
+        position = []
+        for field in self.get_fields(type(instance)):
+            value = getattr(instance, field.attname)
+            position.append(value.isoformat() if isinstance(value, datetime) else value)
+
+        # Padding is dropped so the cursor needs no escaping in a URL
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        """Decodes the cursor in the request into a position.
+
+        Args:
+            request (Request): The request object.
+            model (Model): The model being paginated.
+
+        Raises:
+            NotFound: If the cursor is malformed.
+
+        Returns:
+            list: The ordering field values to seek past, or None for the first page.
+        """
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        fields = self.get_fields(model)
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            position = json.loads(base64.urlsafe_b64decode(cursor + padding))
+            if not isinstance(position, list) or len(position) != len(fields):
+                raise ValueError(cursor)
+            return [field.to_python(value) for field, value in zip(fields, position)]
+        except (binascii.Error, ValueError, TypeError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+
+    def get_seek_filter(self, position):
+        """Builds the filter selecting the rows after a position.
+
+        Args:
+            position (list): The ordering field values to seek past.
+
+        Returns:
+            Q: The filter, e.g. (a > x) OR (a = x AND b > y) for ordering (a, b).
+        """
+
+        seek = Q()
+        for i, name in enumerate(self.ordering):
+            clause = Q(**{f'{name}__gt': position[i]})
+            for previous, value in zip(self.ordering[:i], position[:i]):
+                clause &= Q(**{previous: value})
+            seek |= clause
+
+        # The leading range lets the database start an index scan at the cursor
+        return Q(**{f'{self.ordering[0]}__gte': position[0]}) & seek
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Gets a single page of results.
+
+        Args:
+            queryset (QuerySet): The queryset to paginate.
+            request (Request): The request object.
+            view (View, optional): The view. Defaults to None.
+
+        Returns:
+            list: The instances on the page.
+        """
+
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """Gets a single page of results with the async ORM.
+
+        Args:
+            queryset (QuerySet): The queryset to paginate.
+            request (Request): The request object.
+
+        Returns:
+            list: The instances on the page.
+        """
+
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        """Narrows a queryset to the rows of the requested page, without running it.
+
+        Args:
+            queryset (QuerySet): The queryset to paginate.
+            request (Request): The request object.
+
+        Returns:
+            QuerySet: The page, plus one row if there is a next page.
+        """
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.position = self.decode_cursor(request, queryset.model)
+
+        queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.get_seek_filter(self.position))
+
+        # Fetch one extra row to know whether there is a next page
+        return queryset[:self.limit + 1]
+
+    def set_page(self, rows):
+        """Trims the fetched rows to the page and works out the next cursor.
+
+        Args:
+            rows (list): The rows fetched from get_page_queryset.
+
+        Returns:
+            list: The instances on the page.
+        """
+
+        self.has_next = len(rows) > self.limit
+        page = rows[:self.limit]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+
+        return page
+
+    def get_next_link(self):
+        """Gets the URL of the next page.
+
+        Returns:
+            str: The URL, or None if this is the last page.
+        """
+
+        if self.next_cursor is None:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        """Wraps a page of serialized data in a response.
+
+        Args:
+            data (list): The serialized page.
+
+        Returns:
+            Response: The response with the next link and the results.
+        """
+
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        """Describes the pagination query parameters for the API schema.
+
+        Args:
+            view (View): The view.
+
+        Returns:
+            list: The OpenAPI parameter objects.
+        """
+
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The cursor returned in the "next" link of the previous page.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.limit_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results per page (max {self.max_limit}).',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class FlightCursorPagination(KeysetPagination):
+    """Paginates flights in departure order."""
+
+    ordering = ('departure_datetime', 'flight_code')
+
+
+class BookingCursorPagination(KeysetPagination):
+    """Paginates bookings in booking reference order."""
+
+    ordering = ('booking_ref',)
@@ -0,0 +1,198 @@
+"""This module contains the on-demand request profiler for staff users.
+
+A staff user can add ?profile= to a request, or send an X-Profile header,
+to run that one request under a profiler:
+
+- 'pstats' (or '1') uses cProfile and stores a pstats file, for snakeviz,
+  flameprof or gprof2dot.
+- 'collapsed' samples the stack of the request thread and stores one
+  collapsed stack per line with its sample count, for flamegraph.pl or
+  speedscope.
+
+The profile is stored in PROFILE_DIR and its file name is returned in the
+X-Profile header. Other requests, and requests from anyone else, run as
+usual. Only requests served over WSGI are profiled: under ASGI requests
+share an event loop, so a profile would mix the others in.
+"""
+
+import asyncio
+import cProfile
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILERS = {'1': 'pstats', 'pstats': 'pstats', 'collapsed': 'collapsed'}
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        """Creates the sampler.
+
+        Args:
+            thread_id (int): The identifier of the thread to sample.
+            interval (float): Seconds between samples.
+        """
+
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """Takes samples until stopped."""
+
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        """Starts sampling.
+
+        Returns:
+            StackSampler: The sampler.
+        """
+
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stops sampling."""
+
+        self.stopped.set()
+        self.thread.join()
+
+    def dump(self, path):
+        """Writes the samples in the collapsed stack format.
+
+        Args:
+            path (str): The file to write.
+        """
+
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+def get_profiler(request):
+    """Gets the profiler a request asks for.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        str: 'pstats' or 'collapsed', or None if the request does not ask for a profile.
+    """
+
+    value = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    return PROFILERS.get(value.lower()) if value else None
+
+
+def is_staff(request):
+    """Checks whether a request comes from a staff user.
+
+    Args:
+        request (HttpRequest): The request.
+
+    Returns:
+        bool: True if the session or the API credentials belong to a staff user.
+    """
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+
+    # API clients sign in with basic auth, which only the REST framework checks
+    authenticators = [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    try:
+        return Request(request, authenticators=authenticators).user.is_staff
+    except APIException:
+        return False
+
+
+def get_profile_path(request, extension):
+    """Works out where to store the profile of a request.
+
+    Args:
+        request (HttpRequest): The profiled request.
+        extension (str): The file extension.
+
+    Returns:
+        str: The path, named after the time, the route and a random suffix.
+    """
+
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    match = getattr(request, 'resolver_match', None)
+    route = match.url_name if match and match.url_name else 'request'
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{route}-{uuid.uuid4().hex[:8]}.{extension}'
+    return os.path.join(settings.PROFILE_DIR, name)
+
+
+def profile(get_response, request, profiler):
+    """Runs a request under a profiler and stores the profile.
+
+    Args:
+        get_response (callable): The next middleware or the view.
+        request (HttpRequest): The request.
+        profiler (str): 'pstats' or 'collapsed'.
+
+    Returns:
+        HttpResponse: The response, with the profile file name in the X-Profile header.
+    """
+
+    if profiler == 'collapsed':
+        with StackSampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL) as sampler:
+            response = get_response(request)
+        path = get_profile_path(request, 'collapsed')
+        sampler.dump(path)
+    else:
+        stats = cProfile.Profile()
+        response = stats.runcall(get_response, request)
+        path = get_profile_path(request, 'prof')
+        stats.dump_stats(path)
+
+    response['X-Profile'] = os.path.basename(path)
+    return response
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """Profiles the requests of staff users that ask for it.
+
+    Args:
+        get_response (callable): The next middleware or the view.
+
+    Returns:
+        callable: The middleware.
+    """
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            return await get_response(request)
+    else:
+        def middleware(request):
+            profiler = get_profiler(request)
+            if profiler is None or not is_staff(request):
+                return get_response(request)
+            return profile(get_response, request, profiler)
+
+    return middleware
@@ -0,0 +1,191 @@
+"""This module contains helpers to capture SQL statements and audit their query plans.
+
+Each plan is checked for full table scans, temporary B-trees (SQLite) or
+temporary tables and filesorts (MySQL), and joins that cannot use an index.
+Statements are identified by a fingerprint of their SQL with the parameters
+left out, so the same query from different requests compares equal.
+"""
+
+import hashlib
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+
+# Only these statements can be explained, and the others are never slow to plan
+EXPLAINED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+SQLITE_SCAN = re.compile(r'^SCAN (?P<table>\w+)(?: AS \w+)?$')
+SQLITE_SEARCH = re.compile(r'^(?:SCAN|SEARCH) (?P<table>\w+)')
+PLACEHOLDER_LIST = re.compile(r'\((?:%s, )+%s\)')
+FLAG_DESCRIPTIONS = {
+    'full_scan': 'reads every row of the table',
+    'unindexed_join': 'joins the table without an index',
+    'temp_btree': 'sorts or groups through a temporary structure',
+}
+
+
+class StatementCollector:
+    """Collects the statements run on the default connection."""
+
+    def __init__(self):
+        """Creates an empty collector."""
+
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        """Collects a statement and runs it.
+
+        Returns:
+            object: The result of the statement.
+        """
+
+        if not many and sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def installed(self):
+        """Collects the statements run in the enclosed block.
+
+        Yields:
+            StatementCollector: The collector.
+        """
+
+        with connection.execute_wrapper(self):
+            yield self
+
+
+def get_fingerprint(sql):
+    """Identifies a statement independently of its parameters.
+
+    Args:
+        sql (str): The SQL with placeholders.
+
+    Returns:
+        str: A short hash of the normalised SQL.
+    """
+
+    # Lists of values, like id IN (%s, %s), give the same query whatever their length
+    sql = PLACEHOLDER_LIST.sub('(%s)', ' '.join(sql.split()))
+    return hashlib.sha1(sql.encode()).hexdigest()[:12]
+
+
+def explain(sql, params):
+    """Gets the query plan of a statement.
+
+    Args:
+        sql (str): The SQL with placeholders.
+        params (list): The parameters.
+
+    Returns:
+        list: The rows of the plan, as dicts.
+    """
+
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_sqlite_findings(plan):
+    """Finds the problems in an SQLite query plan.
+
+    Args:
+        plan (list): The rows of EXPLAIN QUERY PLAN, with id, parent and detail.
+
+    Returns:
+        list: (flag, table, detail) for each problem.
+    """
+
+    findings = []
+    # Loops sharing a parent are nested in plan order, so only the first one may scan its whole table
+    parents = set()
+    for row in plan:
+        detail = row['detail']
+        if detail.startswith('USE TEMP B-TREE'):
+            findings.append(('temp_btree', None, detail))
+            continue
+
+        loop = SQLITE_SEARCH.match(detail)
+        if not loop or ' VIRTUAL TABLE ' in detail or detail.startswith('SCAN CONSTANT ROW'):
+            continue
+        outer = row['parent'] not in parents
+        parents.add(row['parent'])
+        table = loop.group('table')
+        if 'AUTOMATIC' in detail:
+            # SQLite builds a throwaway index for the join because there is none to use
+            findings.append(('unindexed_join', table, detail))
+        elif SQLITE_SCAN.match(detail):
+            findings.append(('full_scan' if outer else 'unindexed_join', table, detail))
+
+    return findings
+
+
+def get_mysql_findings(plan):
+    """Finds the problems in a MySQL query plan.
+
+    Args:
+        plan (list): The rows of EXPLAIN.
+
+    Returns:
+        list: (flag, table, detail) for each problem.
+    """
+
+    findings = []
+    seen = set()
+    for row in plan:
+        extra = row.get('Extra') or ''
+        detail = f'type={row.get("type")} key={row.get("key")} extra={extra}'
+        outer = row['id'] not in seen
+        seen.add(row['id'])
+        if 'Using join buffer' in extra or (row.get('type') == 'ALL' and not outer):
+            findings.append(('unindexed_join', row.get('table'), detail))
+        elif row.get('type') == 'ALL':
+            findings.append(('full_scan', row.get('table'), detail))
+        if 'Using temporary' in extra or 'Using filesort' in extra:
+            findings.append(('temp_btree', row.get('table'), detail))
+
+    return findings
+
+
+def audit(statements):
+    """Explains statements and collects the problems in their plans.
+
+    Args:
+        statements (list): (sql, params) of each statement.
+
+    Returns:
+        list: A dict for each problem, with the flag, table, plan detail, fingerprint and SQL.
+            A statement run several times is only reported once.
+    """
+
+    get_findings = get_sqlite_findings if connection.vendor == 'sqlite' else get_mysql_findings
+    findings = []
+    explained = set()
+    for sql, params in statements:
+        fingerprint = get_fingerprint(sql)
+        if fingerprint in explained:
+            continue
+        explained.add(fingerprint)
+        for flag, table, detail in get_findings(explain(sql, params)):
+            findings.append({
+                'flag': flag, 'table': table, 'detail': detail,
+                'fingerprint': fingerprint, 'sql': ' '.join(sql.split()),
+            })
+
+    return findings
+
+
+def get_key(route, finding):
+    """Identifies a finding when comparing with a baseline.
+
+    Args:
+        route (str): The route name.
+        finding (dict): The finding.
+
+    Returns:
+        tuple: The route, flag, table and statement fingerprint.
+    """
+
+    return route, finding['flag'], finding['table'], finding['fingerprint']
@@ -0,0 +1,169 @@
+"""This module contains the generator of booking references.
+
+A reference packs the time in seconds, the number of the process that made
+it and a counter into one integer, so references made by the same process
+never repeat and references made by different processes only repeat if
+their nodes match. The integer is then shuffled with a keyed permutation
+and written as 10 letters and digits, so references still look random and
+cannot be guessed from each other. No query is needed to make one. The
+unique constraint on Booking.booking_ref catches the rare repeat between
+processes that share a node, and the booking is retried with a new one.
+
+A process making more than 256 references a second uses up the following
+seconds early. Once it is MAX_LEAD_SECONDS ahead of the clock it makes
+random references instead until the clock catches up, so making one never
+waits; the unique constraint and the retry cover a random one repeating.
+"""
+
+import hashlib
+import os
+import secrets
+import socket
+import string
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+ALPHABET = string.ascii_uppercase + string.digits
+REF_LENGTH = 10
+REF_SPACE = len(ALPHABET) ** REF_LENGTH
+# 30 bits of seconds last until 2058, 13 bits tell apart 8192 processes,
+# and 8 bits count the references each process makes in a second
+EPOCH = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+NODE_BITS = 13
+COUNTER_BITS = 8
+# The permutation works on two halves of 26 bits, a little more than the 36^10 references
+HALF_BITS = 26
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+# Times a booking is retried with a new reference after hitting an existing one
+BOOKING_REF_ATTEMPTS = 3
+# A process making more than 2^COUNTER_BITS references a second borrows later seconds, at most
+# this many ahead of the clock, and then makes random references until the clock catches up
+MAX_LEAD_SECONDS = 10
+
+
+def get_node():
+    """Gets the node number of this process.
+
+    Returns:
+        int: BOOKING_REF_NODE if set, otherwise a number made from the host name and the process id.
+            Two processes on one host only get the same number if their ids differ by a multiple
+            of 8192, but processes on different hosts can easily share one, so deployments on
+            several hosts should set BOOKING_REF_NODE for every process.
+    """
+
+    if settings.BOOKING_REF_NODE is not None:
+        return settings.BOOKING_REF_NODE % (1 << NODE_BITS)
+
+    return (zlib.crc32(socket.gethostname().encode()) + os.getpid()) % (1 << NODE_BITS)
+
+
+class BookingRefGenerator:
+    """Makes unique booking references without asking the database."""
+
+    def __init__(self, node=None, key=None):
+        """Creates the generator.
+
+        Args:
+            node (int, optional): The node number of the process. Defaults to get_node().
+            key (bytes, optional): The key of the permutation. Defaults to one derived from SECRET_KEY.
+        """
+
+        self.fixed_node = node
+        self.key = key
+        self.reset()
+
+    def reset(self):
+        """Starts again with the node of the current process, as a forked child must."""
+
+        # The lock may have been held by another thread of the parent when it forked
+        self.lock = threading.Lock()
+        self.node = self.fixed_node
+        self.second = 0
+        self.counter = 0
+
+    def get_sequence(self):
+        """Gets the next unique number of this process.
+
+        Returns:
+            int: The number, or a random one while the process is too far ahead of the clock.
+        """
+
+        with self.lock:
+            if self.node is None:
+                self.node = get_node()
+            now = int(time.time()) - EPOCH
+            if now > self.second:
+                self.second, self.counter = now, 0
+            elif self.counter >= 1 << COUNTER_BITS:
+                # Busier than the counter allows, or the clock went back, so use up the next second
+                # early. Running further ahead would outlast a restart, and waiting for the clock
+                # would hold up the booking's transaction, so fall back to a random number instead.
+                if self.second - now >= MAX_LEAD_SECONDS:
+                    return secrets.randbelow(REF_SPACE)
+                self.second, self.counter = self.second + 1, 0
+            sequence = (self.second << NODE_BITS | self.node) << COUNTER_BITS | self.counter
+            self.counter += 1
+
+        return sequence
+
+    def get_key(self):
+        """Gets the key of the permutation.
+
+        Returns:
+            bytes: The key.
+        """
+
+        if self.key is None:
+            self.key = hashlib.blake2b(settings.SECRET_KEY.encode(), person=b'booking-refs').digest()
+
+        return self.key
+
+    def permute(self, value):
+        """Shuffles a number within the reference space with a keyed Feistel network.
+
+        A Feistel network is a bijection, so different numbers always give different results.
+        Results past the reference space are shuffled again until they land inside it.
+
+        Args:
+            value (int): A number smaller than REF_SPACE.
+
+        Returns:
+            int: The shuffled number, also smaller than REF_SPACE.
+        """
+
+        key = self.get_key()
+        while True:
+            left, right = value >> HALF_BITS, value & HALF_MASK
+            for round_number in range(ROUNDS):
+                digest = hashlib.blake2b(right.to_bytes(4, 'big'), key=key, digest_size=4,
+                                         salt=round_number.to_bytes(16, 'big')).digest()
+                left, right = right, left ^ (int.from_bytes(digest, 'big') & HALF_MASK)
+            value = left << HALF_BITS | right
+            if value < REF_SPACE:
+                return value
+
+    def next(self):
+        """Makes a booking reference.
+
+        Returns:
+            str: 10 upper case letters and digits.
+        """
+
+        value = self.permute(self.get_sequence())
+        chars = []
+        for _ in range(REF_LENGTH):
+            value, digit = divmod(value, len(ALPHABET))
+            chars.append(ALPHABET[digit])
+
+        return ''.join(chars)
+
+
+booking_refs = BookingRefGenerator()
+
+# A forked worker would otherwise carry on with its parent's node and counter
+os.register_at_fork(after_in_child=booking_refs.reset)
@@ -0,0 +1,161 @@
+"""This module contains the full-text airport search.
+
+On SQLite the search runs against the api_airport_fts FTS5 table (see
+migration 0009_airport_search_signals). Each row holds the ident of its
+airport and is keyed by a hash of it, so it can be found without scanning
+the table and the key survives VACUUM and table rebuilds. The rows are
+kept in sync from the save and delete signals of airports and cities;
+code that changes them with bulk_create() or update() calls index_airports
+afterwards. Other
+databases fall back to case-insensitive substring matches.
+"""
+
+import hashlib
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Airport, City
+
+SEARCH_FIELDS = ['name', 'region', 'city__name', 'city__country__name']
+SEARCH_KEY_FUNCTION = 'airport_search_key'
+INDEX_SQL = f"""
+    INSERT INTO api_airport_fts (rowid, ident, name, region, city, country)
+    SELECT {SEARCH_KEY_FUNCTION}(a.ident), a.ident, a.name, a.region, c.name, c.country_id
+    FROM api_airport a JOIN api_city c ON c.id = a.city_id
+"""
+
+
+def get_search_key(ident):
+    """Gets the FTS rowid of an airport.
+
+    Args:
+        ident (str): The airport ident.
+
+    Returns:
+        int: A positive 63-bit hash of the ident.
+    """
+
+    return int.from_bytes(hashlib.blake2b(ident.encode(), digest_size=8).digest(), 'big') >> 1
+
+
+def register_functions(sender, connection, **kwargs):
+    """Lets the SQL of a new SQLite connection compute the FTS rowid of an airport.
+
+    Args:
+        sender: The database wrapper class.
+        connection (DatabaseWrapper): The new connection.
+    """
+
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(SEARCH_KEY_FUNCTION, 1, get_search_key, deterministic=True)
+
+
+def index_airports(idents=None):
+    """Writes the FTS rows of airports again from the airports and cities tables.
+
+    Args:
+        idents (list, optional): The airports to index. Defaults to None, which indexes every airport.
+    """
+
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        if idents is None:
+            cursor.execute('DELETE FROM api_airport_fts')
+            cursor.execute(INDEX_SQL)
+            return
+
+        idents = list(idents)
+        for start in range(0, len(idents), 500):
+            batch = idents[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM api_airport_fts WHERE rowid IN ({placeholders})',
+                           [get_search_key(ident) for ident in batch])
+            cursor.execute(f'{INDEX_SQL} WHERE a.ident IN ({placeholders})', batch)
+
+
+@receiver(post_save, sender=Airport)
+def airport_saved(sender, instance, **kwargs):
+    """Indexes a saved airport."""
+
+    index_airports([instance.ident])
+
+
+@receiver(post_delete, sender=Airport)
+def airport_deleted(sender, instance, **kwargs):
+    """Drops the FTS row of a deleted airport."""
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_airport_fts WHERE rowid = %s', [get_search_key(instance.ident)])
+
+
+@receiver(post_save, sender=City)
+def city_saved(sender, instance, created, **kwargs):
+    """Indexes the airports of a renamed or moved city again."""
+
+    if not created:
+        index_airports(Airport.objects.filter(city=instance).values_list('ident', flat=True))
+
+
+def get_terms(text):
+    """Splits search text into terms.
+
+    Args:
+        text (str): The search text.
+
+    Returns:
+        list: The words of the text.
+    """
+
+    return re.findall(r'\w+', text)
+
+
+def get_match_expression(terms):
+    """Builds an FTS5 query where every term must start a word.
+
+    Args:
+        terms (list): The search terms.
+
+    Returns:
+        str: The query, e.g. '"new"* "york"*'.
+    """
+
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_airports(queryset, text):
+    """Narrows an airport queryset to the airports matching search text.
+
+    Args:
+        queryset (QuerySet): The airports to search.
+        text (str): The search text, e.g. "new york kennedy".
+
+    Returns:
+        QuerySet: The matching airports, best match first on SQLite.
+    """
+
+    terms = get_terms(text)
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor == 'sqlite':
+        # The matches are found once, then only they are ranked, looking their rows up by key
+        match = get_match_expression(terms)
+        matches = RawSQL('SELECT ident FROM api_airport_fts WHERE api_airport_fts MATCH %s', [match])
+        rank = RawSQL(f'SELECT rank FROM api_airport_fts WHERE api_airport_fts MATCH %s '
+                      f'AND rowid = {SEARCH_KEY_FUNCTION}(api_airport.ident)', [match])
+        return queryset.filter(ident__in=matches).alias(search_rank=rank).order_by('search_rank')
+
+    # Every term has to match at least one of the fields
+    return queryset.filter(reduce(and_, (
+        reduce(or_, (Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS))
+        for term in terms)))
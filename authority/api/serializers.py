@@ -2,12 +2,136 @@
 
 from rest_framework import serializers
 
+from .instrumentation import TimedSerializerMixin
 from .models import Airline, Airport, Flight, Booking, City, Country
 
 
-class FlightSerializer(serializers.ModelSerializer):
+class ExpandableFieldsMixin:
+    """Lets a request choose the fields of a serializer and inline related objects.
+
+    Passing fields keeps only the named fields. Passing expand replaces the
+    named foreign keys with the serialized related object, and dotted names
+    like flight.airline expand further down. A serializer lists what can be
+    expanded in get_expandable, and what is always expanded in default_expand.
+    """
+
+    default_expand = ()
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        """Creates the serializer.
+
+        Args:
+            fields (list, optional): The fields to keep. Defaults to None, which keeps every field.
+            expand (list, optional): The related objects to inline. Defaults to none.
+        """
+
+        super().__init__(*args, **kwargs)
+
+        nested = {}
+        for path in (*self.default_expand, *expand):
+            name, _, rest = path.partition('.')
+            nested.setdefault(name, [])
+            if rest:
+                nested[name].append(rest)
+        if nested:
+            expandable = self.get_expandable()
+            for name, rest in nested.items():
+                if name in self.fields:
+                    self.fields[name] = expandable[name](read_only=True, expand=rest)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def get_expandable(cls):
+        """Gets the foreign keys that can be expanded.
+
+        Returns:
+            dict: The serializer of the related object for each field.
+        """
+
+        return {}
+
+    @classmethod
+    def check_fieldsets(cls, fields, expand):
+        """Checks that the requested fields and expansions exist.
+
+        Args:
+            fields (list): The fields to keep, or None.
+            expand (list): The related objects to inline.
+
+        Raises:
+            ValueError: If a field or an expansion is unknown.
+        """
+
+        if fields is not None:
+            unknown = set(fields) - set(cls().fields)
+            if unknown:
+                raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+
+        for path in expand:
+            serializer_class = cls
+            for name in path.split('.'):
+                expandable = serializer_class.get_expandable()
+                if name not in expandable:
+                    raise ValueError(f'Cannot expand \'{path}\', choose from: {", ".join(sorted(expandable))}')
+                serializer_class = expandable[name]
+
+    @classmethod
+    def select_fields(cls, queryset, fields, expand, required=()):
+        """Limits a queryset to the columns the serializer will read.
+
+        Args:
+            queryset (QuerySet): The queryset.
+            fields (list): The fields to keep, or None for every field.
+            expand (list): The related objects to inline.
+            required (tuple, optional): Other fields to load, like the pagination ordering. Defaults to none.
+
+        Returns:
+            QuerySet: The queryset, joining the expanded objects in and loading only the needed columns.
+        """
+
+        relations = set()
+        for path in (*cls.default_expand, *expand):
+            if fields is not None and path.split('.')[0] not in fields:
+                continue
+            names = path.split('.')
+            relations.update('__'.join(names[:depth]) for depth in range(1, len(names) + 1))
+        if relations:
+            queryset = queryset.select_related(*relations)
+
+        if fields is None:
+            return queryset
+
+        model = queryset.model
+        columns = {field.name for field in model._meta.concrete_fields} & {*fields, *required, model._meta.pk.name}
+        for relation in relations:
+            related_model = model
+            for name in relation.split('__'):
+                related_model = related_model._meta.get_field(name).related_model
+            # Expanded objects are serialized whole, so every column of theirs is needed
+            columns.update(f'{relation}__{field.name}' for field in related_model._meta.concrete_fields)
+        return queryset.only(*columns)
+
+
+class FlightSerializer(ExpandableFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes the Flight model."""
 
+    @classmethod
+    def get_expandable(cls):
+        """Gets the foreign keys that can be expanded.
+
+        Returns:
+            dict: The serializer of the related object for each field.
+        """
+
+        return {
+            'departure_airport': AirportSerializer,
+            'destination_airport': AirportSerializer,
+            'airline': AirlineSerializer,
+        }
+
     class Meta:
         """Meta class for the FlightSerializer."""
 
@@ -15,31 +139,68 @@ class FlightSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class BookingSerializer(serializers.ModelSerializer):
+class ItinerarySerializer(TimedSerializerMixin, serializers.Serializer):
+    """Serializes an itinerary of one or more connecting flights."""
+
+    flights = FlightSerializer(many=True)
+    stops = serializers.IntegerField()
+    departure_datetime = serializers.DateTimeField()
+    arrival_datetime = serializers.DateTimeField()
+    duration_time = serializers.DurationField()
+    total_price = serializers.FloatField()
+
+    def to_representation(self, instance):
+        """Summarises a list of flights as an itinerary.
+
+        Args:
+            instance (list): The flights of the itinerary, in order.
+
+        Returns:
+            dict: The serialized itinerary.
+        """
+
+        return super().to_representation({
+            'flights': instance,
+            'stops': len(instance) - 1,
+            'departure_datetime': instance[0].departure_datetime,
+            'arrival_datetime': instance[-1].arrival_datetime,
+            'duration_time': instance[-1].arrival_datetime - instance[0].departure_datetime,
+            'total_price': round(sum(flight.base_price for flight in instance), 2),
+        })
+
+
+class BookingSerializer(ExpandableFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes the Booking model."""
 
+    @classmethod
+    def get_expandable(cls):
+        """Gets the foreign keys that can be expanded.
+
+        Returns:
+            dict: The serializer of the related object for each field.
+        """
+
+        return {'flight': FlightSerializer}
+
     class Meta:
         """Meta class for the BookingSerializer."""
 
         model = Booking
         fields = ('booking_ref', 'flight', 'passport_number')
+        # Booking.save generates the reference
         read_only_fields = ('booking_ref',)
 
-    def create(self, validated_data):
-        """Create a new booking.
 
-        Args:
-            validated_data (dict): The validated data.
+class BookingDetailSerializer(BookingSerializer):
+    """Serializes a booking with the details of its flight."""
 
-        Returns:
-            Booking: The created booking.
-        """
+    default_expand = ('flight',)
 
-        validated_data['booking_ref'] = Booking.generate_booking_ref()
-        return super().create(validated_data)
+    class Meta(BookingSerializer.Meta):
+        """Meta class for the BookingDetailSerializer."""
 
 
-class AirlineSerializer(serializers.ModelSerializer):
+class AirlineSerializer(ExpandableFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes the Airline model."""
 
     class Meta:
@@ -49,7 +210,7 @@ class AirlineSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class AirportSerializer(serializers.ModelSerializer):
+class AirportSerializer(ExpandableFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes the Airport model."""
 
     class Meta:
@@ -59,7 +220,16 @@ class AirportSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CitySerializer(serializers.ModelSerializer):
+class NearbyAirportSerializer(AirportSerializer):
+    """Serializes an airport with its distance from a searched position."""
+
+    distance_km = serializers.FloatField(read_only=True)
+
+    class Meta(AirportSerializer.Meta):
+        """Meta class for the NearbyAirportSerializer."""
+
+
+class CitySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes the City model."""
 
     class Meta:
@@ -69,7 +239,7 @@ class CitySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class CountrySerializer(serializers.ModelSerializer):
+class CountrySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes the Country model."""
 
     class Meta:
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.server_timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.profiling.profiling_middleware',
 ]
 
 ROOT_URLCONF = 'api.urls'
@@ -73,6 +75,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'api.wsgi.application'
+ASGI_APPLICATION = 'api.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
@@ -140,15 +143,64 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
-        'LOCATION': 'redis://127.0.0.1:6379/1',
-        'OPTIONS': {
-            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+# Set REDIS_URL whenever more than one process serves the API. Without it each process
+# caches on its own, so invalidation only reaches the process that made the change.
+REDIS_URL = os.getenv('REDIS_URL')
+SHARED_CACHE = bool(REDIS_URL)
+
+if SHARED_CACHE:
+    # Errors are raised rather than ignored: a missed invalidation would serve stale seats
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
         },
-    },
-}
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'authority',
+        },
+    }
+
+# Set RESPONSE_CACHE_LOCAL=1 to cache responses without a shared cache when only one process
+# serves the API, as runserver does. On by default with DEBUG, 0 turns it off.
+RESPONSE_CACHE_LOCAL = os.getenv('RESPONSE_CACHE_LOCAL', '1' if DEBUG else '0') == '1'
+
+# Seconds to keep cached responses of the read endpoints, 0 to turn the response cache off.
+# Off by default when several processes would each cache without hearing of the others' changes.
+RESPONSE_CACHE_TIMEOUT = int(os.getenv(
+    'RESPONSE_CACHE_TIMEOUT', '300' if SHARED_CACHE or RESPONSE_CACHE_LOCAL else '0'))
+
+# Number (0-8191) of this process for the booking reference generator. Giving every
+# process its own guarantees unique references. Otherwise one is made from the host and pid,
+# which processes on different hosts can share, so set it when running on several hosts.
+BOOKING_REF_NODE = int(os.environ['BOOKING_REF_NODE']) if os.getenv('BOOKING_REF_NODE') else None
+
+# Keep-alive connections kept open per airline server, and the timeouts of requests to them
+AIRLINE_POOL_SIZE = int(os.getenv('AIRLINE_POOL_SIZE', '10'))
+AIRLINE_CONNECT_TIMEOUT = float(os.getenv('AIRLINE_CONNECT_TIMEOUT', '3.05'))
+AIRLINE_READ_TIMEOUT = float(os.getenv('AIRLINE_READ_TIMEOUT', '20'))
+
+# Airline requests slower than the budget (in seconds) count as failures for the circuit breakers
+AIRLINE_LATENCY_BUDGET = float(os.getenv('AIRLINE_LATENCY_BUDGET', '2'))
+# Consecutive failures that open an airline's circuit, and how long it first stays open (in seconds)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv('CIRCUIT_MAX_OPEN_SECONDS', '600'))
+
+# Share (0-1) of requests whose query count and database, serializer and airline time are
+# sent back in a Server-Timing header and logged to 'api.timing'
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', '0.01'))
+
+# Where the profiles of requests sent by staff with ?profile= are stored, and the
+# seconds between stack samples of ?profile=collapsed
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.001'))
 
 LOGGING = {
     'version': 1,
@@ -163,6 +215,11 @@ LOGGING = {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
         },
+        'api.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -170,6 +227,7 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.streaming.NDJSONRenderer',
     ],
     # 'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -0,0 +1,165 @@
+"""This module contains the spatial index behind the nearby airports endpoint.
+
+Airports are stored in a KD-tree over their positions as 3D unit vectors.
+The straight-line (chord) distance between unit vectors grows with the
+great-circle distance, so nearest neighbours by chord are nearest by
+great-circle too, with no special cases at the poles or the date line.
+"""
+
+import heapq
+import math
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .inmemory import InMemoryIndex
+from .models import Airport
+
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 8
+
+
+def to_unit_vector(latitude, longitude):
+    """Converts a latitude and longitude to a point on the unit sphere.
+
+    Args:
+        latitude (float): The latitude in degrees.
+        longitude (float): The longitude in degrees.
+
+    Returns:
+        tuple: The x, y and z coordinates.
+    """
+
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord_squared):
+    """Converts a squared chord length on the unit sphere to a great-circle distance.
+
+    Args:
+        chord_squared (float): The squared chord length.
+
+    Returns:
+        float: The distance in kilometres.
+    """
+
+    return 2 * math.asin(min(1.0, math.sqrt(chord_squared) / 2)) * EARTH_RADIUS_KM
+
+
+def km_to_chord(distance_km):
+    """Converts a great-circle distance to a squared chord length on the unit sphere.
+
+    Args:
+        distance_km (float): The distance in kilometres.
+
+    Returns:
+        float: The squared chord length.
+    """
+
+    angle = min(math.pi, distance_km / EARTH_RADIUS_KM)
+    return (2 * math.sin(angle / 2)) ** 2
+
+
+class AirportIndex:
+    """A static KD-tree of airport positions."""
+
+    def __init__(self, airports):
+        """Builds the tree.
+
+        Args:
+            airports (iterable): (ident, latitude, longitude) for each airport.
+        """
+
+        self.nodes = [(ident, to_unit_vector(lat, lon)) for ident, lat, lon in airports]
+        self._build(0, len(self.nodes), 0)
+
+    @classmethod
+    def from_database(cls):
+        """Builds the index from the airports table.
+
+        Returns:
+            AirportIndex: The index.
+        """
+
+        return cls(Airport.objects.values_list('ident', 'latitude', 'longitude').iterator())
+
+    def _build(self, lo, hi, axis):
+        """Arranges nodes[lo:hi] so each median splits its range on the given axis.
+
+        Args:
+            lo (int): The start of the range.
+            hi (int): The end of the range.
+            axis (int): The coordinate to split on.
+        """
+
+        if hi - lo <= LEAF_SIZE:
+            return
+
+        self.nodes[lo:hi] = sorted(self.nodes[lo:hi], key=lambda node: node[1][axis])
+        mid = (lo + hi) // 2
+        self._build(lo, mid, (axis + 1) % 3)
+        self._build(mid + 1, hi, (axis + 1) % 3)
+
+    def nearest(self, latitude, longitude, k=10, radius_km=None):
+        """Finds the nearest airports to a position.
+
+        Args:
+            latitude (float): The latitude in degrees.
+            longitude (float): The longitude in degrees.
+            k (int, optional): The maximum number of airports. Defaults to 10.
+            radius_km (float, optional): The maximum distance in kilometres. Defaults to None.
+
+        Returns:
+            list: (distance in km, ident) of each airport, nearest first.
+        """
+
+        query = to_unit_vector(latitude, longitude)
+        limit = km_to_chord(radius_km) if radius_km is not None else math.inf
+        # Max-heap of the best k so far, as (-chord squared, ident)
+        best = []
+
+        def visit(node):
+            ident, point = node
+            distance = sum((a - b) ** 2 for a, b in zip(query, point))
+            if distance > limit:
+                return
+            if len(best) < k:
+                heapq.heappush(best, (-distance, ident))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, ident))
+
+        def worst():
+            return min(limit, -best[0][0]) if len(best) == k else limit
+
+        def search(lo, hi, axis):
+            if hi - lo <= LEAF_SIZE:
+                for node in self.nodes[lo:hi]:
+                    visit(node)
+                return
+
+            mid = (lo + hi) // 2
+            visit(self.nodes[mid])
+            diff = query[axis] - self.nodes[mid][1][axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+
+            search(*near, (axis + 1) % 3)
+            # The far side can only hold closer points if the split plane is within reach
+            if diff * diff < worst():
+                search(*far, (axis + 1) % 3)
+
+        if k > 0 and self.nodes:
+            search(0, len(self.nodes), 0)
+
+        return [(chord_to_km(-distance), ident) for distance, ident in sorted(best, reverse=True)]
+
+
+airport_index = InMemoryIndex(AirportIndex.from_database, max_age=300)
+
+
+@receiver(post_save, sender=Airport)
+@receiver(post_delete, sender=Airport)
+def airport_changed(sender, **kwargs):
+    """Marks the spatial index stale when an airport is added, moved or deleted."""
+
+    airport_index.mark_stale()
@@ -0,0 +1,144 @@
+"""This module contains the streaming mode of the list endpoints.
+
+A streamed response walks the queryset with a chunked database cursor and
+writes rows as soon as they are encoded, so memory use stays flat and the
+first byte is sent before the whole table has been read.
+"""
+
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+STREAM_CHUNK_SIZE = 2000
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Renders data as newline-delimited JSON, one object per line."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Renders the data.
+
+        Args:
+            data (object): The data to render.
+            accepted_media_type (str, optional): The accepted media type. Defaults to None.
+            renderer_context (dict, optional): The renderer context. Defaults to None.
+
+        Returns:
+            bytes: A line for each item if the data is a list, otherwise a single line.
+        """
+
+        if data is None:
+            return b''
+
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(f'{encode_row(row)}\n' for row in rows).encode()
+
+
+def encode_row(row):
+    """Encodes a single serialized row as compact JSON.
+
+    Args:
+        row (dict): The serialized row.
+
+    Returns:
+        str: The JSON text.
+    """
+
+    return json.dumps(row, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def wants_stream(request):
+    """Checks whether the client asked for a streamed response.
+
+    Args:
+        request (Request): The request object.
+
+    Returns:
+        bool: True if ?stream=1 is set or NDJSON was negotiated.
+    """
+
+    if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer is not None and renderer.format == NDJSONRenderer.format
+
+
+def encode_batches(queryset, serializer_class, chunk_size=STREAM_CHUNK_SIZE):
+    """Serializes a queryset one database chunk at a time.
+
+    Args:
+        queryset (QuerySet): The queryset to serialize.
+        serializer_class (Serializer): The serializer for the rows.
+        chunk_size (int, optional): Rows fetched per round trip. Defaults to STREAM_CHUNK_SIZE.
+
+    Yields:
+        list: The encoded JSON text of each row in the chunk.
+    """
+
+    batch = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        batch.append(instance)
+        if len(batch) == chunk_size:
+            yield [encode_row(row) for row in serializer_class(batch, many=True).data]
+            batch = []
+
+    if batch:
+        yield [encode_row(row) for row in serializer_class(batch, many=True).data]
+
+
+def stream_ndjson(batches):
+    """Writes encoded rows as newline-delimited JSON.
+
+    Args:
+        batches (iterator): The encoded rows, a chunk at a time.
+
+    Yields:
+        str: The lines of each chunk.
+    """
+
+    for rows in batches:
+        yield ''.join(f'{row}\n' for row in rows)
+
+
+def stream_json_array(batches):
+    """Writes encoded rows as a single JSON array.
+
+    Args:
+        batches (iterator): The encoded rows, a chunk at a time.
+
+    Yields:
+        str: The array, piece by piece.
+    """
+
+    yield '['
+    separator = ''
+    for rows in batches:
+        yield separator + ','.join(rows)
+        separator = ','
+    yield ']'
+
+
+def stream_queryset(request, queryset, serializer_class):
+    """Streams a queryset as NDJSON or as a JSON array.
+
+    Args:
+        request (Request): The request object.
+        queryset (QuerySet): The queryset to stream.
+        serializer_class (Serializer): The serializer for the rows.
+
+    Returns:
+        StreamingHttpResponse: NDJSON if it was negotiated, otherwise a JSON array.
+    """
+
+    batches = encode_batches(queryset, serializer_class)
+
+    if request.accepted_renderer.format == NDJSONRenderer.format:
+        return StreamingHttpResponse(stream_ndjson(batches), content_type=NDJSONRenderer.media_type)
+
+    return StreamingHttpResponse(stream_json_array(batches), content_type='application/json')
@@ -1,9 +1,41 @@
 """This module contains the tests for the API."""
 
+import base64
+import json
+import math
+import multiprocessing
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import TestCase, RequestFactory
+from django.db import OperationalError, connection, models
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
 
-from .views import AirlineViewSet, AirportViewSet, CityViewSet, CountryViewSet
+from .airlines import AirlineClient, airline_client
+from .autocomplete import autocomplete_index
+from .benchmarking import generate_booking_refs, stub_airline
+from .itineraries import invalidate_timetable
+from .metrics import REGISTRY
+from .models import Airline, AirlineCircuit, Airport, Booking, City, Country, Flight, NoSeatsAvailable, \
+    OutboxMessage
+from .outbox import AsyncOutboxDispatcher, OutboxDispatcher
+from .query_plans import StatementCollector, audit, get_fingerprint, get_sqlite_findings
+from .references import COUNTER_BITS, EPOCH, MAX_LEAD_SECONDS, REF_SPACE, BookingRefGenerator
+from .search import search_airports
+from .spatial import EARTH_RADIUS_KM, AirportIndex, airport_index
+from .views import AirlineViewSet, AirportViewSet, AutocompleteViewSet, CityViewSet, CountryViewSet, \
+    FlightViewSet, ItineraryViewSet
 
 
 class SearchCapabilitiesTest(TestCase):
@@ -95,3 +127,1364 @@ class SearchCapabilitiesTest(TestCase):
         response = view(request)
         self.assertEqual(response.status_code, 200)
         self.assertGreater(len(response.data), 0)
+
+
+class CachedEndpointTestCase(TestCase):
+    """Base class for tests of endpoints that use the response cache."""
+
+    def setUp(self):
+        """Clear the response cache so tests cannot see each other's responses."""
+
+        cache.clear()
+
+
+def create_schedule():
+    """Create two London airports and a small schedule of flights between them.
+
+    Two flights share each departure time and flight TA003 is fully booked.
+    """
+    country = Country.objects.create(name='GB', continent='EU')
+    city = City.objects.create(name='London', country=country)
+    airline = Airline.objects.create(code='TA', name='Test Airline', ip='localhost')
+    departure = Airport.objects.create(
+        ident='EGLL', name='Heathrow', city=city, region='GB-ENG',
+        size_type='large_airport', latitude=51.47, longitude=-0.46, elevation='83')
+    destination = Airport.objects.create(
+        ident='EGKK', name='Gatwick', city=city, region='GB-ENG',
+        size_type='large_airport', latitude=51.15, longitude=-0.19, elevation='202')
+
+    start = datetime(2023, 6, 1, tzinfo=timezone.utc)
+    for i in range(7):
+        departure_datetime = start + timedelta(hours=i // 2)
+        Flight.objects.create(
+            flight_code=f'TA{i:03d}', departure_airport=departure,
+            destination_airport=destination, departure_datetime=departure_datetime,
+            arrival_datetime=departure_datetime + timedelta(hours=1),
+            duration_time=timedelta(hours=1), base_price=100,
+            total_seats=10, available_seats=0 if i == 3 else 10, airline=airline)
+
+
+class FlightPaginationTest(CachedEndpointTestCase):
+    """Tests for the cursor pagination of the flights endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+        cls.factory = RequestFactory()
+        cls.view = FlightViewSet.as_view({'get': 'get_flights'})
+
+    def test_pages_cover_every_bookable_flight_once(self):
+        """Test that following the next links visits every bookable flight in order."""
+
+        codes = []
+        params = {'limit': 2}
+        while True:
+            response = self.view(self.factory.get('/api/flights/', params))
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            codes += [flight['flight_code'] for flight in response.data['results']]
+            if not response.data['next']:
+                break
+            params['cursor'] = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+
+        self.assertEqual(codes, ['TA000', 'TA001', 'TA002', 'TA004', 'TA005', 'TA006'])
+
+    def test_airport_filter_ignores_case(self):
+        """Test that airport idents still match regardless of case."""
+
+        response = self.view(self.factory.get(
+            '/api/flights/', {'departure_airport': 'egll', 'destination_airport': 'EGKK'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected."""
+
+        response = self.view(self.factory.get('/api/flights/', {'cursor': 'not-a-cursor'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class StreamingTest(CachedEndpointTestCase):
+    """Tests for the streaming mode of the list endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+        cls.factory = RequestFactory()
+        cls.view = FlightViewSet.as_view({'get': 'get_flights'})
+
+    def test_stream_json_array(self):
+        """Test that ?stream=1 streams every bookable flight as one JSON array."""
+
+        response = self.view(self.factory.get('/api/flights/', {'stream': '1', 'limit': 2}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        flights = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(flights), 6)
+
+    def test_stream_ndjson(self):
+        """Test that an NDJSON Accept header streams one flight per line."""
+
+        response = self.view(self.factory.get(
+            '/api/flights/', HTTP_ACCEPT='application/x-ndjson'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertIn('flight_code', json.loads(lines[0]))
+
+
+class ItineraryTest(CachedEndpointTestCase):
+    """Tests for the itineraries endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a network of London, Paris and New York flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+        airline = Airline.objects.get(code='TA')
+        country = Country.objects.create(name='FR', continent='EU')
+        paris = Airport.objects.create(
+            ident='LFPG', name='Charles de Gaulle', city=City.objects.create(name='Paris', country=country),
+            region='FR-IDF', size_type='large_airport', latitude=49.01, longitude=2.55, elevation='392')
+        country = Country.objects.create(name='US', continent='NA')
+        new_york = Airport.objects.create(
+            ident='KJFK', name='John F Kennedy', city=City.objects.create(name='New York', country=country),
+            region='US-NY', size_type='large_airport', latitude=40.64, longitude=-73.78, elevation='13')
+
+        start = datetime(2023, 6, 1, 8, tzinfo=timezone.utc)
+        for code, departure, destination, hours, duration, price in [
+            ('TA100', 'EGLL', 'KJFK', 0, 8, 900),
+            ('TA101', 'EGLL', 'LFPG', 0, 1, 100),
+            # Too tight a connection from TA101
+            ('TA102', 'LFPG', 'KJFK', 1.5, 8, 300),
+            ('TA103', 'LFPG', 'KJFK', 3, 8, 400),
+            ('TA104', 'EGKK', 'LFPG', 1, 1, 50),
+        ]:
+            departure_datetime = start + timedelta(hours=hours)
+            Flight.objects.create(
+                flight_code=code, departure_airport_id=departure, destination_airport_id=destination,
+                departure_datetime=departure_datetime,
+                arrival_datetime=departure_datetime + timedelta(hours=duration),
+                duration_time=timedelta(hours=duration), base_price=price,
+                total_seats=10, available_seats=10, airline=airline)
+
+        cls.factory = RequestFactory()
+        cls.view = ItineraryViewSet.as_view({'get': 'get_itineraries'})
+        cls.window = {'departure_datetime_min': '2023-06-01T00:00:00Z'}
+
+    def setUp(self):
+        """Drop any timetable built from another test's data."""
+
+        super().setUp()
+        invalidate_timetable()
+
+    def get_routes(self, **params):
+        """Searches for itineraries and returns their flight codes.
+
+        Args:
+            **params: The query parameters.
+
+        Returns:
+            list: The flight codes of each itinerary, in ranked order.
+        """
+
+        response = self.view(self.factory.get('/api/itineraries/', {**self.window, **params}))
+        self.assertEqual(response.status_code, 200)
+        return [[flight['flight_code'] for flight in itinerary['flights']] for itinerary in response.data]
+
+    def test_rank_by_arrival(self):
+        """Test that the direct flight arrives first and tight connections are skipped."""
+
+        routes = self.get_routes(departure_airport='EGLL', destination_airport='KJFK', max_stops=1)
+        self.assertEqual(routes, [['TA100'], ['TA101', 'TA103']])
+
+    def test_rank_by_price_across_cities(self):
+        """Test a city search ranked by total price."""
+
+        routes = self.get_routes(departure_city='London', destination_city='New York', sort='price')
+        self.assertEqual(routes, [['TA104', 'TA103'], ['TA101', 'TA103'], ['TA100']])
+
+    def test_sold_out_flights_are_skipped(self):
+        """Test that an itinerary is dropped once one of its flights sells out."""
+
+        Flight.objects.filter(flight_code='TA103').update(available_seats=0)
+        routes = self.get_routes(departure_airport='EGLL', destination_airport='KJFK')
+        self.assertEqual(routes, [['TA100']])
+
+    def test_sold_out_candidates_beyond_overfetch(self):
+        """Test that the limit is still filled when more candidates sold out than were over-fetched."""
+
+        departure_datetime = datetime(2023, 6, 1, 6, tzinfo=timezone.utc)
+        for i in range(3):
+            Flight.objects.create(
+                flight_code=f'TA2{i:02d}', departure_airport_id='EGLL', destination_airport_id='KJFK',
+                departure_datetime=departure_datetime, arrival_datetime=departure_datetime + timedelta(hours=7),
+                duration_time=timedelta(hours=7), base_price=500, total_seats=10, available_seats=10,
+                airline_id='TA')
+        invalidate_timetable()
+        self.get_routes(departure_airport='EGLL', destination_airport='KJFK')
+
+        # update() skips the signals, so the timetable still lists these flights first
+        Flight.objects.filter(flight_code__startswith='TA2').update(available_seats=0)
+        routes = self.get_routes(departure_airport='EGLL', destination_airport='KJFK', limit=1)
+        self.assertEqual(routes, [['TA100']])
+
+    def test_missing_destination(self):
+        """Test that a destination is required."""
+
+        response = self.view(self.factory.get('/api/itineraries/', {'departure_airport': 'EGLL'}))
+        self.assertEqual(response.status_code, 400)
+
+
+class NearbyAirportTest(CachedEndpointTestCase):
+    """Tests for the nearby airports endpoint and its spatial index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the London airports.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+        cls.factory = RequestFactory()
+        cls.view = AirportViewSet.as_view({'get': 'get_nearby_airports'})
+
+    def setUp(self):
+        """Drop any index built from another test's data."""
+
+        super().setUp()
+        airport_index.invalidate()
+
+    def test_nearest_first(self):
+        """Test that airports come back nearest first with their distances."""
+
+        response = self.view(self.factory.get('/api/airports/nearby/', {'lat': 51.16, 'lon': -0.18}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([airport['ident'] for airport in response.data], ['EGKK', 'EGLL'])
+        self.assertLess(response.data[0]['distance_km'], 2)
+
+    def test_radius(self):
+        """Test that airports outside the radius are left out."""
+
+        response = self.view(self.factory.get(
+            '/api/airports/nearby/', {'lat': 51.16, 'lon': -0.18, 'radius_km': 10}))
+        self.assertEqual([airport['ident'] for airport in response.data], ['EGKK'])
+
+    def test_invalid_position(self):
+        """Test that a latitude out of range is rejected."""
+
+        response = self.view(self.factory.get('/api/airports/nearby/', {'lat': 91, 'lon': 0}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_matches_brute_force(self):
+        """Test the KD-tree against a linear scan of haversine distances."""
+
+        rng = random.Random(1)
+        points = [(str(i), rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(2000)]
+        index = AirportIndex(points)
+
+        def haversine(lat1, lon1, lat2, lon2):
+            lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+            a = math.sin((lat2 - lat1) / 2) ** 2 \
+                + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+        for lat, lon in [(0, 179.9), (89, 0), (-45, -60), (51.5, -0.1)]:
+            expected = sorted((haversine(lat, lon, p_lat, p_lon), ident) for ident, p_lat, p_lon in points)[:5]
+            found = index.nearest(lat, lon, k=5)
+            self.assertEqual([ident for _, ident in found], [ident for _, ident in expected])
+            self.assertAlmostEqual(found[0][0], expected[0][0], places=3)
+
+
+class AutocompleteTest(TestCase):
+    """Tests for the autocomplete endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the London airports and a city with an accented name.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+        City.objects.create(name='São Paulo', country=Country.objects.create(name='BR', continent='SA'))
+
+        cls.factory = RequestFactory()
+        cls.view = AutocompleteViewSet.as_view({'get': 'get_suggestions'})
+
+    def setUp(self):
+        """Drop any index built from another test's data."""
+
+        autocomplete_index.invalidate()
+
+    def suggest(self, query):
+        """Gets the names suggested for a query.
+
+        Args:
+            query (str): The text typed so far.
+
+        Returns:
+            list: The suggested names, best first.
+        """
+
+        response = self.view(self.factory.get('/api/autocomplete/', {'q': query}))
+        self.assertEqual(response.status_code, 200)
+        return [suggestion['name'] for suggestion in response.data]
+
+    def test_prefix_across_types(self):
+        """Test that a prefix matches countries, cities and airports, ignoring case."""
+
+        self.assertEqual(self.suggest('LON'), ['London'])
+        self.assertEqual(self.suggest('g'), ['GB', 'Gatwick'])
+        self.assertEqual(self.suggest('egl'), ['Heathrow'])
+
+    def test_later_words_and_accents(self):
+        """Test that later words and unaccented text also match."""
+
+        self.assertEqual(self.suggest('paulo'), ['São Paulo'])
+        self.assertEqual(self.suggest('sao p'), ['São Paulo'])
+
+    def test_missing_query(self):
+        """Test that a query is required."""
+
+        response = self.view(self.factory.get('/api/autocomplete/'))
+        self.assertEqual(response.status_code, 400)
+
+
+class AirportSearchTest(CachedEndpointTestCase):
+    """Tests for the full-text search of the airports endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the London airports and John F Kennedy airport.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+        Airport.objects.create(
+            ident='KJFK', name='John F Kennedy International Airport',
+            city=City.objects.create(name='New York', country=Country.objects.create(name='US', continent='NA')),
+            region='US-NY', size_type='large_airport', latitude=40.64, longitude=-73.78, elevation='13')
+
+        cls.factory = RequestFactory()
+        cls.view = AirportViewSet.as_view({'get': 'get_airports'})
+
+    def search(self, text, **params):
+        """Searches the airports.
+
+        Args:
+            text (str): The search text.
+            **params: Other query parameters.
+
+        Returns:
+            list: The idents of the matching airports.
+        """
+
+        response = self.view(self.factory.get('/api/airports/', {'search': text, **params}))
+        if response.status_code == 404:
+            return []
+        return [airport['ident'] for airport in response.data]
+
+    def test_partial_words_across_fields(self):
+        """Test that partial words match the name, city and country."""
+
+        self.assertEqual(self.search('new york kenn'), ['KJFK'])
+        self.assertEqual(self.search('HEATH'), ['EGLL'])
+        self.assertEqual(sorted(self.search('london')), ['EGKK', 'EGLL'])
+        self.assertEqual(self.search('kennedy paris'), [])
+
+    def test_combined_with_filters(self):
+        """Test that the search narrows the other filters."""
+
+        self.assertEqual(self.search('london', size_type='small_airport'), [])
+
+    def test_follows_renamed_city(self):
+        """Test that renaming a city updates the search index."""
+
+        city = City.objects.get(name='London')
+        city.name = 'Londinium'
+        city.save()
+        self.assertEqual(self.search('london'), [])
+        self.assertEqual(sorted(self.search('londinium')), ['EGKK', 'EGLL'])
+
+
+class AirportSchemaChangeTest(TransactionTestCase):
+    """Tests that the airport search index does not get in the way of schema changes."""
+
+    def test_alter_airport_field(self):
+        """Test that an airport field can be altered, as a migration would, and search still works."""
+
+        create_schedule()
+        old_field = Airport._meta.get_field('region')
+        new_field = models.CharField(max_length=150)
+        new_field.set_attributes_from_name('region')
+        new_field.model = Airport
+
+        # SQLite rebuilds the whole table to alter a field
+        with connection.schema_editor() as editor:
+            editor.alter_field(Airport, old_field, new_field)
+        try:
+            matches = search_airports(Airport.objects.all(), 'heathrow')
+            self.assertEqual(list(matches.values_list('ident', flat=True)), ['EGLL'])
+        finally:
+            with connection.schema_editor() as editor:
+                editor.alter_field(Airport, new_field, old_field)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=300)
+class ResponseCacheTest(CachedEndpointTestCase):
+    """Tests for the response cache of the read endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+        cls.factory = RequestFactory()
+        cls.view = FlightViewSet.as_view({'get': 'get_flights'})
+
+    def get_flights(self, **params):
+        """Gets the flights endpoint.
+
+        Args:
+            **params: The query parameters.
+
+        Returns:
+            Response: The response.
+        """
+
+        return self.view(self.factory.get('/api/flights/', params))
+
+    def test_repeated_search_skips_database(self):
+        """Test that an identical search, with its parameters reordered, is served from the cache."""
+
+        first = self.get_flights(departure_airport='EGLL', limit=3)
+        with self.assertNumQueries(0):
+            second = self.view(self.factory.get('/api/flights/?limit=3&departure_airport=EGLL'))
+        self.assertEqual(first.data, second.data)
+
+    def test_save_invalidates(self):
+        """Test that saving a flight changes the cached seat count."""
+
+        self.assertEqual(self.get_flights(limit=1).data['results'][0]['available_seats'], 10)
+
+        flight = Flight.objects.get(flight_code='TA000')
+        flight.available_seats = 9
+        with self.captureOnCommitCallbacks(execute=True):
+            flight.save()
+
+        self.assertEqual(self.get_flights(limit=1).data['results'][0]['available_seats'], 9)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_zero_timeout_turns_cache_off(self):
+        """Test that with the response cache turned off every search goes to the database."""
+
+        self.get_flights(limit=1)
+        with self.assertNumQueries(1):
+            self.get_flights(limit=1)
+
+    def test_streams_are_not_cached(self):
+        """Test that streamed responses always go to the database."""
+
+        self.get_flights(stream='1')
+        response = self.get_flights(stream='1')
+        self.assertTrue(response.streaming)
+
+
+class ConditionalGetTest(CachedEndpointTestCase):
+    """Tests for the ETags of the reference data endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+        cls.factory = RequestFactory()
+        cls.view = CountryViewSet.as_view({'get': 'get_countries'})
+
+    def get_countries(self, etag=None):
+        """Gets the countries endpoint.
+
+        Args:
+            etag (str, optional): The If-None-Match header. Defaults to None.
+
+        Returns:
+            Response: The response.
+        """
+
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.view(self.factory.get('/api/countries/', **headers))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_matching_etag_skips_view(self):
+        """Test that a current ETag is answered with an empty 304 after only the version lookup."""
+
+        etag = self.get_countries()['ETag']
+        with self.assertNumQueries(1):
+            response = self.get_countries(etag=f'W/{etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.render().content)
+
+    def test_save_changes_etag(self):
+        """Test that saving a country changes the ETag."""
+
+        etag = self.get_countries()['ETag']
+
+        country = Country.objects.get(name='GB')
+        country.continent = 'AS'
+        with self.captureOnCommitCallbacks(execute=True):
+            country.save()
+
+        response = self.get_countries(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_etag_same_in_every_process(self):
+        """Test that without a shared cache the ETag is the same in every process."""
+
+        etag = self.get_countries()['ETag']
+        # Another process starts its cached versions afresh
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            response = self.get_countries(etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+
+class SeatInventoryTest(TransactionTestCase):
+    """Tests for the seat counts of concurrent bookings."""
+
+    def setUp(self):
+        """Create a small schedule of flights."""
+
+        create_schedule()
+
+    def test_full_flight_rejects_booking(self):
+        """Test that a booking on a full flight is refused and not stored."""
+
+        flight = Flight.objects.get(flight_code='TA003')
+        with self.assertRaises(NoSeatsAvailable):
+            Booking.objects.create(flight=flight, passport_number=12345678)
+
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_concurrent_bookings_do_not_oversell(self):
+        """Test that bookings racing from several threads sell each seat once."""
+
+        outcomes = []
+        flight = Flight.objects.get(flight_code='TA000')
+
+        def book():
+            for _ in range(4):
+                while True:
+                    try:
+                        Booking.objects.create(flight=flight, passport_number=random.randint(10000000, 99999999))
+                        outcomes.append(True)
+                    except NoSeatsAvailable:
+                        outcomes.append(False)
+                    except OperationalError:
+                        # The in-memory test database locks tables instead of waiting, so retry
+                        continue
+                    break
+            connection.close()
+
+        threads = [threading.Thread(target=book) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        flight = Flight.objects.get(flight_code='TA000')
+        self.assertEqual(outcomes.count(True), 10)
+        self.assertEqual(flight.available_seats, 0)
+        self.assertEqual(Booking.objects.filter(flight=flight).count(), 10)
+
+        Booking.objects.filter(flight=flight).first().delete()
+        self.assertEqual(Flight.objects.get(flight_code='TA000').available_seats, 1)
+
+
+@mock.patch.object(airline_client, 'request')
+class OutboxTest(TestCase):
+    """Tests for the delivery of queued airline notifications."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+    def setUp(self):
+        """Book a flight and cancel the booking, queueing two notifications."""
+
+        booking = Booking.objects.create(flight_id='TA000', passport_number=12345678)
+        self.booking_ref = booking.booking_ref
+        booking.delete()
+
+    def test_booking_queues_notifications(self, request):
+        """Test that bookings queue their notifications instead of sending them."""
+
+        messages = OutboxMessage.objects.order_by('id')
+        self.assertEqual([message.method for message in messages], ['POST', 'DELETE'])
+        self.assertEqual(messages[0].payload['booking_ref'], self.booking_ref)
+        request.assert_not_called()
+
+    def test_dispatch_sends_in_order(self, request):
+        """Test that the dispatcher sends a booking and its cancellation in order."""
+
+        request.return_value = mock.Mock(status_code=201)
+
+        counts = OutboxDispatcher().dispatch()
+
+        self.assertEqual(counts['sent'], 2)
+        self.assertEqual([call.args[0] for call in request.call_args_list], ['POST', 'DELETE'])
+        self.assertEqual(request.call_args_list[0].args[1:3], ('localhost', '/api/bookings/'))
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.SENT).exists())
+
+    def test_failure_backs_off_and_holds_later_messages(self, request):
+        """Test that a failed booking is retried later and its cancellation waits for it."""
+
+        request.return_value = mock.Mock(status_code=503, text='Unavailable')
+        dispatcher = OutboxDispatcher()
+
+        counts = dispatcher.dispatch()
+        self.assertEqual((counts['retried'], counts['deferred']), (1, 1))
+        self.assertEqual(request.call_count, 1)
+
+        post = OutboxMessage.objects.get(method='POST')
+        self.assertEqual(post.attempts, 1)
+        self.assertGreater(post.next_attempt_at, post.created_at)
+
+        # Nothing is due until the backoff runs out, not even the cancellation
+        self.assertEqual(dispatcher.dispatch()['sent'], 0)
+        self.assertEqual(request.call_count, 1)
+
+    def test_client_error_fails_without_retry(self, request):
+        """Test that a rejected message is marked failed straight away."""
+
+        request.return_value = mock.Mock(status_code=400, text='Bad Request')
+
+        OutboxDispatcher().dispatch()
+
+        self.assertEqual(OutboxMessage.objects.get(method='POST').status, OutboxMessage.FAILED)
+
+    @override_settings(CIRCUIT_FAILURE_THRESHOLD=1)
+    def test_open_circuit_holds_messages(self, request):
+        """Test that an airline failing past the threshold has its later messages held back."""
+
+        request.return_value = mock.Mock(status_code=503, text='Unavailable')
+        OutboxDispatcher().dispatch()
+
+        circuit = AirlineCircuit.objects.get(airline='TA')
+        self.assertEqual(circuit.get_status(), 'open')
+
+        Booking.objects.create(flight_id='TA000', passport_number=87654321)
+        counts = OutboxDispatcher().dispatch()
+
+        self.assertEqual(counts['held'], 1)
+        self.assertEqual(request.call_count, 1)
+        held = OutboxMessage.objects.filter(method='POST').latest('id')
+        self.assertEqual((held.attempts, held.next_attempt_at), (0, circuit.retry_at))
+
+        out = StringIO()
+        call_command('circuit_breakers', '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())[0]['status'], 'open')
+
+    @override_settings(CIRCUIT_FAILURE_THRESHOLD=1)
+    def test_probe_closes_circuit(self, request):
+        """Test that a successful probe once the circuit is due closes it again."""
+
+        request.return_value = mock.Mock(status_code=503, text='Unavailable')
+        OutboxDispatcher().dispatch()
+
+        past = datetime.now(timezone.utc) - timedelta(seconds=1)
+        AirlineCircuit.objects.filter(airline='TA').update(retry_at=past)
+        OutboxMessage.objects.update(next_attempt_at=past)
+        self.assertEqual(AirlineCircuit.objects.get(airline='TA').get_status(), 'half-open')
+
+        request.return_value = mock.Mock(status_code=201)
+        counts = OutboxDispatcher().dispatch()
+
+        self.assertEqual(counts['sent'], 2)
+        circuit = AirlineCircuit.objects.get(airline='TA')
+        self.assertEqual((circuit.get_status(), circuit.failures), ('closed', 0))
+
+    @override_settings(CIRCUIT_FAILURE_THRESHOLD=2, CIRCUIT_OPEN_SECONDS=30)
+    def test_only_failed_probe_extends_circuit(self, request):
+        """Test that failures already on their way when the circuit opens do not keep it open longer."""
+
+        circuit = AirlineCircuit(airline_id='TA')
+        now = datetime.now(timezone.utc)
+        for _ in range(10):
+            circuit.record(100, False, now)
+        self.assertEqual((circuit.get_status(now), circuit.open_seconds), ('open', 30))
+
+        circuit.record(100, False, circuit.retry_at)
+        self.assertEqual(circuit.open_seconds, 60)
+
+    def test_one_dispatcher_claims_probe(self, request):
+        """Test that only one dispatcher gets to probe a circuit that is due to half-open."""
+
+        now = datetime.now(timezone.utc)
+        AirlineCircuit.objects.create(airline_id='TA', state=AirlineCircuit.OPEN, open_seconds=30,
+                                      retry_at=now - timedelta(seconds=1))
+
+        self.assertTrue(OutboxDispatcher().claim_probe('TA', now))
+        self.assertFalse(OutboxDispatcher().claim_probe('TA', now))
+
+
+class AirlineClientTest(TestCase):
+    """Tests for the pooled HTTP client of the airline servers."""
+
+    def test_requests_reuse_connections(self):
+        """Test that requests to one airline share a keep-alive connection."""
+
+        client = AirlineClient(pool_size=2)
+        with stub_airline() as ip:
+            for _ in range(3):
+                self.assertEqual(client.request('POST', ip, '/api/bookings/', data={'booking_ref': 'A'}).status_code, 201)
+            stats = client.stats()[ip]
+        client.close()
+
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 2)
+
+
+class BulkBookingTest(TestCase):
+    """Tests for the bulk booking endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+    def post(self, entries):
+        """Post a list of bookings to the bulk endpoint.
+
+        Args:
+            entries (list): The bookings.
+
+        Returns:
+            Response: The response.
+        """
+
+        return self.client.post('/api/bookings/bulk/', entries, content_type='application/json')
+
+    def test_group_booked_together(self):
+        """Test that a group takes its seats and queues a notification per passenger."""
+
+        response = self.post([{'flight': 'TA000', 'passport_number': 10000000 + i} for i in range(4)]
+                             + [{'flight': 'TA001', 'passport_number': 20000000}])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 5)
+        self.assertEqual(Flight.objects.get(flight_code='TA000').available_seats, 6)
+        booking_refs = {result['booking']['booking_ref'] for result in response.json()['results']}
+        self.assertEqual(len(booking_refs), 5)
+        self.assertEqual(set(OutboxMessage.objects.values_list('booking_ref', flat=True)), booking_refs)
+
+    def test_results_per_entry(self):
+        """Test that entries that cannot be booked get their own errors without stopping the others."""
+
+        Booking.objects.create(flight_id='TA000', passport_number=12345678)
+
+        response = self.post([
+            {'flight': 'TA000', 'passport_number': 12345678},
+            {'flight': 'TA001', 'passport_number': 12345678},
+            {'flight': 'TA003', 'passport_number': 12345678},
+            {'flight': 'XX999', 'passport_number': 12345678},
+            {'flight': 'TA001', 'passport_number': 'abc'},
+        ])
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [400, 201, 409, 404, 400])
+        self.assertEqual(Flight.objects.get(flight_code='TA003').available_seats, 0)
+
+    def test_group_larger_than_flight_is_refused(self):
+        """Test that a group is not split when the flight has too few seats for all of it."""
+
+        response = self.post([{'flight': 'TA000', 'passport_number': 10000000 + i} for i in range(11)])
+
+        self.assertEqual(response.json()['created'], 0)
+        self.assertEqual(Flight.objects.get(flight_code='TA000').available_seats, 10)
+        self.assertFalse(Booking.objects.exists())
+
+
+class FlightImportTest(TestCase):
+    """Tests for the bulk flight import endpoint and command."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+    def test_csv_import(self):
+        """Test that a CSV schedule creates and updates flights and reports rejected rows."""
+
+        Booking.objects.create(flight_id='TA000', passport_number=12345678)
+        header = 'flight_code,departure_airport,destination_airport,departure_datetime,arrival_datetime,' \
+                 'base_price,total_seats,airline'
+        body = '\n'.join([
+            header,
+            'TA000,EGKK,EGLL,2023-07-01T10:00:00Z,2023-07-01T11:00:00Z,150,10,TA',
+            'TA100,EGLL,EGKK,2023-07-01T12:00:00Z,2023-07-01T13:30:00Z,90,50,TA',
+            'TA101,XXXX,EGKK,2023-07-01T12:00:00Z,2023-07-01T11:00:00Z,90,50,TA',
+        ])
+
+        response = self.client.post('/api/flights/bulk/', body, content_type='text/csv')
+
+        report = response.json()
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((report['created'], report['updated'], report['rejected']), (1, 1, 1))
+        self.assertEqual(report['errors'][0]['row'], 4)
+        self.assertEqual(set(report['errors'][0]['errors']), {'departure_airport', 'arrival_datetime'})
+
+        rescheduled = Flight.objects.get(flight_code='TA000')
+        self.assertEqual((rescheduled.departure_airport_id, rescheduled.base_price), ('EGKK', 150))
+        # The booking still holds its seat
+        self.assertEqual(rescheduled.available_seats, 9)
+        created = Flight.objects.get(flight_code='TA100')
+        self.assertEqual((created.available_seats, created.duration_time), (50, timedelta(minutes=90)))
+
+    def test_prices_must_be_finite_and_positive(self):
+        """Test that rows with a price that is not a number, infinite or negative are rejected."""
+
+        header = 'flight_code,departure_airport,destination_airport,departure_datetime,arrival_datetime,' \
+                 'base_price,total_seats,airline'
+        body = '\n'.join([header] + [
+            f'TA2{i:02d},EGLL,EGKK,2023-07-01T12:00:00Z,2023-07-01T13:00:00Z,{price},50,TA'
+            for i, price in enumerate(['nan', 'inf', '-Infinity', '-0.5'])
+        ])
+
+        response = self.client.post('/api/flights/bulk/', body, content_type='text/csv')
+
+        report = response.json()
+        self.assertEqual((report['created'], report['rejected']), (0, 4))
+        self.assertEqual([set(error['errors']) for error in report['errors']], [{'base_price'}] * 4)
+        self.assertFalse(Flight.objects.filter(flight_code__startswith='TA2').exists())
+
+    def test_ndjson_command(self):
+        """Test that the command imports an NDJSON file in chunks."""
+
+        flights = [{
+            'flight_code': f'NJ{i:03d}', 'departure_airport': 'EGLL', 'destination_airport': 'EGKK',
+            'departure_datetime': '2023-07-02T08:00:00Z', 'arrival_datetime': '2023-07-02T09:00:00Z',
+            'base_price': 80, 'total_seats': 100, 'available_seats': 40, 'airline': 'TA',
+        } for i in range(5)]
+
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as file:
+            file.write('\n'.join(json.dumps(flight) for flight in flights) + '\nnot json\n')
+        out = StringIO()
+        try:
+            call_command('import_flights', file.name, '--chunk-size', '2', '--json', stdout=out)
+        finally:
+            os.remove(file.name)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['rows'], report['created'], report['rejected']), (6, 5, 1))
+        self.assertEqual(Flight.objects.filter(flight_code__startswith='NJ', available_seats=40).count(), 5)
+
+    def test_json_rows_must_be_objects(self):
+        """Test that a JSON list with rows that are not objects has them rejected."""
+
+        response = self.client.post('/api/flights/bulk/', [1, 'TA000'], content_type='application/json')
+
+        report = response.json()
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(report['rejected'], 2)
+        self.assertEqual([error['errors'] for error in report['errors']],
+                         [{'row': 'Each row must be a JSON object'}] * 2)
+
+
+class BulkLoaderTest(TestCase):
+    """Tests for the bulk airport loader of populate_database."""
+
+    def test_bulk_load(self):
+        """Test that every usable row is loaded once, sharing countries and cities."""
+
+        header = 'ident,name,city,country,continent,region,size_type,latitude,longitude,elevation'
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('\n'.join([
+                header,
+                'EGLL,Heathrow,London,GB,EU,GB-ENG,large_airport,51.47,-0.46,83',
+                'EGKK,Gatwick,London,GB,EU,GB-ENG,large_airport,51.15,-0.19,202',
+                'LFPG,Charles de Gaulle,Paris,FR,EU,FR-IDF,large_airport,49.01,2.55,392',
+                'EGLL,Heathrow again,London,GB,EU,GB-ENG,large_airport,51.47,-0.46,83',
+                ',No ident,London,GB,EU,GB-ENG,small_airport,51.0,0.0,0',
+                'XXNC,No city,,GB,EU,GB-ENG,small_airport,51.0,0.0,0',
+            ]))
+        try:
+            call_command('populate_database', '--bulk', '--file', file.name, stdout=StringIO())
+            # Loading the file again adds nothing
+            call_command('populate_database', '--bulk', '--file', file.name, stdout=StringIO())
+        finally:
+            os.remove(file.name)
+
+        self.assertEqual(set(Airport.objects.values_list('ident', flat=True)), {'EGLL', 'EGKK', 'LFPG'})
+        self.assertEqual(Country.objects.count(), 2)
+        self.assertEqual(City.objects.count(), 2)
+        self.assertEqual(Airport.objects.get(ident='EGKK').city.name, 'London')
+
+
+class BookingRefTest(TestCase):
+    """Tests for the booking reference generator."""
+
+    def test_refs_unique_across_processes(self):
+        """Test that forked processes making references at once never repeat one."""
+
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            batches = pool.map(generate_booking_refs, [5000] * 4)
+        refs = [ref for batch in batches for ref in batch]
+
+        self.assertEqual(len(set(refs)), len(refs))
+        self.assertTrue(all(len(ref) == 10 and ref.isalnum() and ref.upper() == ref for ref in refs))
+
+    def test_repeated_ref_is_retried(self):
+        """Test that a booking given an existing reference is stored under a new one."""
+
+        create_schedule()
+        existing = Booking.objects.create(flight_id='TA000', passport_number=12345678)
+
+        with mock.patch.object(Booking, 'generate_booking_ref', side_effect=[existing.booking_ref, 'NEWREF0001']):
+            booking = Booking.objects.create(flight_id='TA000', passport_number=87654321)
+
+        self.assertEqual(booking.booking_ref, 'NEWREF0001')
+        self.assertEqual(Booking.objects.get(booking_ref=existing.booking_ref).passport_number, 12345678)
+        self.assertEqual(Flight.objects.get(flight_code='TA000').available_seats, 8)
+
+    def test_busy_process_never_waits(self):
+        """Test that a process out of references for the second stays MAX_LEAD_SECONDS ahead at most."""
+
+        generator = BookingRefGenerator(node=1)
+        count = (MAX_LEAD_SECONDS + 5) << COUNTER_BITS
+
+        with mock.patch('api.references.time.time', return_value=EPOCH + 100.5):
+            start = time.perf_counter()
+            sequences = [generator.get_sequence() for _ in range(count)]
+            elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 1)
+        self.assertEqual(generator.second, 100 + MAX_LEAD_SECONDS)
+        self.assertEqual(len(set(sequences[:(MAX_LEAD_SECONDS + 1) << COUNTER_BITS])),
+                         (MAX_LEAD_SECONDS + 1) << COUNTER_BITS)
+        self.assertTrue(all(sequence < REF_SPACE for sequence in sequences))
+
+
+class BookingLookupTest(CachedEndpointTestCase):
+    """Tests for looking up bookings by flight and passport number."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights and a passenger with a booking on three of them.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+        for flight_code in ('TA000', 'TA001', 'TA002'):
+            Booking.objects.create(flight_id=flight_code, passport_number=12345678)
+        Booking.objects.create(flight_id='TA000', passport_number=87654321)
+
+    def test_passport_lookup_pages_every_booking(self):
+        """Test that a passenger's bookings are all returned, a page at a time, with their flights."""
+
+        response = self.client.get('/api/bookings/', {'passport_number': 12345678, 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        first_page = response.json()
+        self.assertEqual(len(first_page['results']), 2)
+        self.assertEqual(first_page['results'][0]['flight']['departure_airport'], 'EGLL')
+
+        response = self.client.get(first_page['next'])
+        second_page = response.json()
+        self.assertIsNone(second_page['next'])
+
+        flights = [booking['flight']['flight_code'] for booking in first_page['results'] + second_page['results']]
+        self.assertEqual(sorted(flights), ['TA000', 'TA001', 'TA002'])
+
+    def test_flight_and_passport_lookup(self):
+        """Test that a flight's bookings can be narrowed to one passenger."""
+
+        response = self.client.get('/api/bookings/', {'flight': 'TA000'})
+        self.assertEqual(len(response.json()['results']), 2)
+
+        response = self.client.get('/api/bookings/', {'flight': 'TA000', 'passport_number': 87654321})
+        self.assertEqual([booking['passport_number'] for booking in response.json()['results']], [87654321])
+
+        response = self.client.get('/api/bookings/', {'flight': 'TA001', 'passport_number': 87654321})
+        self.assertEqual(response.status_code, 404)
+
+    def test_lookup_uses_index(self):
+        """Test that a passport lookup seeks the index instead of scanning the bookings."""
+
+        bookings = Booking.objects.filter(passport_number=12345678).order_by('booking_ref')
+        self.assertIn('booking_passport_idx', bookings.explain())
+
+
+class AsyncEndpointTest(CachedEndpointTestCase):
+    """Tests for the async flight and booking endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+    def test_flights_match_sync_endpoint(self):
+        """Test that the async flights endpoint returns the same page as the sync one."""
+
+        params = {'departure_airport': 'egll', 'limit': 3}
+        sync_page = self.client.get('/api/flights/', params).json()
+        async_page = self.client.get('/api/async/flights/', params).json()
+
+        self.assertEqual(async_page['results'], sync_page['results'])
+        self.assertIn('/api/async/flights/', async_page['next'])
+
+    def test_booking_created(self):
+        """Test that the async booking endpoint books a seat and queues the notification."""
+
+        response = self.client.post(
+            '/api/async/bookings/', {'flight': 'TA000', 'passport_number': 12345678}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Flight.objects.get(flight_code='TA000').available_seats, 9)
+        self.assertTrue(OutboxMessage.objects.filter(booking_ref=response.json()['booking_ref']).exists())
+
+    def test_full_flight_conflict(self):
+        """Test that booking a full flight is refused."""
+
+        response = self.client.post(
+            '/api/async/bookings/', {'flight': 'TA003', 'passport_number': 12345678}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_async_dispatcher_delivers(self):
+        """Test that the async dispatcher sends queued notifications to the airline."""
+
+        Booking.objects.create(flight_id='TA000', passport_number=12345678)
+
+        with stub_airline() as ip:
+            Airline.objects.update(ip=ip)
+            dispatcher = AsyncOutboxDispatcher()
+
+            async def dispatch():
+                counts = await dispatcher.adispatch()
+                await dispatcher.aclose()
+                return counts
+
+            counts = async_to_sync(dispatch)()
+
+        self.assertEqual(counts['sent'], 1)
+        self.assertEqual(OutboxMessage.objects.get().status, OutboxMessage.SENT)
+
+
+class ServerTimingTest(CachedEndpointTestCase):
+    """Tests for the per-request timing middleware."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_sampled_request_timed(self):
+        """Test that a sampled request reports its queries in a header and a log line."""
+
+        with self.assertLogs('api.timing', level='INFO') as logs:
+            response = self.client.get('/api/flights/', {'flight_code': 'TA000'})
+
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        timing = logs.records[0].timing
+        self.assertEqual(timing['route'], 'flights')
+        self.assertEqual(timing['queries'], 1)
+        self.assertGreater(timing['serializer_ms'], 0)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_async_request_timed(self):
+        """Test that queries run by an async view are counted too."""
+
+        with self.assertLogs('api.timing', level='INFO'):
+            response = self.client.get('/api/async/flights/', {'flight_code': 'TA000'})
+
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request_untouched(self):
+        """Test that requests left out of the sample get no header."""
+
+        response = self.client.get('/api/flights/', {'flight_code': 'TA000'})
+
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTest(CachedEndpointTestCase):
+    """Tests for the Prometheus metrics."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+
+    def get_sample(self, name, **labels):
+        """Read the current value of a metric of this process.
+
+        Args:
+            name (str): The sample name.
+            **labels: The labels of the sample.
+
+        Returns:
+            float: The value, or 0 if nothing was recorded yet.
+        """
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_counted_per_route(self):
+        """Test that requests are counted and timed under their route name and method."""
+
+        labels = {'route': 'flights', 'method': 'GET'}
+        requests_before = self.get_sample('api_requests_total', status='200', **labels)
+        queries_before = self.get_sample('api_request_queries_sum', **labels)
+
+        self.client.get('/api/flights/', {'flight_code': 'TA000'})
+
+        self.assertEqual(self.get_sample('api_requests_total', status='200', **labels), requests_before + 1)
+        self.assertEqual(self.get_sample('api_request_queries_sum', **labels), queries_before + 1)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'api_request_duration_seconds_bucket{le="0.005",method="GET",route="flights"}',
+                      response.content)
+
+    def test_bookings_counted_per_airline(self):
+        """Test that created and deleted bookings are counted once committed."""
+
+        created_before = self.get_sample('api_bookings_created_total', airline='TA')
+        deleted_before = self.get_sample('api_bookings_deleted_total', airline='TA')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = Booking.objects.create(flight_id='TA000', passport_number=12345678)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+
+        self.assertEqual(self.get_sample('api_bookings_created_total', airline='TA'), created_before + 1)
+        self.assertEqual(self.get_sample('api_bookings_deleted_total', airline='TA'), deleted_before + 1)
+
+    def test_airline_errors_counted(self):
+        """Test that notifications an airline fails to answer are timed and counted."""
+
+        errors_before = self.get_sample('api_airline_errors_total', airline='TA', retry='true')
+        Booking.objects.create(flight_id='TA000', passport_number=12345678)
+
+        unavailable = mock.Mock(status_code=503, text='Unavailable')
+        with mock.patch.object(airline_client, 'request', return_value=unavailable):
+            OutboxDispatcher().dispatch()
+
+        self.assertEqual(self.get_sample('api_airline_errors_total', airline='TA', retry='true'), errors_before + 1)
+        self.assertGreater(self.get_sample('api_airline_request_duration_seconds_count', airline='TA'), 0)
+
+
+class ProfilingTest(CachedEndpointTestCase):
+    """Tests for profiling single requests of staff users."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights and a staff and a regular user.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+        cls.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        cls.user = User.objects.create_user('user', password='secret')
+
+    def setUp(self):
+        """Store the profiles in a temporary directory."""
+
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_staff_request_profiled(self):
+        """Test that a staff user gets a pstats profile of the request."""
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/flights/', {'departure_airport': 'EGLL', 'profile': 1})
+
+        self.assertEqual(response.status_code, 200)
+        stats = pstats.Stats(os.path.join(self.directory, response['X-Profile']))
+        self.assertTrue(any(function == 'get_flights' for _, _, function in stats.stats))
+
+    def test_collapsed_stacks_with_basic_auth(self):
+        """Test that an API client signed in with basic auth can ask for collapsed stacks by header."""
+
+        get_airports = AirportViewSet.get_airports
+
+        def slow_get_airports(view, request, *args, **kwargs):
+            # Long enough to be sampled many times, however fast the query is
+            time.sleep(0.05)
+            return get_airports(view, request, *args, **kwargs)
+
+        credentials = base64.b64encode(b'staff:secret').decode()
+        with mock.patch.object(AirportViewSet, 'get_airports', slow_get_airports):
+            response = self.client.get('/api/airports/', HTTP_AUTHORIZATION=f'Basic {credentials}',
+                                       HTTP_X_PROFILE='collapsed')
+
+        with open(os.path.join(self.directory, response['X-Profile']), encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        self.assertTrue(any('slow_get_airports' in line for line in lines))
+        for line in lines:
+            _, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+    def test_other_users_not_profiled(self):
+        """Test that the parameter is ignored for anonymous and regular users."""
+
+        response = self.client.get('/api/flights/', {'profile': 1})
+        self.assertNotIn('X-Profile', response)
+
+        self.client.force_login(self.user)
+        response = self.client.get('/api/flights/', {'profile': 1})
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class QueryPlanTest(TestCase):
+    """Tests for the query plan audit."""
+
+    def test_plan_problems_flagged(self):
+        """Test that scans, joins without an index and temporary B-trees are told apart."""
+
+        plan = [
+            {'id': 2, 'parent': 0, 'detail': 'SCAN api_airport'},
+            {'id': 3, 'parent': 0, 'detail': 'SEARCH api_city USING INTEGER PRIMARY KEY (rowid=?)'},
+            {'id': 4, 'parent': 0, 'detail': 'SCAN api_country'},
+            {'id': 5, 'parent': 0, 'detail': 'USE TEMP B-TREE FOR ORDER BY'},
+        ]
+
+        self.assertEqual([flag for flag, _, _ in get_sqlite_findings(plan)],
+                         ['full_scan', 'unindexed_join', 'temp_btree'])
+
+    def test_fingerprint_ignores_list_length(self):
+        """Test that the same query with more values in a list is recognised."""
+
+        self.assertEqual(get_fingerprint('SELECT 1 FROM t WHERE id IN (%s, %s)'),
+                         get_fingerprint('SELECT 1 FROM t WHERE id IN (%s, %s, %s)'))
+
+    @skipUnless(connection.vendor == 'sqlite', 'The plan details are those of SQLite')
+    def test_iexact_join_scans_airports(self):
+        """Test that a case-insensitive city lookup is flagged while a flight code lookup is not."""
+
+        with StatementCollector().installed() as collector:
+            list(Airport.objects.filter(city__name__iexact='london'))
+            list(Flight.objects.filter(flight_code='TA000'))
+
+        findings = audit(collector.statements)
+        self.assertEqual([(finding['flag'], finding['table']) for finding in findings],
+                         [('full_scan', 'api_airport')])
+
+
+class FieldsetTest(CachedEndpointTestCase):
+    """Tests for choosing and expanding the fields of flights and bookings."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a small schedule of flights and a booking on one of them.
+
+        Args:
+            cls: The class itself.
+        """
+        create_schedule()
+        Booking.objects.create(flight_id='TA000', passport_number=12345678)
+
+    def test_fields_trim_flights(self):
+        """Test that only the requested fields of each flight are returned."""
+
+        response = self.client.get('/api/flights/', {'fields': 'flight_code,base_price', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0], {'flight_code': 'TA000', 'base_price': 100.0})
+
+    def test_expand_inlines_relations_in_one_query(self):
+        """Test that expanded airlines and airports are fetched in the same query as the flights."""
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/flights/', {
+                'fields': 'flight_code,airline,departure_airport',
+                'expand': 'airline,departure_airport', 'limit': 2})
+
+        flight = response.json()['results'][0]
+        self.assertEqual(flight['airline'], {'code': 'TA', 'name': 'Test Airline', 'ip': 'localhost'})
+        self.assertEqual(flight['departure_airport']['ident'], 'EGLL')
+
+    def test_nested_expand_on_bookings(self):
+        """Test that a booking lookup can expand its flight and the flight's airline."""
+
+        response = self.client.get('/api/bookings/', {
+            'passport_number': 12345678, 'fields': 'booking_ref,flight', 'expand': 'flight.airline'})
+        self.assertEqual(response.status_code, 200)
+        booking = response.json()['results'][0]
+        self.assertEqual(set(booking), {'booking_ref', 'flight'})
+        self.assertEqual(booking['flight']['airline']['code'], 'TA')
+
+    def test_unknown_fields_rejected(self):
+        """Test that unknown fields and relations that cannot be expanded are rejected."""
+
+        response = self.client.get('/api/flights/', {'fields': 'flight_code,nope'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Unknown fields: nope'})
+        response = self.client.get('/api/bookings/', {'expand': 'passport_number'})
+        self.assertEqual(response.status_code, 400)
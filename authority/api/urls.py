@@ -6,8 +6,10 @@ from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
-from .views import AirlineViewSet, AirportViewSet, \
-    FlightViewSet, BookingViewSet, CityViewSet, CountryViewSet
+from .async_views import AsyncBookingView, AsyncFlightView
+from .metrics import metrics_view
+from .views import AirlineViewSet, AirportViewSet, AutocompleteViewSet, \
+    FlightViewSet, BookingViewSet, CityViewSet, CountryViewSet, ItineraryViewSet
 
 urlpatterns = [
         # This path is used to access the API documentation
@@ -18,6 +20,9 @@ urlpatterns = [
         path('swagger/', SpectacularSwaggerView.as_view(url_name='schema'),
             name='swagger-ui'),
 
+        # This path is scraped by Prometheus
+        path('metrics', metrics_view, name='metrics'),
+
         # This path is used to access the admin panel
         path('admin/', admin.site.urls),
 
@@ -29,6 +34,14 @@ urlpatterns = [
             'delete': 'delete_flight',
         }), name='flights'),
 
+        path('api/flights/bulk/', FlightViewSet.as_view({
+            'post': 'import_flights',
+        }), name='bulk-flights'),
+
+        path('api/itineraries/', ItineraryViewSet.as_view({
+            'get': 'get_itineraries',
+        }), name='itineraries'),
+
         path('api/bookings/', BookingViewSet.as_view({
             'get': 'get_bookings',
             'post': 'create_booking',
@@ -36,6 +49,14 @@ urlpatterns = [
             'delete': 'delete_booking',
         }), name='bookings'),
 
+        path('api/bookings/bulk/', BookingViewSet.as_view({
+            'post': 'create_bookings',
+        }), name='bulk-bookings'),
+
+        # Async versions of the flight and booking endpoints, for ASGI servers
+        path('api/async/flights/', AsyncFlightView.as_view(), name='async-flights'),
+        path('api/async/bookings/', AsyncBookingView.as_view(), name='async-bookings'),
+
         # These paths are used to access the search capabilities
         path('api/airlines/', AirlineViewSet.as_view({
             'get': 'get_airlines',
@@ -45,6 +66,10 @@ urlpatterns = [
             'get': 'get_airports',
         }), name='airports'),
 
+        path('api/airports/nearby/', AirportViewSet.as_view({
+            'get': 'get_nearby_airports',
+        }), name='nearby-airports'),
+
         path('api/cities/', CityViewSet.as_view({
             'get': 'get_cities',
         }), name='cities'),
@@ -52,4 +77,8 @@ urlpatterns = [
         path('api/countries/', CountryViewSet.as_view({
             'get': 'get_countries',
         }), name='countries'),
+
+        path('api/autocomplete/', AutocompleteViewSet.as_view({
+            'get': 'get_suggestions',
+        }), name='autocomplete'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,16 +1,30 @@
 """This module contains the viewsets for the Flight and Booking endpoints."""
 
-import requests
+import math
+from datetime import timedelta
+from functools import partial
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.static import serve
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from .autocomplete import MAX_SUGGESTIONS, autocomplete_index
+from .bulk import BULK_BOOKING_LIMIT, book_many, import_flights, read_flight_rows
+from .caching import cache_response, conditional_response, invalidate
 from .filters import AirportFilter, FlightFilter
-from .models import Airline, Airport, Flight, Booking, City, Country
+from .itineraries import SORT_KEYS, find_itineraries
+from .models import Airline, Airport, Flight, Booking, City, Country, NoSeatsAvailable
+from .pagination import BookingCursorPagination, FlightCursorPagination
+from .search import search_airports
 from .serializers import AirlineSerializer, AirportSerializer, \
-    FlightSerializer, BookingSerializer, CitySerializer, CountrySerializer
+    FlightSerializer, BookingSerializer, BookingDetailSerializer, CitySerializer, CountrySerializer, \
+    ItinerarySerializer, NearbyAirportSerializer
+from .spatial import airport_index
+from .streaming import stream_queryset, wants_stream
 
 
 def get_param(param, request):
@@ -28,6 +42,129 @@ def get_param(param, request):
     return query if query else request.data.get(param)
 
 
+def get_fieldsets(request, serializer_class):
+    """Gets the fields and the related objects to inline that the request asks for.
+
+    Args:
+        request (Request): The request object.
+        serializer_class (Serializer): The serializer of the response.
+
+    Raises:
+        ValueError: If a field or a related object is unknown.
+
+    Returns:
+        tuple: The fields to keep, or None for every field, and the related objects to inline.
+    """
+
+    fields = get_param('fields', request)
+    expand = get_param('expand', request)
+    fields = [name.strip() for name in fields.split(',') if name.strip()] if fields else None
+    expand = [name.strip() for name in expand.split(',') if name.strip()] if expand else []
+    serializer_class.check_fieldsets(fields, expand)
+
+    return fields, expand
+
+
+def get_int_param(param, request, default, minimum, maximum):
+    """Gets an integer parameter from the request, clamped to a range.
+
+    Args:
+        param (str): The parameter to get.
+        request (Request): The request object.
+        default (int): The value to use if the parameter is missing or invalid.
+        minimum (int): The smallest allowed value.
+        maximum (int): The largest allowed value.
+
+    Returns:
+        int: The parameter value.
+    """
+
+    try:
+        value = int(get_param(param, request))
+    except (TypeError, ValueError):
+        return default
+
+    return max(minimum, min(value, maximum))
+
+
+def get_datetime_param(param, request):
+    """Gets a datetime parameter from the request.
+
+    Args:
+        param (str): The parameter to get.
+        request (Request): The request object.
+
+    Raises:
+        ValueError: If the parameter is not an ISO 8601 datetime.
+
+    Returns:
+        datetime: The timezone-aware datetime, or None if the parameter is missing.
+    """
+
+    value = get_param(param, request)
+    if not value:
+        return None
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Invalid datetime: {value}')
+
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def get_float_param(param, request):
+    """Gets a number parameter from the request.
+
+    Args:
+        param (str): The parameter to get.
+        request (Request): The request object.
+
+    Raises:
+        ValueError: If the parameter is not a finite number.
+
+    Returns:
+        float: The parameter value, or None if the parameter is missing.
+    """
+
+    value = get_param(param, request)
+    if value in (None, ''):
+        return None
+
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f'Invalid number: {value}')
+
+    return value
+
+
+def resolve_airports(prefix, request):
+    """Resolves the airports at one end of a journey from the request.
+
+    Args:
+        prefix (str): Either 'departure' or 'destination'.
+        request (Request): The request object.
+
+    Returns:
+        set: The airport idents, or None if no airport, city or country was given.
+    """
+
+    ident = get_param(f'{prefix}_airport', request)
+    city = get_param(f'{prefix}_city', request)
+    country = get_param(f'{prefix}_country', request)
+
+    if ident:
+        return {ident.upper()}
+
+    if city:
+        airports = Airport.objects.filter(city__name__iexact=city)
+    elif country:
+        airports = Airport.objects.filter(city__country__name__iexact=country)
+    else:
+        return None
+
+    return set(airports.values_list('ident', flat=True))
+
+
 class AirlineViewSet(viewsets.GenericViewSet):
     """This class defines the viewset for the Airline endpoint."""
 
@@ -36,6 +173,8 @@ class AirlineViewSet(viewsets.GenericViewSet):
     filter_backends = [DjangoFilterBackend]
 
     @action(detail=False, methods=['get'], serializer_class=AirlineSerializer)
+    @conditional_response('airline')
+    @cache_response('airline')
     def get_airlines(self, request):
         """
         This API endpoint retrieves a list of all airlines or a specific airline, depending on the provided parameters. 
@@ -91,6 +230,8 @@ class AirportViewSet(viewsets.GenericViewSet):
     filterset_class = AirportFilter
 
     @action(detail=False, methods=['get'], serializer_class=AirportSerializer)
+    @conditional_response('airport', 'city', 'country')
+    @cache_response('airport', 'city', 'country')
     def get_airports(self, request):
         """
         This API endpoint retrieves a list of all airports or specific airports based on provided parameters. 
@@ -108,6 +249,10 @@ class AirportViewSet(viewsets.GenericViewSet):
                 - longitude_min and longitude_max: (optional) Filter by longitude range.
                 - elevation_min and elevation_max: (optional) Filter by elevation range.
                 - continent: (optional) Filter by continent.
+                - search: (optional) Full-text search over the airport name, region, city and country.
+                  Every word must start a word of one of those, and the best matches come first.
+                - stream: (optional) If 1, stream the list as a JSON array instead of buffering it.
+                  Sending 'Accept: application/x-ndjson' streams it as one airport per line.
 
         Returns:
             Response: A Django REST framework response object. 
@@ -133,6 +278,7 @@ class AirportViewSet(viewsets.GenericViewSet):
             To get a list of airports in a latitude range: GET /api/airports/?latitude_min=40&latitude_max=45
             To get a list of airports in a longitude range: GET /api/airports/?longitude_min=-80&longitude_max=-70
             To get a list of airports in an elevation range: GET /api/airports/?elevation_min=100&elevation_max=200
+            To search for JFK airport: GET /api/airports/?search=new york kennedy
         """
         
         ident = get_param('ident', request)
@@ -180,6 +326,13 @@ class AirportViewSet(viewsets.GenericViewSet):
         # Filter the airports based on the query parameters
         airports = AirportFilter(request.GET, queryset=airports).qs
 
+        search = get_param('search', request)
+        if search:
+            airports = search_airports(airports, search)
+
+        if wants_stream(request):
+            return stream_queryset(request, airports, AirportSerializer)
+
         # If no airports are found, return 404
         if not airports:
             return Response({'error': 'No airports found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -189,6 +342,71 @@ class AirportViewSet(viewsets.GenericViewSet):
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'], serializer_class=NearbyAirportSerializer)
+    @cache_response('airport')
+    def get_nearby_airports(self, request):
+        """
+        This API endpoint retrieves the airports nearest to a position by great-circle distance.
+
+        Parameters:
+            request (Request): The Django REST framework request object.
+                Query parameters:
+                - lat: (required) The latitude in degrees.
+                - lon: (required) The longitude in degrees.
+                - radius_km: (optional) Only include airports within this many kilometres.
+                - k: (optional) The maximum number of airports, up to 100. Defaults to 10.
+
+        Returns:
+            Response: A Django REST framework response object.
+                Response data format:
+                - If airports are found:
+                    - HTTP status code: 200 (OK)
+                    - JSON data: A list of airports, nearest first, each with its 'distance_km'.
+                - If the position or radius is missing or invalid:
+                    - HTTP status code: 400 (Bad Request)
+                    - JSON data: An error message.
+                - If no airports are within the radius:
+                    - HTTP status code: 404 (Not Found)
+                    - JSON data: An error message.
+
+        Example usage:
+            To get the 5 airports nearest to central London: GET /api/airports/nearby/?lat=51.5&lon=-0.12&k=5
+            To get the airports within 50 km of central London: GET /api/airports/nearby/?lat=51.5&lon=-0.12&radius_km=50
+        """
+
+        try:
+            latitude = get_float_param('lat', request)
+            longitude = get_float_param('lon', request)
+            radius_km = get_float_param('radius_km', request)
+        except ValueError:
+            return Response({'error': 'lat, lon and radius_km must be numbers.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if latitude is None or longitude is None \
+                or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            return Response({'error': 'A lat between -90 and 90 and a lon between -180 and 180 are required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if radius_km is not None and radius_km <= 0:
+            return Response({'error': 'radius_km must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Find the nearest idents in memory, then fetch just those airports by primary key
+        nearest = airport_index.get().nearest(
+            latitude, longitude, k=get_int_param('k', request, 10, 1, 100), radius_km=radius_km)
+        airports = Airport.objects.in_bulk([ident for _, ident in nearest])
+
+        results = []
+        for distance_km, ident in nearest:
+            if ident in airports:
+                airport = airports[ident]
+                airport.distance_km = round(distance_km, 3)
+                results.append(airport)
+
+        if not results:
+            return Response({'error': 'No airports found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(NearbyAirportSerializer(results, many=True).data, status=status.HTTP_200_OK)
+
 
 class FlightViewSet(viewsets.GenericViewSet):
     """Viewset for the Flight model."""
@@ -197,8 +415,10 @@ class FlightViewSet(viewsets.GenericViewSet):
     serializer_class = FlightSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = FlightFilter
+    pagination_class = FlightCursorPagination
 
     @action(detail=False, methods=['get'], serializer_class=FlightSerializer)
+    @cache_response('flight', 'airport', 'city', 'country')
     def get_flights(self, request):
         """
         This API endpoint retrieves a list of all flights or specific flights based on provided parameters.
@@ -213,6 +433,13 @@ class FlightViewSet(viewsets.GenericViewSet):
                 - base_price_min and base_price_max: (optional) Filter by base price range.
                 - departure_datetime_min and departure_datetime_max: (optional) Filter by departure datetime range.
                 - arrival_datetime_min and arrival_datetime_max: (optional) Filter by arrival datetime range.
+                - limit: (optional) The number of flights per page (default 100, max 1000).
+                - cursor: (optional) The cursor from the 'next' link of the previous page.
+                - stream: (optional) If 1, stream every matching flight as a JSON array instead of a page.
+                  Sending 'Accept: application/x-ndjson' streams them as one flight per line.
+                - fields: (optional) A comma-separated list of the fields to return, like flight_code,base_price.
+                - expand: (optional) A comma-separated list of departure_airport, destination_airport and airline,
+                  to return the related objects instead of their keys.
 
         Returns:
             Response: A Django REST framework response object.
@@ -225,15 +452,19 @@ class FlightViewSet(viewsets.GenericViewSet):
                     - JSON data: An error message.
                 - If no 'flight_code' parameter is provided:
                     - HTTP status code: 200 (OK)
-                    - JSON data: A serialized list of all flights that match the other query parameters.
+                    - JSON data: A page of the flights that match the other query parameters,
+                      ordered by departure datetime and flight code, as 'results',
+                      with the URL of the next page (or null) as 'next'.
                 - If no flights match the provided parameters:
                     - HTTP status code: 204 (No Content)
                     - JSON data: An error message.
 
         Example usage:
             To get a list of all flights: GET /api/flights/
+            To get the next page of flights: GET /api/flights/?limit=100&cursor=<cursor>
             To get a specific flight by flight_code: GET /api/flights/?flight_code=AA100
             To get a list of flights from LAX to JFK: GET /api/flights/?departure_airport=LAX&destination_airport=JFK
+            To get just the codes and prices of flights with their airlines: GET /api/flights/?fields=flight_code,base_price,airline&expand=airline
             To get a list of flights with a base price between $100 and $300: GET /api/flights/?base_price_min=100&base_price_max=300
             To get a list of flights with a departure datetime between 2023-05-01T00:00:00Z and 2023-05-31T23:59:59Z: GET /api/flights/?departure_datetime_min=2023-05-01T00:00:00Z&departure_datetime_max=2023-05-31T23:59:59Z
             To get a list of flights with an arrival datetime between 2023-05-01T00:00:00Z and 2023-05-31T23:59:59Z: GET /api/flights/?arrival_datetime_min=2023-05-01T00:00:00Z&arrival_datetime_max=2023-05-31T23:59:59Z            
@@ -241,6 +472,11 @@ class FlightViewSet(viewsets.GenericViewSet):
 
         flight_code = get_param('flight_code', request)
 
+        try:
+            fields, expand = get_fieldsets(request, FlightSerializer)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
         # We want to allow the user to get flights based on a query parameter
         # They can choose a a specific departure_datetime, destination_airport, departure_airport, airline, arrival_datetime, duration_time, base_price, total_seats, available_seats
         # They can also choose a range of values for the above parameters
@@ -249,10 +485,11 @@ class FlightViewSet(viewsets.GenericViewSet):
 
         if flight_code:
             # Get the specific flight with the provided flight_code
-            flights = Flight.objects.filter(flight_code=flight_code)
-            if not flights.exists():
+            flights = FlightSerializer.select_fields(Flight.objects.filter(flight_code=flight_code), fields, expand)
+            flight = flights.first()
+            if flight is None:
                 return Response({"detail": f'Flight \'{flight_code}\' not found.'}, status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(flights.first()).data, status=status.HTTP_200_OK)
+            return Response(self.get_serializer(flight, fields=fields, expand=expand).data, status=status.HTTP_200_OK)
 
         # Get filtered flights or all flights if no filter is applied
         flight_filter = FlightFilter(
@@ -260,15 +497,24 @@ class FlightViewSet(viewsets.GenericViewSet):
 
         # Do not show flights with 0 available seats
         flights = flight_filter.qs.filter(available_seats__gt=0)
+        # Only read the requested columns, and join in the requested related objects
+        flights = FlightSerializer.select_fields(flights, fields, expand, required=FlightCursorPagination.ordering)
+
+        # Exports skip pagination and write rows as they are read
+        if wants_stream(request):
+            return stream_queryset(request, flights, partial(FlightSerializer, fields=fields, expand=expand))
 
-        if not flights.exists():
+        # Only fetch a single page, seeking past the cursor if one is given
+        page = self.paginate_queryset(flights)
+
+        if not page and self.paginator.position is None:
             return Response(
                 {"detail": "No flights available."},
                 status=status.HTTP_204_NO_CONTENT)
 
-        serializer = self.get_serializer(flights, many=True)
+        serializer = self.get_serializer(page, many=True, fields=fields, expand=expand)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['post'], serializer_class=FlightSerializer)
     def create_flight(self, request):
@@ -330,6 +576,58 @@ class FlightViewSet(viewsets.GenericViewSet):
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], serializer_class=FlightSerializer)
+    def import_flights(self, request):
+        """
+        This API endpoint creates or updates many flights in one request, such as a season's schedule.
+
+        Parameters:
+            request (Request): The Django REST framework request object.
+                Request body, read as it arrives, in one of these formats:
+                - Content-Type text/csv: A header row, then a flight per row.
+                - Content-Type application/x-ndjson: A JSON object per line.
+                - Content-Type application/json: A list of JSON objects.
+                Each flight has the fields of POST /api/flights/. duration_time defaults to the
+                time between departure and arrival, and available_seats to total_seats.
+                Existing flights are updated, apart from their seat counts.
+
+        Returns:
+            Response: A Django REST framework response object.
+                Response data format:
+                - If every row is imported:
+                    - HTTP status code: 201 (Created)
+                - If some rows are rejected:
+                    - HTTP status code: 207 (Multi-Status)
+                - Either way, JSON data: The number of rows read, flights created and updated and rows
+                  rejected, with the row number and field errors of the first rejected rows.
+                - If the body is in another format:
+                    - HTTP status code: 415 (Unsupported Media Type)
+                    - JSON data: An error message.
+
+        Example usage:
+            To import a schedule: POST /api/flights/bulk/ with a CSV file and 'Content-Type: text/csv'.
+        """
+
+        file_format = {
+            'text/csv': 'csv',
+            'application/x-ndjson': 'ndjson',
+        }.get(request.content_type.split(';')[0].strip())
+
+        if file_format:
+            # Parse the body as it is read, without holding all of it in memory
+            rows = read_flight_rows((line.decode('utf-8', 'replace') for line in request.stream or ()), file_format)
+        elif isinstance(request.data, list):
+            rows = ((number, row if isinstance(row, dict) else 'Each row must be a JSON object')
+                    for number, row in enumerate(request.data, start=1))
+        else:
+            return Response(
+                {"error": "Send flights as text/csv, application/x-ndjson or a JSON list"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        report = import_flights(rows)
+
+        return Response(report, status=status.HTTP_207_MULTI_STATUS if report['rejected'] else status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['patch'], serializer_class=FlightSerializer)
     def modify_flight(self, request):
 
@@ -434,6 +732,91 @@ class FlightViewSet(viewsets.GenericViewSet):
         return Response({"detail": f'Flight \'{flight_code}\' deleted'}, status=status.HTTP_200_OK)
 
 
+class ItineraryViewSet(viewsets.GenericViewSet):
+    """Viewset for itineraries of connecting flights."""
+
+    queryset = Flight.objects.none()
+    serializer_class = ItinerarySerializer
+
+    @action(detail=False, methods=['get'], serializer_class=ItinerarySerializer)
+    @cache_response('flight', 'airport', 'city', 'country')
+    def get_itineraries(self, request):
+        """
+        This API endpoint finds direct flights and 1- and 2-stop connections between two places.
+
+        Parameters:
+            request (Request): The Django REST framework request object.
+                Query parameters:
+                - departure_airport, departure_city or departure_country: (one required) Where to travel from.
+                - destination_airport, destination_city or destination_country: (one required) Where to travel to.
+                - departure_datetime_min: (optional) The earliest first departure. Defaults to now.
+                - departure_datetime_max: (optional) The latest first departure. Defaults to a day after the earliest.
+                - max_stops: (optional) The maximum number of stops, from 0 to 2. Defaults to 2.
+                - min_connection: (optional) The minimum connection time in minutes, at least 30. Defaults to 60.
+                - max_connection: (optional) The maximum connection time in minutes. Defaults to 1440.
+                - sort: (optional) Rank by 'arrival' time or total 'price'. Defaults to 'arrival'.
+                - limit: (optional) The maximum number of itineraries, up to 100. Defaults to 20.
+
+        Returns:
+            Response: A Django REST framework response object.
+                Response data format:
+                - If itineraries are found:
+                    - HTTP status code: 200 (OK)
+                    - JSON data: A ranked list of itineraries, each with its flights, number of stops,
+                      departure and arrival datetimes, total duration and total price.
+                - If the departure or destination is missing or a parameter is invalid:
+                    - HTTP status code: 400 (Bad Request)
+                    - JSON data: An error message.
+                - If no itineraries are found:
+                    - HTTP status code: 204 (No Content)
+                    - JSON data: A message stating that no itineraries are available.
+
+        Example usage:
+            To find connections from Heathrow to JFK: GET /api/itineraries/?departure_airport=EGLL&destination_airport=KJFK
+            To find the cheapest way from London to New York: GET /api/itineraries/?departure_city=London&destination_city=New York&sort=price
+        """
+
+        origins = resolve_airports('departure', request)
+        destinations = resolve_airports('destination', request)
+
+        if origins is None or destinations is None:
+            return Response(
+                {"error": "A departure and a destination airport, city or country are required"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            earliest = get_datetime_param('departure_datetime_min', request) or timezone.now()
+            latest = get_datetime_param('departure_datetime_max', request) or earliest + timedelta(days=1)
+        except ValueError:
+            return Response(
+                {"error": "Departure datetimes must be in ISO 8601 format"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        sort = get_param('sort', request) or 'arrival'
+        if sort not in SORT_KEYS:
+            return Response(
+                {"error": f'Sort must be one of {", ".join(SORT_KEYS)}'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        min_connection = get_int_param('min_connection', request, 60, 30, 24 * 60)
+        max_connection = get_int_param('max_connection', request, 24 * 60, min_connection, 3 * 24 * 60)
+
+        itineraries = find_itineraries(
+            origins, destinations, earliest, latest,
+            sort=sort,
+            limit=get_int_param('limit', request, 20, 1, 100),
+            max_stops=get_int_param('max_stops', request, 2, 0, 2),
+            min_connection=min_connection * 60,
+            max_connection=max_connection * 60)
+
+        if not itineraries:
+            return Response(
+                {"detail": "No itineraries available."},
+                status=status.HTTP_204_NO_CONTENT)
+
+        return Response(self.get_serializer(itineraries, many=True).data, status=status.HTTP_200_OK)
+
+
 class BookingViewSet(viewsets.GenericViewSet):
     """Viewset for the Booking model."""
 
@@ -442,17 +825,28 @@ class BookingViewSet(viewsets.GenericViewSet):
     filter_backends = [DjangoFilterBackend]
 
     @action(detail=False, methods=['get'], serializer_class=BookingSerializer)
+    @cache_response('booking', 'flight')
     def get_bookings(self, request):
         """
-        This API endpoint retrieves a list of all bookings or a specific booking based on the provided booking reference,
-        flight code, or passport number. 
+        This API endpoint retrieves a list of all bookings, a specific booking based on the provided booking reference,
+        or every booking with the provided flight code and/or passport number.
 
         Parameters:
             request (Request): The Django REST framework request object.
                 Query parameters:
                 - booking_ref: The unique reference of the booking to be retrieved.
-                - flight: The unique code of the flight associated with the booking.
+                - flight: The unique code of the flight associated with the bookings.
                 - passport_number: The passport number of the passenger.
+                - limit: (optional) With flight or passport_number, the number of bookings per page
+                  (default 100, max 1000).
+                - cursor: (optional) With flight or passport_number, the cursor from the 'next' link
+                  of the previous page.
+                - stream: (optional) If 1, stream the list of all bookings as a JSON array.
+                  Sending 'Accept: application/x-ndjson' streams it as one booking per line.
+                - fields: (optional) A comma-separated list of the fields to return, like booking_ref,flight.
+                - expand: (optional) flight to return the flight instead of its code, and flight.airline,
+                  flight.departure_airport or flight.destination_airport to expand the flight's too.
+                  Bookings found by flight or passport number always have their flight expanded.
 
         Returns:
             Response: A Django REST framework response object.
@@ -463,6 +857,13 @@ class BookingViewSet(viewsets.GenericViewSet):
                 - If a specific booking is retrieved:
                     - HTTP status code: 200 (OK)
                     - JSON data: A booking object.
+                - If bookings are looked up by flight and/or passport number:
+                    - HTTP status code: 200 (OK)
+                    - JSON data: A page of the matching bookings in booking reference order, each with
+                      the details of its flight, as 'results', with the URL of the next page (or null) as 'next'.
+                - If no bookings match the flight and/or passport number:
+                    - HTTP status code: 404 (Not Found)
+                    - JSON data: An error message.
                 - If no bookings are found:
                     - HTTP status code: 204 (No Content)
                     - JSON data: A message stating that no bookings are available.
@@ -470,48 +871,61 @@ class BookingViewSet(viewsets.GenericViewSet):
         
         booking_ref = get_param('booking_ref', request)
 
+        try:
+            fields, expand = get_fieldsets(request, BookingSerializer)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
         if booking_ref:
             # Get the specific booking with the provided booking_ref
-            bookings = Booking.objects.filter(booking_ref=booking_ref)
-            if not bookings.exists():
+            bookings = BookingSerializer.select_fields(Booking.objects.filter(booking_ref=booking_ref), fields, expand)
+            booking = bookings.first()
+            if booking is None:
                 return Response({"detail": f'Booking \'{booking_ref}\' not found.'}, status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(bookings.first()).data, status=status.HTTP_200_OK)
+            return Response(self.get_serializer(booking, fields=fields, expand=expand).data, status=status.HTTP_200_OK)
 
         flight_code = get_param('flight', request)
         passport_number = get_param('passport_number', request)
 
-        if flight_code:
-            # Get the specific booking with the provided flight_code
-            # but if passport_number is provided, use it in query as well
+        if flight_code or passport_number:
+            # Every matching booking, a page at a time, found through the booking lookup indexes
+            bookings = BookingDetailSerializer.select_fields(
+                Booking.objects.all(), fields, expand, required=BookingCursorPagination.ordering)
+            if flight_code:
+                bookings = bookings.filter(flight=flight_code)
             if passport_number:
-                bookings = Booking.objects.filter(
-                    flight=flight_code, passport_number=passport_number)
-                if not bookings.exists():
-                    return Response({
-                        "detail": f'No bookings found with flight code \'{flight_code}\' and passport number \'{passport_number}\'.'},
-                        status=status.HTTP_404_NOT_FOUND)
-            else:
-                bookings = Booking.objects.filter(flight=flight_code)
-                if not bookings.exists():
-                    return Response({"detail": f'No bookings found with flight code \'{flight_code}\'.'},
-                                    status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(bookings.first()).data, status=status.HTTP_200_OK)
-
-        if passport_number:
-            # Get the specific bookings with the provided passport_number
-            bookings = Booking.objects.filter(passport_number=passport_number)
-            if not bookings.exists():
-                return Response({"detail": f'No bookings found with passport number \'{passport_number}\'.'},
-                                status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(bookings.first()).data, status=status.HTTP_200_OK)
+                try:
+                    bookings = bookings.filter(passport_number=int(passport_number))
+                except ValueError:
+                    return Response({"error": "Passport number must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+            paginator = BookingCursorPagination()
+            page = paginator.paginate_queryset(bookings, request)
+
+            if not page and paginator.position is None:
+                if flight_code and passport_number:
+                    message = f'No bookings found with flight code \'{flight_code}\' and passport number \'{passport_number}\'.'
+                elif flight_code:
+                    message = f'No bookings found with flight code \'{flight_code}\'.'
+                else:
+                    message = f'No bookings found with passport number \'{passport_number}\'.'
+                return Response({"detail": message}, status=status.HTTP_404_NOT_FOUND)
+
+            return paginator.get_paginated_response(
+                BookingDetailSerializer(page, many=True, fields=fields, expand=expand).data)
 
         # Otherwise get all bookings
-        bookings = Booking.objects.all()
+        bookings = BookingSerializer.select_fields(Booking.objects.all(), fields, expand)
+
+        if wants_stream(request):
+            return stream_queryset(request, bookings, partial(BookingSerializer, fields=fields, expand=expand))
+
         if not bookings.exists():
             return Response(
                 {"detail": "No bookings available."},
                 status=status.HTTP_204_NO_CONTENT)
-        return Response(self.get_serializer(bookings, many=True).data, status=status.HTTP_200_OK)
+        return Response(self.get_serializer(bookings, many=True, fields=fields, expand=expand).data,
+                        status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'], serializer_class=BookingSerializer)
     def create_booking(self, request):
@@ -534,6 +948,9 @@ class BookingViewSet(viewsets.GenericViewSet):
                 - If the booking already exists or the flight is not found:
                     - HTTP status code: 400 (Bad Request)
                     - JSON data: An error message.
+                - If the flight is fully booked:
+                    - HTTP status code: 409 (Conflict)
+                    - JSON data: An error message.
         """
 
         booking_ref = get_param('booking_ref', request)
@@ -562,10 +979,13 @@ class BookingViewSet(viewsets.GenericViewSet):
                     status=status.HTTP_400_BAD_REQUEST)
 
         # Save the booking
-        booking = Booking.objects.create(
-            passport_number=passport_number,
-            flight=flight
-        )
+        try:
+            booking = Booking.objects.create(
+                passport_number=passport_number,
+                flight=flight
+            )
+        except NoSeatsAvailable as error:
+            return Response({"error": str(error)}, status=status.HTTP_409_CONFLICT)
 
         serializer = self.get_serializer(booking)
 
@@ -573,6 +993,58 @@ class BookingViewSet(viewsets.GenericViewSet):
         # but we return the whole booking object
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], serializer_class=BookingSerializer)
+    def create_bookings(self, request):
+        """
+        This API endpoint books a group of passengers in one request.
+
+        The passengers of each flight are booked together or not at all, and
+        every booking is checked, stored and queued for its airline in one
+        transaction.
+
+        Parameters:
+            request (Request): The Django REST framework request object.
+                Request body (JSON): A list of bookings, each with:
+                - flight: The unique code of the flight to book.
+                - passport_number: The passport number of the passenger.
+
+        Returns:
+            Response: A Django REST framework response object.
+                Response data format:
+                - If every booking is created:
+                    - HTTP status code: 201 (Created)
+                - If some bookings are not created:
+                    - HTTP status code: 207 (Multi-Status)
+                - Either way, JSON data: The number of bookings created and a result for each entry,
+                  with the status code POST /api/bookings/ would have answered with and
+                  either the booking or an error message.
+                - If the body is not a list or has too many entries:
+                    - HTTP status code: 400 (Bad Request)
+                    - JSON data: An error message.
+        """
+
+        entries = request.data
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "A list of bookings is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(entries) > BULK_BOOKING_LIMIT:
+            return Response({"error": f'At most {BULK_BOOKING_LIMIT} bookings can be made at once'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = book_many(entries)
+
+        # Bulk inserts and updates send no signals, so drop the cached bookings and seat counts here
+        invalidate('booking', 'flight')
+
+        created = 0
+        for result in results:
+            if 'booking' in result:
+                result['booking'] = self.get_serializer(result['booking']).data
+                created += 1
+
+        return Response({'created': created, 'results': results},
+                        status=status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS)
+
     @action(detail=False, methods=['patch'], serializer_class=BookingSerializer)
     def modify_booking(self, request):
         """
@@ -629,7 +1101,7 @@ class BookingViewSet(viewsets.GenericViewSet):
                 - If the booking is deleted successfully:
                     - HTTP status code: 200 (OK)
                     - JSON data: A message stating that the booking was deleted.
-                - If the booking or the flight does not exist:
+                - If the booking does not exist:
                     - HTTP status code: 404 (Not Found)
                     - JSON data: An error message.
         """
@@ -644,25 +1116,7 @@ class BookingViewSet(viewsets.GenericViewSet):
         if not booking:
             return Response({"error": f'Booking \'{booking_ref}\' not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Use the flight airline to get flight code and its IP address and post to the flight API
-        flight_code = booking.flight.flight_code
-        flight = Flight.objects.filter(flight=flight_code).first()
-        if not flight:
-            return Response({"error": f'Flight \'{flight_code}\' not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Get the airline IP address
-        flight_ip_address = flight.airline.ip
-
-        url = f'http://{flight_ip_address}/api/bookings/?booking_ref={booking_ref}'
-
-        # Make the request data
-        data = {
-            'booking_ref': booking_ref
-        }
-
-        # Make the request
-        requests.delete(url, data=data, timeout=5)
-
+        # Deleting also queues the cancellation for the airline, which run_outbox sends
         booking.delete()
 
         return Response({"detail": f'Booking \'{booking_ref}\' deleted'}, status=status.HTTP_200_OK)
@@ -675,6 +1129,8 @@ class CityViewSet(viewsets.GenericViewSet):
     serializer_class = CitySerializer
 
     @action(detail=False, methods=['get'], serializer_class=CitySerializer)
+    @conditional_response('city')
+    @cache_response('city')
     def get_cities(self, request):
         """
         This API endpoint retrieves a list of all cities or specific cities based on the provided city name or country name.
@@ -685,6 +1141,8 @@ class CityViewSet(viewsets.GenericViewSet):
                 - id: The ID of the city to be retrieved.
                 - name: The name of the city to be retrieved.
                 - country: The name of the country whose cities are to be retrieved.
+                - stream: (optional) If 1, stream the list of cities as a JSON array.
+                  Sending 'Accept: application/x-ndjson' streams it as one city per line.
 
         Returns:
             Response: A Django REST framework response object.
@@ -707,27 +1165,33 @@ class CityViewSet(viewsets.GenericViewSet):
         
         if ident:
             # Get the specific city with the provided city ID
-            cities = City.objects.filter(id=ident)
-            if not cities.exists():
+            result = City.objects.filter(id=ident).first()
+            if result is None:
                 return Response({"detail": f'City with ID \'{ident}\' not found.'}, status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(cities.first()).data, status=status.HTTP_200_OK)
+            return Response(self.get_serializer(result).data, status=status.HTTP_200_OK)
         
         if city:
             # Get the specific city with the provided city name
-            cities = City.objects.filter(name=city)
-            if not cities.exists():
+            result = City.objects.filter(name=city).first()
+            if result is None:
                 return Response({"detail": f'City \'{city}\' not found.'}, status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(cities.first()).data, status=status.HTTP_200_OK)
+            return Response(self.get_serializer(result).data, status=status.HTTP_200_OK)
 
         if country:
             # Get the specific cities with the provided country name
             cities = City.objects.filter(country=country)
+            if wants_stream(request):
+                return stream_queryset(request, cities, CitySerializer)
             if not cities.exists():
                 return Response({"detail": f'No cities found in \'{country}\'.'}, status=status.HTTP_404_NOT_FOUND)
             return Response(self.get_serializer(cities, many=True).data, status=status.HTTP_200_OK)
 
         # Otherwise get all cities
         cities = City.objects.all()
+
+        if wants_stream(request):
+            return stream_queryset(request, cities, CitySerializer)
+
         if not cities.exists():
             return Response(
                 {"detail": "No cities available."},
@@ -743,6 +1207,8 @@ class CountryViewSet(viewsets.GenericViewSet):
     serializer_class = CountrySerializer
 
     @action(detail=False, methods=['get'], serializer_class=CountrySerializer)
+    @conditional_response('country')
+    @cache_response('country')
     def get_countries(self, request):
         """
         This API endpoint retrieves a list of all countries or specific countries based on the provided country name or continent name.
@@ -752,6 +1218,8 @@ class CountryViewSet(viewsets.GenericViewSet):
                 Query parameters:
                 - name: The name of the country to be retrieved.
                 - continent: The name of the continent whose countries are to be retrieved.
+                - stream: (optional) If 1, stream the list of countries as a JSON array.
+                  Sending 'Accept: application/x-ndjson' streams it as one country per line.
 
         Returns:
             Response: A Django REST framework response object.
@@ -773,23 +1241,72 @@ class CountryViewSet(viewsets.GenericViewSet):
 
         if country:
             # Get the specific country with the provided country name
-            countries = Country.objects.filter(name=country)
-            if not countries.exists():
+            result = Country.objects.filter(name=country).first()
+            if result is None:
                 return Response({"detail": f'Country \'{country}\' not found.'}, status=status.HTTP_404_NOT_FOUND)
-            return Response(self.get_serializer(countries.first()).data, status=status.HTTP_200_OK)
+            return Response(self.get_serializer(result).data, status=status.HTTP_200_OK)
 
         if continent:
             # Get the specific countries with the provided continent name
             countries = Country.objects.filter(continent=continent)
+            if wants_stream(request):
+                return stream_queryset(request, countries, CountrySerializer)
             if not countries.exists():
                 return Response({"detail": f'No countries found in \'{continent}\'.'}, status=status.HTTP_404_NOT_FOUND)
             return Response(self.get_serializer(countries, many=True).data, status=status.HTTP_200_OK)
 
         # Otherwise get all countries
         countries = Country.objects.all()
+
+        if wants_stream(request):
+            return stream_queryset(request, countries, CountrySerializer)
+
         if not countries.exists():
             return Response(
                 {"detail": "No countries available."},
                 status=status.HTTP_204_NO_CONTENT)
 
         return Response(self.get_serializer(countries, many=True).data, status=status.HTTP_200_OK)
+
+
+class AutocompleteViewSet(viewsets.GenericViewSet):
+    """This class defines the viewset for the Autocomplete endpoint."""
+
+    queryset = Airport.objects.none()
+
+    @action(detail=False, methods=['get'])
+    def get_suggestions(self, request):
+        """
+        This API endpoint suggests airports, cities and countries whose name starts with the typed text.
+
+        Parameters:
+            request (Request): The Django REST framework request object.
+                Query parameters:
+                - q: (required) The text typed so far. Matching ignores case and accents,
+                  and also matches the start of any later word of a name or an airport ident.
+                - limit: (optional) The maximum number of suggestions, up to 20. Defaults to 10.
+
+        Returns:
+            Response: A Django REST framework response object.
+                Response data format:
+                - If the 'q' parameter is provided:
+                    - HTTP status code: 200 (OK)
+                    - JSON data: A ranked list of suggestions, each with its 'type' (airport, city or country),
+                      'id' (airport ident, city ID or country name), 'name' and 'detail'.
+                - If the 'q' parameter is not provided:
+                    - HTTP status code: 400 (Bad Request)
+                    - JSON data: An error message.
+
+        Example usage:
+            To get suggestions while typing "heath": GET /api/autocomplete/?q=heath
+        """
+
+        query = get_param('q', request)
+
+        if not query or not query.strip():
+            return Response({"error": "Query parameter 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = get_int_param('limit', request, 10, 1, MAX_SUGGESTIONS)
+        suggestions = autocomplete_index.get().search(query, limit=limit)
+
+        return Response(suggestions, status=status.HTTP_200_OK)